@@ -0,0 +1,85 @@
+"""Benchmark many processes adding contacts to the same book at once.
+
+Each writer process adds contacts one at a time, loading and committing
+the book for every contact as separate `contacts add` invocations would.
+The benchmark reports throughput and fails if any write was lost.
+
+Usage: python -m benchmarks.concurrent_writers [--writers N] [--adds N]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from multiprocessing import Process
+from pathlib import Path
+
+
+def writer(json_path, storage_name, writer_id, adds):
+    """Add contacts one at a time, each through a fresh ContactManager"""
+    from contacts.contacts import ContactManager
+    from contacts.storage import open_storage
+
+    sys.stderr = open(os.devnull, 'w')
+    for n in range(adds):
+        data = ContactManager(json_path, open_storage(json_path, storage_name))
+        data.add(args=Namespace(
+            name=f'Writer {writer_id} contact {n}',
+            email=[f'writer{writer_id}.{n}@example.com'],
+            phone=None,
+            tags=['benchmark'],
+        ))
+
+
+def run(writers, adds, storage_name):
+    """Run the benchmark and return a dict of results"""
+    from contacts.storage import open_storage
+
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = Path(directory, 'contacts.json')
+        with open(json_path, 'w+') as f:
+            json.dump([], f)
+
+        processes = [
+            Process(target=writer, args=(json_path, storage_name, i, adds))
+            for i in range(writers)
+        ]
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        stored = open_storage(json_path, storage_name).load()
+        expected = writers * adds
+        return {
+            'storage': storage_name,
+            'writers': writers,
+            'adds_per_writer': adds,
+            'expected': expected,
+            'stored': len(stored),
+            'lost': expected - len(stored),
+            'failed_writers': sum(p.exitcode != 0 for p in processes),
+            'seconds': elapsed,
+            'writes_per_second': expected / elapsed,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=16)
+    parser.add_argument('--adds', type=int, default=25)
+    parser.add_argument('--storage', default='json')
+    args = parser.parse_args()
+
+    result = run(args.writers, args.adds, args.storage)
+    sys.stdout.write(json.dumps(result, indent=2) + '\n')
+    if result['lost'] or result['failed_writers']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Deterministic generator of synthetic address books.
+
+The same size and seed always give the same contacts, so results from
+different commits are measured against identical data. Contacts have
+realistic names, one to three email addresses, one or two phone numbers
+and up to three tags, and are written in no particular order, as an
+imported book would be.
+
+Usage: python -m benchmarks.generate SIZE OUTPUT [--seed N]
+"""
+import argparse
+import random
+import sys
+from uuid import UUID
+
+first_names = (
+    'James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael',
+    'Linda', 'David', 'Elizabeth', 'William', 'Barbara', 'Richard', 'Susan',
+    'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen', 'Wei',
+    'Fatima', 'Aarav', 'Sofia', 'Mateo', 'Chloé', 'Jürgen', 'Olga', 'Kenji',
+    'Amara', 'Liam', 'Noah', 'Emma', 'Olivia', 'Ava', 'Isabella', 'Lucas',
+    'Mia', 'Ethan', 'Zoe', 'Rick', 'Morty', 'Summer', 'Beth', 'Jerry',
+)
+last_names = (
+    'Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller',
+    'Davis', 'Rodriguez', 'Martinez', 'Hernandez', 'Lopez', 'Gonzalez',
+    'Wilson', 'Anderson', 'Thomas', 'Taylor', 'Moore', 'Jackson', 'Martin',
+    'Lee', 'Perez', 'Thompson', 'White', 'Harris', 'Sanchez', 'Clark',
+    'Nguyen', 'Kim', 'Müller', 'Rossi', 'Dubois', 'Kowalski', 'Ivanova',
+    'Tanaka', 'Okafor', 'Singh', 'Chen', "O'Brien", 'Van der Berg',
+)
+domains = (
+    'gmail.com', 'yahoo.com', 'outlook.com', 'example.com', 'acme.com',
+    'plumbus.com', 'citadel.org', 'university.edu', 'fastmail.fm',
+)
+tags = (
+    'family', 'friend', 'work', 'school', 'gym', 'neighbour', 'client',
+    'supplier', 'archived', 'vip', 'book-club', 'football',
+)
+
+
+def contact(rng, n):
+    """Return the nth synthetic contact using the random generator rng"""
+    first = rng.choice(first_names)
+    last = rng.choice(last_names)
+    local = f'{first}.{last}'.lower().replace(' ', '').replace("'", '')
+    emails = [f'{local}{n}@{rng.choice(domains)}']
+    emails += [f'{first[0].lower()}{n}.{k}@{rng.choice(domains)}'
+               for k in range(rng.choice((0, 0, 0, 1, 2)))]
+    phones = [f'07{rng.randrange(10**9):09d}'
+              for _ in range(rng.choice((1, 1, 1, 2)))]
+    return {
+        'name': f'{first} {last}',
+        'email': emails,
+        'phone': phones,
+        'uuid': str(UUID(int=rng.getrandbits(128), version=4)),
+        'tags': rng.sample(tags, rng.choice((0, 0, 1, 1, 2, 3))),
+    }
+
+
+def synthetic_contacts(count, seed=0):
+    """Yield count synthetic contacts, the same ones for the same seed"""
+    rng = random.Random(seed)
+    for n in range(count):
+        yield contact(rng, n)
+
+
+def write_book(path, count, seed=0):
+    """Write a synthetic book of count contacts to path as a json array"""
+    from contacts.export import write_export
+
+    with open(path, 'w') as f:
+        write_export(synthetic_contacts(count, seed), f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('size', type=int)
+    parser.add_argument('output')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    write_book(args.output, args.size, args.seed)
+    sys.stderr.write(f'wrote {args.size} contacts to {args.output}\n')
+
+
+if __name__ == '__main__':
+    main()
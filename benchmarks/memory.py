@@ -0,0 +1,94 @@
+"""Benchmark the memory used to hold a book in each representation.
+
+For each book size and representation a fresh process generates synthetic
+contacts one at a time, keeps them as list-of-dicts (as commands load
+them), a list of Contact records (as the server holds them, see
+contacts.server) or a ContactTable, and reports the growth of its resident
+set size.
+
+Usage: python -m benchmarks.memory [--sizes 100000 1000000]
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+representations = ('dicts', 'records', 'table')
+
+tags = ('family', 'work', 'friend', 'plumbus', 'archived')
+
+
+def synthetic_contacts(count):
+    """Yield count contacts shaped like real ones, with fresh strings"""
+    from uuid import uuid4
+
+    for n in range(count):
+        yield {
+            'name': f'Person {n:07d} Smith',
+            'email': [f'person.{n}@example.com'],
+            'phone': [f'07{n:09d}'],
+            'uuid': str(uuid4()),
+            'tags': [tags[n % len(tags)]] if n % 3 else [],
+        }
+
+
+def rss_bytes():
+    """Return the resident set size of this process"""
+    import os
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(representation, count):
+    """Return the bytes of RSS used to hold count contacts"""
+    from contacts.record import ContactTable, compact
+
+    before = rss_bytes()
+    contacts = synthetic_contacts(count)
+    if representation == 'dicts':
+        book = list(contacts)
+    elif representation == 'records':
+        book = [compact(contact) for contact in contacts]
+    else:
+        book = ContactTable(contacts)
+    used = rss_bytes() - before
+    assert len(book) == count
+    return used
+
+
+def run(sizes):
+    """Run the benchmark and return a dict of results"""
+    results = {}
+    for count in sizes:
+        results[count] = {}
+        for representation in representations:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.memory',
+                 '--measure', representation, str(count)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            used = int(output)
+            results[count][representation] = {
+                'rss_mb': round(used / 2**20, 1),
+                'bytes_per_contact': round(used / count),
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[100000, 1000000])
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        representation, count = args.measure
+        sys.stdout.write(f'{measure(representation, int(count))}\n')
+        return
+    sys.stdout.write(json.dumps(run(args.sizes), indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Benchmark cold start of the contacts command used by completion hooks.
+
+Runs `python -X importtime -m contacts -q <query> get_field email` against
+a small temporary book and accounts import time per module. Fails if a
+module which get_field does not need is imported, or if the median total
+import time exceeds the budget.
+
+Usage: python -m benchmarks.startup [--runs N] [--budget-ms MS]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Modules only needed by other subcommands, which get_field must not import
+forbidden_modules = ('tabulate', 'asyncio', 'subprocess', 'uuid', 'tempfile',
+                     'contacts.sync', 'contacts.editing', 'contacts.importer',
+                     'contacts.export', 'contacts.order')
+
+repo_path = Path(__file__).parent.parent
+example_contacts = repo_path/'tests'/'test_data'/'example_contacts.json'
+
+
+def parse_importtime(stderr):
+    """Return a dict of module name to (self, cumulative) import time in us"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def run_once(env, query):
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'contacts',
+         '-q', query, 'get_field', 'email'],
+        env=env, capture_output=True, text=True, check=True
+    )
+    wall = time.perf_counter() - start
+    return wall, parse_importtime(process.stderr)
+
+
+def run(runs, query):
+    """Run the benchmark and return a dict of results"""
+    with tempfile.TemporaryDirectory() as directory:
+        Path(directory, 'contacts').mkdir()
+        shutil.copyfile(
+            example_contacts, Path(directory, 'contacts', 'contacts.json')
+        )
+        env = dict(os.environ, XDG_CONFIG_HOME=directory,
+                   EDITOR=os.environ.get('EDITOR', 'vi'))
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [str(repo_path), env.get('PYTHONPATH')])
+        )
+        # The first run writes the query index, later runs only read it
+        run_once(env, query)
+        walls, import_us, imported = [], [], set()
+        for _ in range(runs):
+            wall, times = run_once(env, query)
+            walls.append(wall)
+            import_us.append(sum(self_us for self_us, _ in times.values()))
+            imported |= set(times)
+
+    contacts_modules = {
+        name: cumulative for name, (_, cumulative) in times.items()
+        if name == 'contacts' or name.startswith('contacts.')
+    }
+    return {
+        'runs': runs,
+        'median_wall_ms': statistics.median(walls) * 1000,
+        'median_import_ms': statistics.median(import_us) / 1000,
+        'contacts_modules_cumulative_us': contacts_modules,
+        'forbidden_imported': sorted(
+            name for name in imported if name in forbidden_modules
+            or name.split('.')[0] in forbidden_modules
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget-ms', type=float, default=60.0)
+    parser.add_argument('--query', default='rick')
+    args = parser.parse_args()
+
+    result = run(args.runs, args.query)
+    result['budget_ms'] = args.budget_ms
+    sys.stdout.write(json.dumps(result, indent=2) + '\n')
+    if result['forbidden_imported']:
+        sys.stderr.write(f'get_field imported {result["forbidden_imported"]}\n')
+        sys.exit(1)
+    if result['median_import_ms'] > args.budget_ms:
+        sys.stderr.write('cold start import time is over budget\n')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
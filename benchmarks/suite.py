@@ -0,0 +1,252 @@
+"""Benchmark the main operations against synthetic books of several sizes.
+
+Books are made by benchmarks.generate, so the same sizes and seed give the
+same data on every commit. Each operation runs in a fresh process against
+a fresh copy of the book, stored and with its cache and indexes written by
+an earlier command as they would be in use, and reports its wall time and
+the peak resident set size of the process. Results are written as json;
+given the results of another commit, operations which got slower by more
+than the threshold are reported and the command fails.
+
+Usage: python -m benchmarks.suite [--sizes 10000 100000] [--output FILE]
+                                  [--compare OLD.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .generate import synthetic_contacts, write_book
+from .startup import repo_path
+
+operations = (
+    'read_json', 'load', 'load_cached', 'sort', 'query_hit', 'query_miss',
+    'scan_hit', 'scan_miss', 'show', 'export', 'add_overwrite', 'delete',
+)
+
+hit_query = 'smith'
+miss_query = 'zzqxj'
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process"""
+    import resource
+
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(operation, json_path, storage_name, seed):
+    """Run one operation on the book at json_path and return its wall time
+    in seconds
+    """
+    from argparse import Namespace
+
+    from contacts.contacts import ContactManager
+    from contacts.storage import open_storage, read_json, sort_contacts
+
+    def manager():
+        return ContactManager(json_path, open_storage(json_path, storage_name))
+
+    sys.stderr = open(os.devnull, 'w')
+    if operation == 'sort':
+        # Sorting as loading an unsorted book would, without the read
+        contacts = read_json(json_path)
+        random.Random(seed).shuffle(contacts)
+        start = time.perf_counter()
+        sort_contacts(contacts)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    if operation == 'read_json':
+        read_json(json_path)
+    elif operation == 'load':
+        data = manager()
+        data.storage.cache.invalidate()
+        data.contacts
+    elif operation == 'load_cached':
+        manager().contacts
+    elif operation == 'query_hit':
+        assert manager().query(hit_query)
+    elif operation == 'query_miss':
+        assert not manager().query(miss_query)
+    elif operation == 'scan_hit':
+        assert manager().query(hit_query, partial=True)
+    elif operation == 'scan_miss':
+        assert not manager().query(miss_query, partial=True)
+    elif operation in ('show', 'export'):
+        data = manager()
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                if operation == 'show':
+                    data.show(data.query(None), Namespace(limit=100))
+                else:
+                    data.export(data.query(None), Namespace(format='json'))
+            finally:
+                sys.stdout = stdout
+    elif operation == 'add_overwrite':
+        manager().add(args=Namespace(
+            name='Benchmark Contact', email=['benchmark@example.com'],
+            phone=['07000000000'], tags=['benchmark'],
+        ))
+    elif operation == 'delete':
+        # One contact, found by uuid through the index
+        uuid = next(synthetic_contacts(1, seed))['uuid']
+        data = manager()
+        data.delete(data.query(uuid), Namespace(
+            yes=True, backup=Path(json_path).parent/'deleted.ndjson'
+        ))
+    else:
+        raise ValueError(f'Unknown operation {operation}')
+    return time.perf_counter() - start
+
+
+def warm(json_path, storage_name):
+    """Store the book as the command does and write its cache and query
+    index, as querying it often enough to be indexed would
+    """
+    from contacts.contacts import ContactManager
+    from contacts.index import scans_before_index
+    from contacts.storage import open_storage
+
+    sys.stderr = open(os.devnull, 'w')
+    data = ContactManager(json_path, open_storage(json_path, storage_name))
+    data.compact()
+    for query in range(scans_before_index + 1):
+        data.query(hit_query)
+
+
+def run_measure(book, operation, storage_name, seed):
+    """Return the time and peak memory of operation on a copy of book"""
+    with tempfile.TemporaryDirectory() as directory:
+        Path(directory, 'contacts').mkdir()
+        json_path = Path(directory, 'contacts', 'contacts.json')
+        shutil.copyfile(book, json_path)
+        env = dict(os.environ, XDG_CONFIG_HOME=directory,
+                   EDITOR=os.environ.get('EDITOR', 'vi'))
+        env['PYTHONPATH'] = os.pathsep.join(
+            filter(None, [str(repo_path), env.get('PYTHONPATH')])
+        )
+        command = [sys.executable, '-m', 'benchmarks.suite',
+                   '--storage', storage_name, '--seed', str(seed)]
+        subprocess.run(command + ['--warm', str(json_path)], env=env,
+                       check=True)
+        output = subprocess.run(
+            command + ['--measure', operation, str(json_path)],
+            env=env, capture_output=True, text=True, check=True
+        ).stdout
+    return json.loads(output)
+
+
+def run(sizes, repeats, storage_name, seed, data_dir):
+    """Run the benchmark and return a dict of results"""
+    results = {}
+    for size in sizes:
+        book = Path(data_dir, f'book-{size}-{seed}.json')
+        if not book.exists():
+            write_book(book, size, seed)
+        results[str(size)] = {}
+        for operation in operations:
+            runs = [run_measure(book, operation, storage_name, seed)
+                    for _ in range(repeats)]
+            results[str(size)][operation] = {
+                'median_s': statistics.median(run['seconds'] for run in runs),
+                'min_s': min(run['seconds'] for run in runs),
+                'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=repo_path,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(old, new, threshold):
+    """Return a list of descriptions of results in new which are worse
+    than those in old by more than a factor of threshold
+    """
+    found = []
+    for size, results in new['results'].items():
+        for operation, result in results.items():
+            before = old['results'].get(size, {}).get(operation)
+            if before is None:
+                continue
+            for metric in ('median_s', 'peak_rss_mb'):
+                if result[metric] > before[metric] * threshold:
+                    found.append(
+                        f'{operation} on {size} contacts: {metric} '
+                        f'{before[metric]:.4g} -> {result[metric]:.4g}'
+                    )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000])
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--storage', default='json')
+    parser.add_argument('--data-dir', default=tempfile.gettempdir(),
+                        help='where generated books are kept between runs')
+    parser.add_argument('--output', help='file to write results to')
+    parser.add_argument('--compare', help='results of an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    parser.add_argument('--warm', help=argparse.SUPPRESS)
+    parser.add_argument('--measure', nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.warm:
+        warm(args.warm, args.storage)
+        return
+    if args.measure:
+        operation, json_path = args.measure
+        seconds = measure(operation, json_path, args.storage, args.seed)
+        sys.stdout.write(json.dumps(
+            {'seconds': seconds, 'peak_rss_mb': peak_rss_mb()}
+        ) + '\n')
+        return
+
+    result = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'storage': args.storage,
+        'seed': args.seed,
+        'repeats': args.repeats,
+        'results': run(args.sizes, args.repeats, args.storage, args.seed,
+                       args.data_dir),
+    }
+    output = json.dumps(result, indent=2) + '\n'
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        sys.stdout.write(output)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            old = json.load(f)
+        found = regressions(old, result, args.threshold)
+        for regression in found:
+            sys.stderr.write(f'regression: {regression}\n')
+        if found:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Benchmark syncing a synthetic book with the local stand-in server.
+
+The book is first sent in full to an empty server, then a few contacts
+are changed on each side and synced, then synced again with nothing
+changed. Each sync is timed with the number of requests it made, so the
+incremental syncs can be compared with the full round trip.
+
+Usage: python -m benchmarks.sync [--size 10000] [--changes 100]
+                                 [--connections 4] [--depth 16]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from pathlib import Path
+
+from .generate import write_book
+
+
+def timed_sync(json_path, url, args):
+    """Sync the book at json_path and return its wall time in seconds"""
+    from contacts.contacts import ContactManager
+
+    start = time.perf_counter()
+    manager = ContactManager(json_path)
+    manager.sync(args=Namespace(
+        url=url, prefer='server', full=False, connections=args.connections,
+        depth=args.depth, backup=os.devnull,
+    ))
+    return time.perf_counter() - start
+
+
+def change_local(json_path, count, rng):
+    """Change the tags of count contacts of the book at json_path"""
+    from contacts.contacts import ContactManager
+
+    manager = ContactManager(json_path)
+    for contact in rng.sample(manager.contacts, count):
+        manager.replace(manager.position(contact),
+                        dict(contact, tags=['benchmark']))
+    manager.overwrite()
+
+
+def change_remote(server, count, rng):
+    """Change the phone numbers of count contacts on the server"""
+    for uuid in rng.sample(list(server.records), count):
+        contact = json.loads(server.records[uuid][1])
+        contact['phone'] = ['07000000000']
+        server.store(uuid, json.dumps(contact).encode())
+
+
+def run(size, changes, args):
+    """Run the benchmark and return a dict of results"""
+    from contacts.syncserver import SyncServer, running
+
+    rng = random.Random(0)
+    server = SyncServer()
+    results = {'size': size, 'changes': changes,
+               'connections': args.connections, 'depth': args.depth}
+    stderr = sys.stderr
+    with tempfile.TemporaryDirectory() as directory, running(server) as url:
+        json_path = Path(directory, 'contacts.json')
+        write_book(json_path, size)
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            for name in ('full', 'incremental', 'unchanged'):
+                if name == 'incremental':
+                    change_local(json_path, changes, rng)
+                    change_remote(server, changes, rng)
+                requests = server.requests
+                seconds = timed_sync(json_path, url, args)
+                results[name] = {
+                    'seconds': seconds,
+                    'requests': server.requests - requests,
+                }
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        results['stored'] = len(server.records)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--changes', type=int, default=100)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--depth', type=int, default=16)
+    args = parser.parse_args()
+
+    result = run(args.size, args.changes, args)
+    sys.stdout.write(json.dumps(result, indent=2) + '\n')
+    if result['stored'] != args.size:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,58 @@
 """Main module for contacts package"""
 import sys
+from . import books, profile, server
 from .cli import CLI
-from .contacts import ContactManager
+from .contacts import (
+    ContactManager, projected_subcommands, read_only_subcommands,
+    unqueried_subcommands
+)
 from .conf import config
 
 
 def main():
-    """Main procedure"""
-    cli = CLI()
+    """Main procedure, profiled if asked to be, see contacts.profile"""
+    profile.start(sys.argv[1:], CLI.value_options)
+    try:
+        run()
+    finally:
+        profile.report()
+
+
+def run():
+    """Parse the command line and run the subcommand"""
+    with profile.phase('cli'):
+        cli = CLI()
     args = cli.args
-    contact_manager = ContactManager(config['working_data'])
-    indices = contact_manager.query(args.query_str)
 
     if args.subcommand is None:
         cli.parser.print_help()
         sys.exit()
 
-    subcommand_callable = getattr(contact_manager, args.subcommand)
+    # A server holds a single book
+    if server.is_remote(args) and args.book is None \
+            and len(books.book_paths()) == 1:
+        response = server.request(config['socket_path'], args)
+        if response is not None:
+            sys.stdout.write(response['stdout'])
+            sys.stderr.write(response['stderr'])
+            sys.exit(response['status'])
+
+    # import is a keyword, so the method has another name
+    method = {'import': 'import_json'}.get(args.subcommand, args.subcommand)
+    paths = books.selected(args)
+    if len(paths) > 1:
+        books.run(args, method, paths)
+        return
+    contact_manager = ContactManager(paths[0])
+    indices = None
+    # Without a query, projected subcommands read every contact themselves
+    unqueried = args.subcommand in projected_subcommands \
+        and args.query_str is None
+    if args.subcommand not in unqueried_subcommands and not unqueried:
+        indices = contact_manager.find(
+            args, partial=args.subcommand in read_only_subcommands
+        )
+    subcommand_callable = getattr(contact_manager, method)
     subcommand_callable(indices=indices, args=args)
 
 
@@ -0,0 +1,166 @@
+"""Append-only archive of deleted contacts.
+
+Deleted contacts are appended to an ndjson file, one contact per line, so
+exiling contacts costs time proportional to the number deleted rather than
+to the size of the archive. The file can be imported back as it is.
+
+An index next to the archive maps each uuid to the offset of the line
+holding its latest deletion. The archive is only ever appended to, so the
+index records how much of it has been indexed and catches up by reading
+the lines added since.
+
+Archives used to be a json array of contacts, by default in
+contacts_deleted.json. Such an archive is converted to ndjson the first
+time it is used, and an archive at a .ndjson path which does not exist
+yet is converted from the .json file of the same name, so that contacts
+deleted before can still be restored. The legacy file is left as it was.
+"""
+import os
+import json
+from pathlib import Path
+
+from .storage import atomic_write, locked
+
+
+def archive_index_path(archive_path):
+    """Return the path of the index kept next to an archive"""
+    return Path(f'{archive_path}.idx')
+
+
+def read_legacy(path):
+    """Return the contacts of an archive written as a json array, or None
+    if there is no file at path or it is not one.
+
+    Raise ValueError if the file starts an array which cannot be read, as
+    appending lines to it would lose the contacts it holds.
+    """
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        if not f.read(64).lstrip().startswith(b'['):
+            return None
+        f.seek(0)
+        try:
+            contacts = json.load(f)
+        except ValueError as error:
+            raise ValueError(
+                f'{path} is neither ndjson nor a json array of contacts: '
+                f'{error}'
+            ) from None
+    if not isinstance(contacts, list):
+        raise ValueError(f'{path} is not a json array of contacts')
+    return contacts
+
+
+class DeletedArchive:
+    """Deleted contacts in an append-only ndjson file"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = f'{path}.lock'
+        self.index_path = archive_index_path(path)
+        self.migrated = False
+
+    def __repr__(self):
+        return f'DeletedArchive({self.path})'
+
+    def migrate(self):
+        """Convert a legacy json array archive to ndjson, once per archive
+        object. See the module docstring.
+        """
+        if self.migrated:
+            return
+        self.migrated = True
+        legacy = self.path
+        if self.path.suffix == '.ndjson' and not self.path.exists():
+            legacy = self.path.with_suffix('.json')
+        if not legacy.exists():
+            return
+        with locked(self.lock_path):
+            if legacy != self.path and self.path.exists():
+                # Converted by another process meanwhile
+                return
+            contacts = read_legacy(legacy)
+            if contacts is None:
+                return
+            atomic_write(
+                self.path,
+                lambda f: f.write(
+                    ''.join(json.dumps(contact) + '\n' for contact in contacts)
+                )
+            )
+            # The index has offsets in the old file
+            try:
+                os.remove(self.index_path)
+            except FileNotFoundError:
+                pass
+
+    def append(self, contacts):
+        """Append contacts to the archive, durably"""
+        lines = ''.join(json.dumps(contact) + '\n' for contact in contacts)
+        self.migrate()
+        with locked(self.lock_path):
+            with open(self.path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def read_index(self):
+        """Return the saved (size, offsets) of the index, or an empty one"""
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            return index['size'], index['offsets']
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0, {}
+
+    def index(self):
+        """Return a dict mapping uuids to the offset of their latest line.
+
+        Lines appended since the index was last saved are read and the
+        index is saved again. A partially written last line is skipped.
+        """
+        self.migrate()
+        with locked(self.lock_path, shared=True):
+            size, offsets = self.read_index()
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return {}
+            with f:
+                if os.fstat(f.fileno()).st_size < size:
+                    # The archive was replaced, index it from the start
+                    size, offsets = 0, {}
+                f.seek(size)
+                indexed = size
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        offsets[json.loads(line)['uuid']] = indexed
+                    except (ValueError, KeyError, TypeError):
+                        pass
+                    indexed += len(line)
+        if indexed != size:
+            atomic_write(
+                self.index_path,
+                lambda f: f.write(
+                    json.dumps({'size': indexed, 'offsets': offsets})
+                ),
+                sync=False
+            )
+        return offsets
+
+    def get(self, uuids):
+        """Return the latest archived copy of each uuid found, by uuid"""
+        offsets = self.index()
+        uuids = [uuid for uuid in uuids if uuid in offsets]
+        found = {}
+        if uuids:
+            with open(self.path, 'rb') as f:
+                for uuid in uuids:
+                    f.seek(offsets[uuid])
+                    found[uuid] = json.loads(f.readline())
+        return found
@@ -0,0 +1,245 @@
+"""Batches of operations applied with one load and one write.
+
+A batch is read as json lines, one operation per line:
+
+    {"op": "add", "name": "Rick Sanchez", "email": ["rick@citadel.com"]}
+    {"op": "modify", "uuid": "ca0617ca-...", "phone": ["07007937005"]}
+    {"op": "modify", "query": "tag:=work", "tags": ["work", "old"]}
+    {"op": "delete", "query": "name:=\\"Mr. Meeseeks\\""}
+    {"op": "get_field", "uuid": ["ca0617ca-...", "ca0619dc-..."],
+     "field": "email"}
+
+modify, delete and get_field act on the contacts with a uuid, or a list of
+uuids, or matching a query as given to -q. Every uuid must be a contact.
+add takes the fields of the new contact, which needs a name, and modify
+the fields to change; lists may also be strings separated by ';'. Any
+operation may carry an "id", returned with its result.
+
+Operations are applied in turn to the contacts in memory, each seeing the
+changes of those before it, and one json result is written per operation.
+If every operation succeeds the contacts are written once at the end,
+and deleted contacts archived as delete does. If one fails, the batch
+stops there and nothing is written.
+
+Queries are answered from the trigram and field indexes, which follow the
+changes of the batch, and their candidates found by uuid, so a query
+costs the same after changes as before. Without indexes, as with sqlite
+storage or an index not built yet, each query scans the contacts, until
+scans_before_index queries were scanned and the indexes are built in
+memory for the rest of the batch.
+"""
+import json
+
+from .importer import list_fields, normalize, normalize_list
+
+operations = ('add', 'modify', 'delete', 'get_field')
+
+# Fields of the contacts get_field may return
+fields = ('name', 'uuid', 'email', 'phone', 'tags')
+
+# Keys each operation may have besides op and id
+allowed_keys = {
+    'add': {'name', 'uuid', *list_fields},
+    'modify': {'uuid', 'query', 'name', *list_fields},
+    'delete': {'uuid', 'query'},
+    'get_field': {'uuid', 'query', 'field'},
+}
+
+
+class BatchError(ValueError):
+    """An operation of a batch which cannot be applied"""
+
+
+def parse_operation(line):
+    """Return the operation decoded from a line of a batch, raising
+    BatchError if it is not one
+    """
+    try:
+        operation = json.loads(line)
+    except ValueError as error:
+        raise BatchError(f'invalid json: {error}') from None
+    if not isinstance(operation, dict):
+        raise BatchError('an operation must be a json object')
+    op = operation.get('op')
+    if op not in operations:
+        raise BatchError(f'op must be one of {", ".join(operations)}')
+    unknown = set(operation) - allowed_keys[op] - {'op', 'id'}
+    if unknown:
+        raise BatchError(f'unknown keys for {op}: {", ".join(sorted(unknown))}')
+    if op != 'add' and ('uuid' in operation) == ('query' in operation):
+        raise BatchError(f'{op} needs either a uuid or a query')
+    return operation
+
+
+def changed_fields(operation):
+    """Return the fields a modify operation sets, validated"""
+    changes = {}
+    if 'name' in operation:
+        name = operation['name']
+        if not isinstance(name, str) or not name.strip():
+            raise BatchError('name must be a non-empty string')
+        changes['name'] = name.strip()
+    for field in list_fields:
+        if field in operation:
+            values = normalize_list(operation[field])
+            if values is None:
+                raise BatchError(f'{field} must be a list of strings')
+            changes[field] = values
+    if not changes:
+        raise BatchError('modify needs a field to change')
+    return changes
+
+
+class Batch:
+    """Applies the operations of a batch to the contacts of a manager,
+    which is left to write them
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        # Contacts by uuid, kept up to date as operations are applied
+        self.by_uuid = {
+            contact['uuid']: contact for contact in manager.contacts
+        }
+        self.deleted = []
+        # Number of queries answered by scanning every contact
+        self.scans = 0
+
+    def __repr__(self):
+        return f'Batch({self.manager})'
+
+    def targets(self, operation):
+        """Return the contacts an operation acts on"""
+        from .query import QueryError, is_structured, parse
+
+        if 'uuid' in operation:
+            uuids = operation['uuid']
+            if isinstance(uuids, str):
+                uuids = [uuids]
+            if not isinstance(uuids, list) \
+                    or not all(isinstance(uuid, str) for uuid in uuids):
+                raise BatchError('uuid must be a string or list of strings')
+            missing = [uuid for uuid in uuids if uuid not in self.by_uuid]
+            if missing:
+                raise BatchError(f'no contact with uuid {missing[0]}')
+            return [self.by_uuid[uuid] for uuid in dict.fromkeys(uuids)]
+        query = operation['query']
+        if not isinstance(query, str):
+            raise BatchError('query must be a string')
+        if not is_structured(query):
+            return self.matching(query.lower(), None)
+        # query_language exits on invalid queries
+        try:
+            parsed = parse(query)
+        except QueryError as error:
+            raise BatchError(f'invalid query: {error}') from None
+        return self.matching(query, parsed)
+
+    def open_indexes(self):
+        """Build the trigram and field indexes of the contacts in memory
+        once scanning them was repeated enough, unless they are open
+        """
+        from .index import (
+            FieldIndex, TrigramIndex, field_index_path, index_path,
+            scans_before_index
+        )
+
+        manager = self.manager
+        if self.scans < scans_before_index or manager.partial:
+            return
+        if manager._index is None:
+            manager._index = TrigramIndex.build(
+                index_path(manager.json_path), None, manager.contacts
+            )
+        if manager._field_index is None:
+            manager._field_index = FieldIndex.build(
+                field_index_path(manager.json_path), None, manager.contacts
+            )
+
+    def matching(self, query, parsed):
+        """Return the contacts matching a query, lowercased if it is plain,
+        or parsed if it uses the query language, in the order of the
+        contacts list.
+
+        ContactManager.query finds the indices of candidates in a map of
+        positions which every contact moved by the batch invalidates, so
+        they are found by uuid and their positions by bisecting instead.
+        """
+        from .index import searchable_values
+
+        manager = self.manager
+        self.open_indexes()
+        if parsed is not None:
+            candidates = parsed.candidates(manager)
+            matches = parsed.matches
+        else:
+            index = manager.index
+            candidates = None if index is None else index.candidates(query)
+
+            def matches(contact):
+                return any(query in value.lower()
+                           for value in searchable_values(contact))
+        if candidates is None:
+            self.scans += 1
+            return [contact for contact in manager.contacts
+                    if matches(contact)]
+        found = [self.by_uuid[uuid] for uuid in candidates
+                 if uuid in self.by_uuid]
+        return sorted(filter(matches, found), key=manager.position)
+
+    def apply(self, operation):
+        """Apply an operation, returning its result"""
+        op = operation['op']
+        if op == 'add':
+            return {'uuids': [self.add(operation)]}
+        targets = self.targets(operation)
+        if op == 'get_field':
+            field = operation.get('field')
+            if field not in fields:
+                raise BatchError(f'field must be one of {", ".join(fields)}')
+            return {'values': [contact.get(field) for contact in targets]}
+        if op == 'modify':
+            changes = changed_fields(operation)
+            for contact in targets:
+                modified = dict(contact, **changes)
+                self.manager.replace(self.manager.position(contact),
+                                     modified)
+                self.by_uuid[contact['uuid']] = modified
+        else:
+            for contact in targets:
+                self.manager.remove(self.manager.position(contact))
+                del self.by_uuid[contact['uuid']]
+                self.deleted.append(contact)
+        return {'uuids': [contact['uuid'] for contact in targets]}
+
+    def add(self, operation):
+        """Add the contact of an add operation, returning its uuid"""
+        from .contacts import new_uuid
+
+        contact = normalize(operation)
+        if contact is None:
+            raise BatchError('a contact needs a name, and lists of strings '
+                             'for email, phone and tags')
+        if not contact['uuid']:
+            contact['uuid'] = new_uuid()
+        elif contact['uuid'] in self.by_uuid:
+            raise BatchError(f'{contact["uuid"]} is already a contact')
+        self.manager.insert(contact)
+        self.by_uuid[contact['uuid']] = contact
+        return contact['uuid']
+
+    def run(self, line_number, line):
+        """Decode and apply the operation on a line, returning its result
+        with ok false and an error if it failed
+        """
+        result = {'line': line_number}
+        try:
+            operation = parse_operation(line)
+            result['op'] = operation['op']
+            if 'id' in operation:
+                result['id'] = operation['id']
+            result['ok'] = True
+            result.update(self.apply(operation))
+        except BatchError as error:
+            result.update(ok=False, error=str(error))
+        return result
@@ -0,0 +1,177 @@
+"""Several address books, each kept in its own contacts file.
+
+Books are named in config.json, with paths relative to the contacts
+directory:
+
+    "books": {"personal": "contacts.json", "work": "/srv/directory.json"},
+    "default_book": "personal"
+
+Without books, working_data is the only book. Each book has its own
+storage, indexes and locks, so it is read and written on its own.
+
+show, export and get_field query every book, or those given with -b, in
+a pool of processes, one per book, and merge the matches by name (fuzzy
+matches are interleaved by rank). modify, delete and edit change each
+matching contact in the book it is stored in, so only books with
+matches are written; edit opens an editor for each. lookup finds the
+owners of each value in every book, or those given with -b, through the
+lookup index of each, and merges them by name. Every other subcommand,
+add included, uses one book: the one given with -b, or else the default
+book.
+"""
+import os
+import sys
+from pathlib import Path
+
+from .conf import config, contacts_path
+from .contacts import ContactManager, read_only_subcommands
+
+# Subcommands which change contacts in the books they are found in
+owner_subcommands = ('modify', 'delete', 'edit')
+
+# Subcommands which only read contacts, one value at a time
+lookup_subcommands = ('lookup',)
+
+
+def book_paths():
+    """Return a dict mapping the name of each book to its contacts file"""
+    books = config['books']
+    if not books:
+        return {'contacts': Path(config['working_data'])}
+    return {name: contacts_path/Path(path).expanduser()
+            for name, path in books.items()}
+
+
+def default_book(paths):
+    """Return the name of the book used when none is given"""
+    name = config['default_book']
+    return name if name is not None else next(iter(paths))
+
+
+def selected(args):
+    """Return the paths of the books a command uses, exiting if a book
+    given is unknown or several are given to a single-book subcommand
+    """
+    paths = book_paths()
+    names = getattr(args, 'book', None)
+    for name in names or []:
+        if name not in paths:
+            sys.stderr.write(
+                f'No book named {name}, books are {", ".join(paths)}\n'
+            )
+            sys.exit(1)
+    if args.subcommand in read_only_subcommands + owner_subcommands \
+            + lookup_subcommands:
+        return [paths[name] for name in dict.fromkeys(names or paths)]
+    names = list(dict.fromkeys(names or [default_book(paths)]))
+    if len(names) > 1:
+        sys.stderr.write(f'{args.subcommand} uses one book at a time\n')
+        sys.exit(1)
+    return [paths[names[0]]]
+
+
+def query_book(path, args):
+    """Return the contacts of the book at path matching args, in order"""
+    manager = ContactManager(path)
+    return manager.list_matches(manager.find(args, partial=True))
+
+
+def fan_out(paths, args):
+    """Return the matches in each book, queried in parallel"""
+    jobs = min(len(paths), os.cpu_count() or 1)
+    if jobs <= 1:
+        return [query_book(path, args) for path in paths]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(jobs) as pool:
+        return list(pool.map(query_book, paths, [args] * len(paths)))
+
+
+def merge_matches(matches, args):
+    """Return the matches of several books as one list, by name or, for
+    fuzzy queries, by rank within each book
+    """
+    if getattr(args, 'fuzzy', False) and args.query_str is not None:
+        from itertools import zip_longest
+
+        ranked = [contact for same_rank in zip_longest(*matches)
+                  for contact in same_rank if contact is not None]
+        return ranked[:args.top]
+    from heapq import merge
+    from .storage import sort_key
+
+    return list(merge(*matches, key=sort_key))
+
+
+class BooksView(ContactManager):
+    """The contacts matching a query in several books, which may be shown
+    or exported but not written
+    """
+
+    def __init__(self, paths, contacts):
+        super().__init__(paths[0])
+        self.paths = paths
+        self._contacts = contacts
+        self.partial = True
+
+    def __repr__(self):
+        return f'BooksView({", ".join(map(str, self.paths))})'
+
+    def order(self, by):
+        """Return the indices of every contact in a secondary order, the
+        modification times of every book being read
+        """
+        from .order import ModifiedLog, modified_log_path
+
+        if by == 'modified' and by not in self._orders:
+            times = {}
+            for path in self.paths:
+                times.update(ModifiedLog(modified_log_path(path)).read())
+            keys = [-times.get(contact['uuid'], 0)
+                    for contact in self.contacts]
+            self._orders[by] = sorted(range(len(keys)), key=keys.__getitem__)
+        return super().order(by)
+
+
+class BooksLookup(ContactManager):
+    """The owners of phone numbers and email addresses in several books,
+    which may be looked up but not written
+    """
+
+    def __init__(self, paths):
+        super().__init__(paths[0])
+        self.paths = paths
+        self.managers = [ContactManager(path) for path in paths]
+
+    def __repr__(self):
+        return f'BooksLookup({", ".join(map(str, self.paths))})'
+
+    def owners(self, field, value):
+        """Return the owners of value in every book, merged by name"""
+        from heapq import merge
+        from .storage import sort_key
+
+        return list(merge(
+            *(manager.owners(field, value) for manager in self.managers),
+            key=sort_key
+        ))
+
+
+def run(args, method, paths):
+    """Run a subcommand over several books"""
+    from .profile import phase
+
+    if args.subcommand in read_only_subcommands:
+        with phase('fan_out') as current:
+            view = BooksView(paths, merge_matches(fan_out(paths, args), args))
+            current.records = len(view.contacts)
+        getattr(view, method)(indices=range(len(view.contacts)), args=args)
+        return
+    if args.subcommand in lookup_subcommands:
+        getattr(BooksLookup(paths), method)(args=args)
+        return
+    for path in paths:
+        manager = ContactManager(path)
+        indices = manager.find(args)
+        if indices:
+            getattr(manager, method)(indices=indices, args=args)
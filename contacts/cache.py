@@ -0,0 +1,107 @@
+"""On-disk cache of parsed and sorted contacts.
+
+Decoding json and sorting the result is most of the cost of loading a
+large book. The cache keeps the sorted list in marshal format, tagged
+with the fingerprint (mtime, size and inode) of the stored data it was
+built from, so that read-only runs on an unchanged book skip both.
+"""
+import sys
+import os
+import gc
+import marshal
+from contextlib import contextmanager
+from pathlib import Path
+
+# Hit and miss counts for this process, reported by `contacts cache --info`
+stats = {'hits': 0, 'misses': 0}
+
+# Marshal's format may change between python versions
+cache_version = [1, marshal.version, *sys.version_info[:2]]
+
+
+@contextmanager
+def paused_gc():
+    """Pause the cyclic garbage collector while decoding contacts.
+
+    Decoding creates a large number of small dicts and lists, none of
+    which can form cycles, but each of them counts towards triggering
+    a collection. Collections would otherwise dominate decoding time.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def cache_path(json_path):
+    """Return the path of the cache file kept next to a contacts file"""
+    return Path(f'{json_path}.cache')
+
+
+class ContactCache:
+    """Sorted contacts stored in marshal format with the source fingerprint"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f'ContactCache({self.path})'
+
+    def read(self):
+        """Return the cached (version, source, contacts), or None"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        try:
+            with paused_gc():
+                return marshal.loads(data)
+        except (EOFError, ValueError, TypeError):
+            return None
+
+    def get(self, source):
+        """Return cached contacts if they were built from source, else None"""
+        cached = self.read()
+        if cached is None or cached[:2] != [cache_version, source]:
+            stats['misses'] += 1
+            return None
+        stats['hits'] += 1
+        return cached[2]
+
+    def put(self, source, contacts):
+        """Cache contacts, which must be sorted, as built from source"""
+        from .storage import atomic_write
+
+        if source is None:
+            return
+        # marshal cannot write the contacts.record.Contact records the
+        # server holds
+        contacts = [contact if type(contact) is dict else dict(contact)
+                    for contact in contacts]
+        atomic_write(
+            self.path,
+            lambda f: marshal.dump([cache_version, source, contacts], f),
+            sync=False, mode='wb'
+        )
+
+    def invalidate(self):
+        if self.path.exists():
+            os.remove(self.path)
+
+    def info(self, source):
+        """Return a dict describing the cache, for source as current data"""
+        cached = self.read()
+        info = {
+            'path': str(self.path),
+            'exists': self.path.exists(),
+            'size': self.path.stat().st_size if self.path.exists() else 0,
+            'valid': cached is not None
+                     and cached[:2] == [cache_version, source],
+            'records': len(cached[2]) if cached is not None else 0,
+        }
+        info.update(stats)
+        return info
@@ -7,7 +7,36 @@ from .conf import config
 class CLI():
     """Class to parse command line arguments for contacts program"""
 
-    def __init__(self):
+    # Methods adding the parser for each subcommand. Only the parser for
+    # the subcommand being run is built, unless help is requested or the
+    # subcommand is not recognised.
+    subcommands = {
+        'show': 'gen_show_parser',
+        'export': 'gen_export_parser',
+        'modify': 'gen_modify_parser',
+        'add': 'gen_add_parser',
+        'import': 'gen_import_parser',
+        'edit': 'gen_edit_parser',
+        'get_field': 'gen_get_field_parser',
+        'delete': 'gen_delete_parser',
+        'undelete': 'gen_undelete_parser',
+        'lookup': 'gen_lookup_parser',
+        'dedupe': 'gen_dedupe_parser',
+        'batch': 'gen_batch_parser',
+        'sync': 'gen_sync_parser',
+        'compact': 'gen_compact_parser',
+        'serve': 'gen_serve_parser',
+        'cache': 'gen_cache_parser',
+        'migrate': 'gen_migrate_parser',
+    }
+
+    # Top level options which take a value
+    value_options = ('-q', '--query_str', '--top', '--profile-dump', '-b',
+                     '--book')
+
+    def __init__(self, argv=None):
+        if argv is None:
+            argv = sys.argv[1:]
         self.parser = argparse.ArgumentParser(
             prog='contacts',
             description='A CLI contact manager application',
@@ -19,25 +48,77 @@ class CLI():
             default=None,
             type=str,
             help='Query contacts list by checking for matches to this string' \
-                 '(in any field).'
+                 '(in any field), or with field:value terms combined with ' \
+                 'AND, OR and NOT, e.g. "name:smith* tag:=work NOT ' \
+                 'email:@acme.com".'
+        )
+        self.parser.add_argument(
+            '--fuzzy',
+            action='store_true',
+            help='Rank contacts by how closely their names and emails match ' \
+                 'the query, tolerating typos.'
+        )
+        self.parser.add_argument(
+            '--top',
+            default=10,
+            type=int,
+            help='Number of matches found by --fuzzy (default 10).'
+        )
+        self.parser.add_argument(
+            '-b',
+            '--book',
+            action='append',
+            default=None,
+            help='Address book to use, named in "books" in config.json ' \
+                 '(may be repeated). show, export, get_field, modify, ' \
+                 'delete and edit use every book by default, other ' \
+                 'commands the default book.'
+        )
+        self.parser.add_argument(
+            '--profile',
+            action='store_true',
+            help='Write the time, I/O and memory used by each phase of the ' \
+                 'command to stderr as json (or set CONTACTS_PROFILE=1).'
+        )
+        self.parser.add_argument(
+            '--profile-dump',
+            default=None,
+            metavar='FILE',
+            help='Also write cProfile stats for the command to FILE (or set ' \
+                 'CONTACTS_PROFILE_DUMP).'
         )
         self.subparsers = self.parser.add_subparsers(dest='subcommand')
-        self.gen_show_parser()
-        self.gen_export_parser()
-        self.gen_modify_parser()
-        self.gen_add_parser()
-        self.gen_import_parser()
-        self.gen_edit_parser()
-        self.gen_get_field_parser()
-        self.gen_delete_parser()
+        subcommand = self.find_subcommand(argv)
+        if subcommand in self.subcommands:
+            getattr(self, self.subcommands[subcommand])()
+        else:
+            for gen_parser in self.subcommands.values():
+                getattr(self, gen_parser)()
         try:
-            self.args = self.parser.parse_args()
+            self.args = self.parser.parse_args(argv)
         except argparse.ArgumentError:
             sys.stderr.write('Invalid arguments passed')
             self.parser.print_help()
             sys.exit(1)
 
+    def find_subcommand(self, argv):
+        """Return the subcommand in argv without parsing it.
+
+        Return None if no subcommand is given or help is requested.
+        """
+        args = iter(argv)
+        for arg in args:
+            if arg in ('-h', '--help'):
+                return None
+            if arg in self.value_options:
+                next(args, None)
+            elif not arg.startswith('-'):
+                return arg
+        return None
+
     def gen_show_parser(self):
+        from .order import orders
+
         show_parser = self.subparsers.add_parser(
             'show',
             help='Show a human-readable table of contacts'
@@ -49,11 +130,47 @@ class CLI():
             default=False,
             help='Show contacts with colored output'
         )
+        show_parser.add_argument(
+            '-l',
+            '--limit',
+            type=int,
+            default=None,
+            help='Show at most this many contacts (default fits the terminal).'
+        )
+        show_parser.add_argument(
+            '-o',
+            '--offset',
+            type=int,
+            default=0,
+            help='Skip this many matching contacts before showing any.'
+        )
+        show_parser.add_argument(
+            '--pager',
+            action='store_true',
+            default=False,
+            help='Show every match through $PAGER (default less).'
+        )
+        show_parser.add_argument(
+            '--tabulate',
+            action='store_true',
+            default=False,
+            help='Render the whole table with tabulate, as before.'
+        )
+        show_parser.add_argument(
+            '--order',
+            choices=orders,
+            default='name',
+            help='Order contacts by name (default), first tag or most '
+                 'recently modified.'
+        )
 
     def gen_export_parser(self):
+        from .export import formats
+        from .order import orders
+
         export_parser = self.subparsers.add_parser(
             'export',
-            help='Export contact data as json, either to a file or to stdout'
+            help='Export contact data, either to a file or to stdout'
         )
         export_parser.add_argument(
             '-o',
@@ -62,6 +179,27 @@ class CLI():
             default=None,
             help='Optional output file path. Default is writing to stdout.'
         )
+        export_parser.add_argument(
+            '-f',
+            '--format',
+            choices=formats,
+            default='json',
+            help='Output format. Default is a json array.'
+        )
+        export_parser.add_argument(
+            '--fields',
+            type=str,
+            default=None,
+            help='Comma separated fields to export, of uuid, name, email, '
+                 'phone and tags. Default is every field.'
+        )
+        export_parser.add_argument(
+            '--order',
+            choices=orders,
+            default='name',
+            help='Order contacts by name (default), first tag or most '
+                 'recently modified.'
+        )
 
     def gen_modify_parser(self):
         modify_parser = self.subparsers.add_parser(
@@ -130,6 +268,8 @@ class CLI():
         )
 
     def gen_import_parser(self):
+        from .export import formats
+
         import_parser = self.subparsers.add_parser(
             'import',
             help='Import contacts data'
@@ -137,10 +277,29 @@ class CLI():
         import_parser.add_argument(
             'input_file',
             type=str,
-            help='Path to JSON file'
+            help='Path to a json, ndjson, csv or vcard file, or - for stdin'
+        )
+        import_parser.add_argument(
+            '-f',
+            '--format',
+            choices=formats,
+            default=None,
+            help='Input format. Default is guessed from the file extension.'
+        )
+        import_parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            default=None,
+            help='Number of processes preparing records. Default is one '
+                 'per cpu.'
         )
 
     def gen_edit_parser(self):
+        # Only imported when the edit parser is built, as it imports the
+        # importer
+        from .editing import formats as edit_formats
+
         edit_parser = self.subparsers.add_parser(
             'edit',
             help='Edit a contact by directly manipulating its json string')
@@ -149,6 +308,19 @@ class CLI():
             default=config['editor'],
             help='Select a text editor (defaults to EDITOR from environment).'
         )
+        edit_parser.add_argument(
+            '-f',
+            '--format',
+            choices=edit_formats,
+            default='ndjson',
+            help='Edit contacts as a json object per line (default), or as ' \
+                 'blocks of "field: value" lines (text).'
+        )
+        edit_parser.add_argument(
+            '--backup',
+            default=config['deleted_data'],
+            help='path to backup file where removed contacts will be exiled'
+        )
 
     def gen_get_field_parser(self):
         get_field_parser = self.subparsers.add_parser(
@@ -160,6 +332,133 @@ class CLI():
             help='fieldname to get value for'
         )
 
+    def gen_lookup_parser(self):
+        lookup_parser = self.subparsers.add_parser(
+            'lookup',
+            help='Find the contacts owning phone numbers or email addresses'
+        )
+        lookup_parser.add_argument(
+            '-p',
+            '--phone',
+            action='append',
+            help='Phone number to look up, in any format (repeatable).'
+        )
+        lookup_parser.add_argument(
+            '-e',
+            '--email',
+            action='append',
+            help='Email address to look up, in any case (repeatable).'
+        )
+        lookup_parser.add_argument(
+            '--stdin',
+            action='store_true',
+            help='Also look up each line of stdin, as an email address if ' \
+                 'it contains @ and as a phone number otherwise.'
+        )
+
+    def gen_dedupe_parser(self):
+        dedupe_parser = self.subparsers.add_parser(
+            'dedupe',
+            help='Find duplicate contacts and merge them'
+        )
+        dedupe_parser.add_argument(
+            '--threshold',
+            type=float,
+            default=0.75,
+            help='Score from 0 to 1 at which two contacts are duplicates ' \
+                 '(default 0.75).'
+        )
+        dedupe_parser.add_argument(
+            '-j',
+            '--jobs',
+            type=int,
+            default=None,
+            help='Number of processes scoring pairs. Default is one per cpu.'
+        )
+        dedupe_parser.add_argument(
+            '--plan',
+            default=None,
+            help='File to write the merge plan to, to review before ' \
+                 'applying it (default stdout).'
+        )
+        dedupe_parser.add_argument(
+            '--apply',
+            default=None,
+            metavar='PLAN',
+            help='Merge the contacts as in a plan written before.'
+        )
+        dedupe_parser.add_argument(
+            '--backup',
+            default=config['deleted_data'],
+            help='path to backup file where merged contacts will be exiled'
+        )
+
+    def gen_batch_parser(self):
+        batch_parser = self.subparsers.add_parser(
+            'batch',
+            help='Apply many operations with one load and one write'
+        )
+        batch_parser.add_argument(
+            'input_file',
+            nargs='?',
+            default='-',
+            help='Path to a file of json operations, one per line, or - ' \
+                 'for stdin (default).'
+        )
+        batch_parser.add_argument(
+            '--backup',
+            default=config['deleted_data'],
+            help='path to backup file where deleted contacts will be exiled'
+        )
+
+    def gen_sync_parser(self):
+        # Only imported when the sync parser is built, as it is not light
+        from .sync import connections, depth, prefer_choices
+
+        sync_parser = self.subparsers.add_parser(
+            'sync',
+            help='Exchange contacts changed since the last sync with a ' \
+                 'CardDAV-style server'
+        )
+        sync_parser.add_argument(
+            '--url',
+            default=None,
+            help='url of the book on the server. Default is sync_url in ' \
+                 'config.json.'
+        )
+        sync_parser.add_argument(
+            '--prefer',
+            choices=prefer_choices,
+            default='server',
+            help='Keep the server\'s version (default) or the local one ' \
+                 'of contacts changed on both sides.'
+        )
+        sync_parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Compare every contact with the one last synced, not ' \
+                 'only those modified since.'
+        )
+        sync_parser.add_argument(
+            '--connections',
+            type=int,
+            default=connections,
+            help=f'Number of connections to the server. Default is ' \
+                 f'{connections}.'
+        )
+        sync_parser.add_argument(
+            '--depth',
+            type=int,
+            default=depth,
+            help=f'Requests pipelined on each connection. Default is ' \
+                 f'{depth}.'
+        )
+        sync_parser.add_argument(
+            '--backup',
+            default=config['deleted_data'],
+            help='path to backup file where deleted contacts will be exiled'
+        )
+
     def gen_delete_parser(self):
         delete_parser = self.subparsers.add_parser(
             'delete',
@@ -170,3 +469,76 @@ class CLI():
             default=config['deleted_data'],
             help='path to backup file where deleted contacts will be exiled'
         )
+        delete_parser.add_argument(
+            '-y',
+            '--yes',
+            action='store_true',
+            help='Delete without showing the contacts and asking first.'
+        )
+
+    def gen_undelete_parser(self):
+        undelete_parser = self.subparsers.add_parser(
+            'undelete',
+            help='Restore deleted contacts'
+        )
+        undelete_parser.add_argument(
+            '--uuid',
+            action='append',
+            required=True,
+            help='uuid of a deleted contact to restore (may be repeated)'
+        )
+        undelete_parser.add_argument(
+            '--backup',
+            default=config['deleted_data'],
+            help='path to backup file where deleted contacts were exiled'
+        )
+
+    def gen_compact_parser(self):
+        self.subparsers.add_parser(
+            'compact',
+            help='Fold the storage journal back into the contacts file'
+        )
+
+    def gen_serve_parser(self):
+        serve_parser = self.subparsers.add_parser(
+            'serve',
+            help='Keep contacts in memory and answer other contacts ' \
+                 'commands over a unix socket'
+        )
+        serve_parser.add_argument(
+            '--socket',
+            default=config['socket_path'],
+            help='path to the unix socket to listen on'
+        )
+
+    def gen_cache_parser(self):
+        cache_parser = self.subparsers.add_parser(
+            'cache',
+            help='Inspect or invalidate the cache of parsed contacts'
+        )
+        cache_parser.add_argument(
+            '--info',
+            action='store_true',
+            default=False,
+            help='Show the cache status and hit/miss counts (default).'
+        )
+        cache_parser.add_argument(
+            '--invalidate',
+            action='store_true',
+            default=False,
+            help='Remove the cache so the next run parses the json file.'
+        )
+
+    def gen_migrate_parser(self):
+        from .storage import storages
+
+        migrate_parser = self.subparsers.add_parser(
+            'migrate',
+            help='Copy contacts into another storage engine'
+        )
+        migrate_parser.add_argument(
+            '--to',
+            required=True,
+            choices=storages,
+            help='storage engine to copy contacts into'
+        )
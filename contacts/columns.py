@@ -0,0 +1,236 @@
+"""Columnar sidecar files holding single fields of every contact.
+
+A column is kept next to the contacts file for each of uuid, name, email,
+phone and tags once it has been needed. It holds the field of every
+contact in the snapshot, in order, one value per line encoded exactly as
+json.dumps encodes it. get_field and export --fields without a query read
+only the columns they output, memory mapped, instead of loading every
+contact. Values are rarely escaped, so most are written out by slicing
+their bytes rather than decoding them, and json exports splice the
+encoded values into records as they are.
+
+Layout of a column, integers being little endian:
+
+    magic       4 bytes, b'CCL1'
+    length      uint32, the length of meta
+    meta        json: the fingerprint of the snapshot (source), the field
+                and the number of rows
+    values      a line per contact
+
+A column is built from the snapshot the first time it is asked for, and
+from then on written with every snapshot. A column written for another
+snapshot is rebuilt.
+"""
+import json
+import struct
+from pathlib import Path
+
+from .storage import atomic_write, line_encoder
+
+fields = ('uuid', 'name', 'email', 'phone', 'tags')
+list_fields = ('email', 'phone', 'tags')
+magic = b'CCL1'
+
+# Bytes of a column read at a time
+chunk_size = 1 << 20
+
+
+def column_path(json_path, field):
+    """Return the path of the column of a field kept next to a contacts
+    file
+    """
+    return Path(f'{json_path}.col.{field}')
+
+
+def field_text(value):
+    """Return a value of a field as get_field writes it"""
+    if isinstance(value, list):
+        return ' '.join(map(str, value))
+    return str(value)
+
+
+def line_text(field, line):
+    """Return the bytes get_field writes for a json encoded value, sliced
+    from it unless it has to be decoded
+    """
+    if b'\\' not in line:
+        if field not in list_fields:
+            if len(line) > 1 and line[:1] == line[-1:] == b'"':
+                return line[1:-1]
+        elif line == b'[]':
+            return b''
+        elif line.startswith(b'["') and line.endswith(b'"]'):
+            # Without escapes every other quote is between two strings
+            text = line[2:-2].replace(b'", "', b' ')
+            if b'"' not in text:
+                return text
+    return field_text(json.loads(line)).encode()
+
+
+def chunk_text(field, chunk):
+    """Return the text get_field writes for a chunk of whole lines of a
+    column, sliced from it at once, or None if some value has to be
+    decoded.
+
+    Unless a quote is escaped every quote delimits a string, so a chunk
+    whose values are all strings, or all empty or string lists, loses
+    every quote to the replacements below. Other escapes, mostly of
+    characters outside ascii, are decoded once the quotes are gone.
+    """
+    if b'\\"' in chunk:
+        return None
+    rows = chunk.count(b'\n')
+    chunk = b'\n' + chunk
+    if field in list_fields:
+        if chunk.count(b'\n["') + chunk.count(b'[]\n') != rows:
+            return None
+        chunk = (chunk.replace(b'[]\n', b'\n').replace(b'\n["', b'\n')
+                 .replace(b'"]\n', b'\n').replace(b'", "', b' '))
+    else:
+        if chunk.count(b'\n"') != rows:
+            return None
+        chunk = chunk.replace(b'\n"', b'\n').replace(b'"\n', b'\n')
+    if b'"' in chunk:
+        return None
+    if b'\\' not in chunk:
+        return chunk[1:].decode()
+    # Characters outside the basic plane are escaped as surrogate pairs
+    return (chunk[1:].decode('unicode_escape')
+            .encode('utf-16', 'surrogatepass').decode('utf-16'))
+
+
+def encode_column(source, field, contacts):
+    """Return the bytes of the column of a field of a list of contacts"""
+    encode = line_encoder()
+    values = ''.join(f'{encode(contact.get(field))}\n'
+                     for contact in contacts)
+    meta = json.dumps({
+        'source': source, 'field': field, 'rows': len(contacts),
+    }).encode()
+    return b''.join([magic, struct.pack('<I', len(meta)), meta,
+                     values.encode()])
+
+
+def write_column(path, source, field, contacts):
+    """Write the column of a field of contacts from the snapshot with
+    fingerprint source
+    """
+    data = encode_column(source, field, contacts)
+    atomic_write(path, lambda f: f.write(data), sync=False, mode='wb')
+
+
+def read_column(path, source):
+    """Return (mapped file, offset of the values, number of values) of the
+    column at path if it was written for source, else None
+    """
+    import mmap
+
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        length, = struct.unpack_from('<I', data, 4)
+        meta = json.loads(data[8:8 + length])
+    except (struct.error, ValueError):
+        meta = None
+    if data[:4] != magic or not isinstance(meta, dict) \
+            or meta.get('source') != source:
+        data.close()
+        return None
+    return data, 8 + length, meta.get('rows')
+
+
+def update_columns(json_path, source, contacts):
+    """Rewrite every column kept next to a contacts file for a new
+    snapshot of contacts with fingerprint source
+    """
+    for field in fields:
+        path = column_path(json_path, field)
+        if path.exists():
+            write_column(path, source, field, contacts)
+
+
+class ColumnStore:
+    """Memory mapped columns of some fields of every contact in a snapshot"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __repr__(self):
+        return f'ColumnStore({", ".join(self.columns)})'
+
+    @classmethod
+    def open(cls, json_path, snapshot, source, fields):
+        """Return the columns of fields for the snapshot with fingerprint
+        source, building those missing or out of date from the snapshot.
+
+        Raise ValueError if the snapshot is not one contact per line.
+        """
+        from .lookup import snapshot_lines
+
+        columns = {}
+        for field in fields:
+            column = read_column(column_path(json_path, field), source)
+            if column is not None:
+                columns[field] = column
+        missing = [field for field in fields if field not in columns]
+        if missing:
+            contacts = [contact for offset, contact in
+                        snapshot_lines(snapshot)]
+            for field in missing:
+                path = column_path(json_path, field)
+                write_column(path, source, field, contacts)
+                columns[field] = read_column(path, source)
+        return cls(columns)
+
+    def count(self):
+        """Return the number of contacts"""
+        data, start, rows = next(iter(self.columns.values()))
+        return rows
+
+    def close(self):
+        for data, start, rows in self.columns.values():
+            data.close()
+
+    def chunks(self, field):
+        """Yield the values of field of every contact as chunks of whole
+        lines
+        """
+        data, start, rows = self.columns[field]
+        end = len(data)
+        while start < end:
+            stop = data.find(b'\n', min(start + chunk_size, end - 1)) + 1
+            yield data[start:stop]
+            start = stop
+
+    def lines(self, field):
+        """Yield the json encoded value of field of each contact"""
+        for chunk in self.chunks(field):
+            yield from chunk.splitlines()
+
+    def text_chunks(self, field):
+        """Yield what get_field writes for every contact, in chunks"""
+        for chunk in self.chunks(field):
+            text = chunk_text(field, chunk)
+            if text is None:
+                text = b''.join(line_text(field, line) + b'\n'
+                                for line in chunk.splitlines()).decode()
+            yield text
+
+    def records(self, fields):
+        """Yield each contact with only fields, json encoded exactly as
+        json.dumps encodes the dict
+        """
+        keys = [f'{", " if i else "{"}"{field}": '.encode()
+                for i, field in enumerate(fields)]
+        for values in zip(*(self.lines(field) for field in fields)):
+            yield b''.join(
+                part for pair in zip(keys, values) for part in pair
+            ) + b'}'
+
+    def rows(self, fields):
+        """Yield each contact as a dict of only fields"""
+        for values in zip(*(self.lines(field) for field in fields)):
+            yield dict(zip(fields, map(json.loads, values)))
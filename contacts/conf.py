@@ -2,24 +2,72 @@
 
 from os import environ
 from pathlib import Path
-from json import load
+from collections.abc import Mapping
 
 contacts_path = Path(environ['XDG_CONFIG_HOME'], 'contacts')
 
 default_config = {
     'path': contacts_path,
     'working_data': contacts_path/'contacts.json',
+    # Names of address books and their contacts files, see contacts.books
+    'books': {},
+    'default_book': None,
     'backup_data': contacts_path/'contacts.json.bak',
-    'deleted_data': contacts_path/'contacts_deleted.json',
-    'backup_deleted_data': contacts_path/'contacts_deleted.json.bak',
+    'deleted_data': contacts_path/'contacts_deleted.ndjson',
+    'backup_deleted_data': contacts_path/'contacts_deleted.ndjson.bak',
     'tmp_edit_path': contacts_path/'contacts_tmp',
-    'editor': Path(environ['EDITOR'])
+    'editor': Path(environ['EDITOR']),
+    'storage': 'json',
+    # Country calling code of phone numbers written without one, e.g. '44'
+    'country_code': None,
+    'max_journal_bytes': 1024 * 1024,
+    'lock_timeout': 10,
+    'socket_path': contacts_path/'contacts.sock',
+    # Url of the book on a CardDAV-style server, see contacts.sync
+    'sync_url': None,
 }
 
 config_file = contacts_path/'config.json'
 
-if config_file.exists():
-    with open(config_file, 'r') as cf:
-        config = load(cf)
-else:
-    config = default_config
+
+class Config(Mapping):
+    """Settings from default_config, updated with those in config.json.
+
+    config.json is read the first time a setting is looked up rather than
+    when this module is imported.
+    """
+
+    def __init__(self, defaults, path):
+        self.defaults = defaults
+        self.path = path
+        self._settings = None
+
+    def __repr__(self):
+        return f'Config({self.path})'
+
+    @property
+    def settings(self):
+        if self._settings is None:
+            from .profile import phase
+
+            with phase('config'):
+                settings = dict(self.defaults)
+                if self.path.exists():
+                    from json import load
+
+                    with open(self.path, 'r') as cf:
+                        settings.update(load(cf))
+            self._settings = settings
+        return self._settings
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+    def __iter__(self):
+        return iter(self.settings)
+
+    def __len__(self):
+        return len(self.settings)
+
+
+config = Config(default_config, config_file)
@@ -1,14 +1,16 @@
 import sys
 import os
 import json
-import subprocess
-from json.decoder import JSONDecodeError
-from shutil import get_terminal_size
-from uuid import uuid1
+from bisect import bisect_left, insort
+from itertools import chain
 
-from tabulate import tabulate
-
-from .conf import config
+from .conf import config, config_file
+from .profile import phase
+from .index import (
+    FieldIndex, TrigramIndex, field_index_path, field_values, index_path,
+    normalize_value, searchable_values
+)
+from .storage import open_storage, sort_contacts, sort_key
 
 # Color and formatting definitions for pretty printing
 colors = {
@@ -18,73 +20,502 @@ colors = {
     'phone': '\033[92m'
 }
 
+# Subcommands which only read the contacts they are given, and so may be
+# given only those found by a scan of the stored file
+read_only_subcommands = ('show', 'get_field', 'export')
 
-def new_uuid():
-    return str(uuid1())
+# Subcommands which do not act on the contacts matching a query, and so
+# need not load them
+unqueried_subcommands = ('lookup', 'batch', 'sync')
 
+# Subcommands which read only some fields, and so need not load every
+# contact when there is no query, see contacts.columns
+projected_subcommands = ('get_field', 'export')
 
-def read_json(path):
-    """Read existing contact list from json file.
 
-    Return existing contacts as a list of dicts (assuming json file is in
-    the correct format.
-    """
-    with open(path, 'r') as f:
-        return json.load(f)
+def new_uuid():
+    from uuid import uuid1
+
+    return str(uuid1())
 
 
 class ContactManager:
     """Stores and manipulates contact information"""
 
-    def __init__(self, json_path):
+    def __init__(self, json_path, storage=None):
         self.json_path = json_path
-        self.contacts = read_json(self.json_path)
-        self.sort()
+        if storage is None:
+            storage = open_storage(json_path)
+        self.storage = storage
+        self.changes = []
+        self._contacts = None
+        self._index = None
+        self._field_index = None
+        self._fuzzy_index = None
+        self._positions = None
+        self._orders = {}
+        # True once only the contacts matching a query were loaded
+        self.partial = False
+        # False if the storage has no lookup index
+        self._lookup_index = None
 
     def __repr__(self):
         """Return simple string to represent ContactData instance"""
         return f'ContactManager({self.json_path})'
 
+    @property
+    def contacts(self):
+        """List of contacts, loaded on first use already sorted by name.
+
+        If the storage is searchable and a query was made first, only the
+        contacts which may match the query are loaded.
+        """
+        if self._contacts is None:
+            with phase('load') as current:
+                self._contacts = self.storage.load()
+                current.records = len(self._contacts)
+        return self._contacts
+
+    @contacts.setter
+    def contacts(self, contacts):
+        self._contacts = contacts
+        self.reordered()
+
+    def open_index(self, index_class, path):
+        """Return an index of the contacts list, or None if it is to be
+        scanned: when only part of it was loaded, or until the stored
+        contacts were queried often enough to be worth indexing, see
+        contacts.index.
+
+        The index is opened for the contacts as they were loaded, and
+        follows the changes made to them since.
+        """
+        from .index import index_log_path
+
+        contacts = self.contacts
+        if self.partial or self.storage.loaded is None:
+            return None
+        return index_class.open(path, self.storage.loaded, contacts,
+                                index_log_path(self.json_path), self.changes)
+
+    @property
+    def index(self):
+        """Trigram index of the contacts list, opened on first use and kept
+        up to date as the contacts change.
+
+        None if the storage answers queries itself, or the contacts are
+        scanned instead, see open_index.
+        """
+        if self._index is None and not self.storage.searchable:
+            with phase('index'):
+                self._index = self.open_index(TrigramIndex,
+                                              index_path(self.json_path))
+        return self._index
+
+    @property
+    def field_index(self):
+        """Per-field indexes of the contacts list, opened on first use and
+        kept up to date as the contacts change, see index
+        """
+        if self._field_index is None and not self.storage.searchable:
+            with phase('field_index'):
+                self._field_index = self.open_index(
+                    FieldIndex, field_index_path(self.json_path)
+                )
+        return self._field_index
+
+    @property
+    def fuzzy_index(self):
+        """Fuzzy index of names and emails, opened on first use and kept up
+        to date as the contacts change.
+
+        When only part of the contacts were loaded, the index of that part
+        is built without being saved.
+        """
+        if self._fuzzy_index is None:
+            from .fuzzy import FuzzyIndex, fuzzy_index_path
+
+            path = fuzzy_index_path(self.json_path)
+            with phase('fuzzy_index'):
+                self._fuzzy_index = self.open_index(FuzzyIndex, path) \
+                    or FuzzyIndex.build(path, None, self.contacts)
+        return self._fuzzy_index
+
+    def open_indexes(self):
+        """Return the indexes which are open, and so follow changes"""
+        return [index for index in
+                (self._index, self._field_index, self._fuzzy_index)
+                if index is not None]
+
+    def drop_indexes(self):
+        """Forget every index, so that each is opened again on next use"""
+        self._index = None
+        self._field_index = None
+        self._fuzzy_index = None
+
+    def positions(self):
+        """Return a dict mapping uuids to indices in the contacts list"""
+        if self._positions is None:
+            self._positions = {
+                contact['uuid']: index
+                for index, contact in enumerate(self.contacts)
+            }
+        return self._positions
+
+    def position(self, contact):
+        """Return the index of a contact in the contacts list, found by
+        bisecting on its name rather than with positions, which have to be
+        rebuilt each time a contact moves
+        """
+        index = bisect_left(self.contacts, sort_key(contact), key=sort_key)
+        while self.contacts[index] is not contact:
+            index += 1
+        return index
+
+    def reordered(self):
+        """Forget positions and orders after the contacts list changed"""
+        self._positions = None
+        self._orders = {}
+
     def sort(self, by='name'):
         """Sort contacts in contact list by a given field"""
         self.contacts.sort(key=lambda contact: contact[by])
+        self.reordered()
+
+    def order(self, by):
+        """Return the indices of every contact in a secondary order.
+
+        by is one of contacts.order.orders. Contacts are kept sorted by
+        name, which breaks ties. The order is cached until the contacts
+        change.
+        """
+        from .order import ModifiedLog, modified_log_path, tags_key
+
+        if by == 'name':
+            return range(len(self.contacts))
+        if by not in self._orders:
+            if by == 'tags':
+                keys = [tags_key(contact) for contact in self.contacts]
+            else:
+                times = ModifiedLog(modified_log_path(self.json_path)).read()
+                keys = [-times.get(contact['uuid'], 0)
+                        for contact in self.contacts]
+            self._orders[by] = sorted(range(len(keys)), key=keys.__getitem__)
+        return self._orders[by]
+
+    def ordered(self, indices, by='name'):
+        """Return indices rearranged into a secondary order"""
+        if by == 'name':
+            return indices
+        selected = set(indices)
+        return [index for index in self.order(by) if index in selected]
 
     def overwrite(self):
-        """Write self.contacts to json file"""
-        self.sort()
-        sys.stderr.write(f'overwriting ... {self.json_path}')
-        with open(self.json_path, 'w+') as f:
-            json.dump(self.contacts, f)
+        """Persist self.contacts and any pending changes via the storage.
+
+        The contacts list is kept sorted as it is changed, so it is not
+        sorted again here.
+        """
+        from .order import ModifiedLog, modified_log_path
+
+        if self.partial:
+            raise RuntimeError('Only part of the contacts list was loaded')
+        changed = {contact['uuid'] for op, contact in self.changes}
+        with phase('write') as current:
+            loaded = self.storage.loaded
+            self.stored(self.storage.commit(self.contacts, self.changes),
+                        loaded, self.changes)
+            current.records = len(self.contacts)
+        self.changes = []
+        ModifiedLog(modified_log_path(self.json_path)).touch(changed)
+
+    def stored(self, contacts, loaded, changes):
+        """Bring the contacts list in line with what was stored, loaded
+        being the fingerprint of the stored contacts changes were made to.
+
+        The storage returns a different list if another process changed
+        the stored contacts since they were loaded, in which case the
+        indexes are dropped to be opened again for it. Otherwise the
+        changes are logged for the indexes of earlier versions to follow,
+        see contacts.index.
+        """
+        from .fuzzy import fuzzy_index_path
+        from .index import append_log, index_log_path
+
+        if contacts is not self._contacts:
+            self.contacts = contacts
+            self.drop_indexes()
+            return
+        paths = (index_path, field_index_path, fuzzy_index_path)
+        if loaded is not None and not self.storage.searchable \
+                and any(path(self.json_path).exists() for path in paths):
+            append_log(index_log_path(self.json_path), loaded,
+                       self.storage.loaded, changes)
+
+    def follow(self, removed=(), added=()):
+        """Keep the open indexes up to date as contacts with the uuids in
+        removed are removed from the contacts list and contacts in added
+        are added to it
+        """
+        for index in self.open_indexes():
+            for uuid in removed:
+                index.remove(uuid)
+            for contact in added:
+                index.add(contact)
+
+    def insert(self, contact):
+        """Insert a contact in sorted position"""
+        insort(self.contacts, contact, key=sort_key)
+        self.follow(added=[contact])
+        self.changes.append(('add', contact))
+        self.reordered()
+
+    def replace(self, index, contact):
+        """Replace the contact at index.
+
+        The contact is moved to keep the list sorted if its name changed,
+        which shifts the indices of the contacts in between.
+        """
+        old_contact = self.contacts[index]
+        if sort_key(contact) == sort_key(old_contact):
+            self.contacts[index] = contact
+            self._orders = {}
+        else:
+            del self.contacts[index]
+            insort(self.contacts, contact, key=sort_key)
+            self.reordered()
+        self.follow([old_contact['uuid']], [contact])
+        if old_contact['uuid'] != contact['uuid']:
+            self.changes.append(('delete', old_contact))
+            self._positions = None
+        self.changes.append(('update', contact))
+
+    def remove(self, index):
+        """Remove the contact at index from the contacts list"""
+        old_contact = self.contacts.pop(index)
+        self.follow([old_contact['uuid']])
+        self.changes.append(('delete', old_contact))
+        self.reordered()
+
+    def merge(self, contacts):
+        """Add contacts, replacing those with the uuid of a stored contact.
 
-    def query(self, query):
+        Unlike insert and replace, the contacts are sorted once at the end
+        and the indexes are not updated per contact but dropped, to be
+        opened again with every change on next use. Return the number of
+        contacts replaced.
+        """
+        positions = self.positions()
+        updated = 0
+        for contact in contacts:
+            index = positions.get(contact['uuid'])
+            if index is None:
+                positions[contact['uuid']] = len(self.contacts)
+                self.contacts.append(contact)
+                self.changes.append(('add', contact))
+            else:
+                self.contacts[index] = contact
+                self.changes.append(('update', contact))
+                updated += 1
+        sort_contacts(self.contacts)
+        self.reordered()
+        self.drop_indexes()
+        return updated
+
+    def remove_many(self, uuids):
+        """Remove every contact whose uuid is in a set, in a single pass"""
+        kept = []
+        for contact in self.contacts:
+            if contact['uuid'] in uuids:
+                self.changes.append(('delete', contact))
+            else:
+                kept.append(contact)
+        self.contacts = kept
+        self.follow(uuids)
+
+    def compact(self, indices=None, args=None):
+        """Fold the storage journal (if any) back into the snapshot"""
+        loaded = self.storage.loaded
+        self.stored(self.storage.compact(self.contacts), loaded, [])
+
+    def query(self, query, partial=False):
         """Query contact information.
 
-        Return a set of indices corresponding to matching contacts. If no
-        query string is supplied, return the indices of the full dataset (as a
-        generator).
+        Return a sorted list of indices corresponding to matching contacts.
+        Candidates are looked up in the trigram index, or found by the
+        storage if it is searchable, and then checked against the full
+        record. Queries using field names or operators are handled by
+        query_language. If no query string is supplied, return the indices
+        of the full dataset (as a generator).
+
+        If partial is true and nothing is loaded yet, only the contacts the
+        storage finds by scanning its file are loaded, so the contacts list
+        cannot be written afterwards.
         """
+        from .query import is_structured
+
         if query is None:
             return range(len(self.contacts))
+        if is_structured(query):
+            return self.query_language(query)
+
+        query = query.lower()
+        indices = None
+        if self._contacts is None and self.storage.searchable:
+            found = self.storage.search(query)
+            if found is not None:
+                self.contacts = found
+                indices = range(len(found))
+        elif self._contacts is None and partial:
+            with phase('scan') as current:
+                found = self.storage.scan(query)
+                if found is not None:
+                    self.contacts = found
+                    self.partial = True
+                    indices = range(len(found))
+                    current.records = len(found)
+        if indices is None:
+            index = self.index
+            candidates = None if index is None else index.candidates(query)
+            indices = self.candidate_indices(candidates)
+        return [
+            index for index in indices
+            if any(query in value.lower()
+                   for value in searchable_values(self.contacts[index]))
+        ]
+
+    def find(self, args, partial=False):
+        """Return the indices of the contacts selected by the query options
+        in parsed command line args, see query for partial
+        """
+        with phase('query') as current:
+            if getattr(args, 'fuzzy', False) and args.query_str is not None:
+                indices = self.fuzzy_query(args.query_str, args.top)
+            else:
+                indices = self.query(args.query_str, partial)
+            current.records = len(indices)
+        return indices
+
+    def fuzzy_query(self, query, top=10):
+        """Return indices of the top contacts for query, best match first.
+
+        Typos are tolerated, see contacts.fuzzy for the scoring.
+        """
+        scores = self.fuzzy_index.search(query)
+        positions = self.positions()
+        ranked = sorted(
+            (score, self.contacts[positions[uuid]]['name'], positions[uuid])
+            for uuid, score in scores.items() if uuid in positions
+        )
+        return [index for score, name, index in ranked[:top]]
 
-        matching_indices = set()
-        for index, contact in enumerate(self.contacts):
-            values = [val for val in contact.values() if val is not None]
-            for value in values:
-                # Concatenate lists of phone numbers, emails, tags
-                if isinstance(value, list):
-                    value = ', '.join(value)
+    def query_language(self, query):
+        """Return sorted indices of the contacts matching a query written in
+        the query language described in contacts.query
+        """
+        from .query import QueryError, parse
+
+        try:
+            parsed = parse(query)
+        except QueryError as error:
+            sys.stderr.write(f'Invalid query: {error}\n')
+            sys.exit(1)
+        candidates = parsed.candidates(self)
+        if self._contacts is None and self.storage.searchable \
+                and candidates is not None:
+            # Only the candidates are loaded, as query does with search
+            self.contacts = self.storage.load_uuids(candidates)
+            indices = range(len(self.contacts))
+        else:
+            indices = self.candidate_indices(candidates)
+        return [
+            index for index in indices
+            if parsed.matches(self.contacts[index])
+        ]
 
-                if query.lower() in value.lower():
-                    matching_indices.add(index)
-        return list(matching_indices)
+    def candidate_indices(self, candidates):
+        """Return sorted indices of a set of candidate uuids, or of every
+        contact if candidates is None
+        """
+        if candidates is None:
+            return range(len(self.contacts))
+        positions = self.positions()
+        return sorted(
+            positions[uuid] for uuid in candidates if uuid in positions
+        )
 
     def list_matches(self, indices):
         """Return a list of contacts at given indices"""
         return [self.contacts[i] for i in indices]
 
+    def deleted_archive(self, path):
+        """Return the archive of deleted contacts at path, converted to
+        ndjson if it is a legacy json array, exiting if it cannot be read
+        """
+        from .archive import DeletedArchive
+
+        archive = DeletedArchive(path)
+        try:
+            archive.migrate()
+        except ValueError as error:
+            sys.stderr.write(f'{error}\n')
+            sys.exit(1)
+        return archive
+
     def show(self, indices=None, args=None):
-        """Write pretty matches to stdout"""
-        term_size = get_terminal_size()
+        """Write a page of pretty matches to stdout or a pager.
+
+        Only the rows on the page are formatted. Unless a limit is given
+        or a pager used, the page is cut to fit the terminal.
+        """
+        from .render import render, table_rows, page
+
+        indices = self.ordered(indices, getattr(args, 'order', 'name'))
+        if getattr(args, 'tabulate', False):
+            return self.show_table(indices, args)
+        total = len(indices)
+        offset = getattr(args, 'offset', 0)
+        limit = getattr(args, 'limit', None)
+        use_pager = getattr(args, 'pager', False) and sys.stdout.isatty()
+        if limit is None and not use_pager:
+            term_lines = self.term_lines(args)
+            if total >= term_lines:
+                limit = term_lines - 5
+        stop = total if limit is None else min(offset + limit, total)
+
+        footer = f'{total} contacts'
+        if total and stop <= offset:
+            footer += ', none shown'
+        elif (offset, stop) != (0, total):
+            footer += f', showing {offset + 1}-{stop}'
+        with phase('render') as current:
+            lines = chain(
+                render(table_rows(self.contacts, indices[offset:stop]),
+                       color=getattr(args, 'color', False)),
+                ['', footer]
+            )
+            if use_pager:
+                page(lines)
+            else:
+                for line in lines:
+                    sys.stdout.write(f'{line}\n')
+            current.records = max(stop - offset, 0)
+
+    def term_lines(self, args):
+        """Return the height of the terminal the command was run in"""
+        from shutil import get_terminal_size
+
+        # Requests forwarded by the server carry the client's terminal size
+        term_lines = getattr(args, 'term_lines', None)
+        if term_lines is None:
+            term_lines = get_terminal_size().lines
+        return term_lines
+
+    def show_table(self, indices=None, args=None):
+        """Write pretty matches to stdout with tabulate"""
+        from tabulate import tabulate
+
+        term_lines = self.term_lines(args)
         matches = self.list_matches(indices)
         pretty_matches = []
         for index, match in enumerate(matches):
@@ -105,8 +536,8 @@ class ContactManager:
             pretty_matches.append(pretty_dict)
 
         nlines = None
-        if len(pretty_matches) >= term_size.lines:
-            nlines = term_size.lines - 5
+        if len(pretty_matches) >= term_lines:
+            nlines = term_lines - 5
             pretty_matches = pretty_matches[:nlines]
 
         sys.stdout.write(tabulate(pretty_matches, headers='keys'))
@@ -116,32 +547,123 @@ class ContactManager:
             sys.stdout.write(f', truncated to {nlines} lines\n')
 
     def export(self, indices=None, args=None):
-        """Export matching contacts as json"""
-        output = self.list_matches(indices)
-        try:
-            with open(args.output_file, 'w+') as output_file:
-                output_file.write(json.dumps(output))
-        except (TypeError, AttributeError) as error:
-            sys.stdout.write(json.dumps(output))
+        """Stream matching contacts to a file or stdout.
+
+        Records are encoded and written one at a time, in the format
+        given by --format (json by default). With --fields only those
+        fields are exported, read from their columns, see
+        contacts.columns, if every contact is exported by name.
+        """
+        from functools import partial
+        from .export import write_encoded, write_export
+
+        format = getattr(args, 'format', 'json')
+        order = getattr(args, 'order', 'name')
+        fields = self.export_fields(getattr(args, 'fields', None))
+        write = partial(write_export, format=format, fields=fields)
+        columns = None
+        if indices is None and fields is not None and order == 'name':
+            columns = self.storage.columns(fields)
+        if columns is not None:
+            count = columns.count()
+            if format in ('json', 'ndjson'):
+                matches = columns.records(fields)
+                write = partial(write_encoded, format=format)
+            else:
+                matches = columns.rows(fields)
+        else:
+            if indices is None:
+                indices = range(len(self.contacts))
+            indices = self.ordered(indices, order)
+            count = len(indices)
+            matches = (self.contacts[i] for i in indices)
+            if fields is not None:
+                matches = ({field: contact.get(field) for field in fields}
+                           for contact in matches)
+        output_file = getattr(args, 'output_file', None)
+        with phase('export') as current:
+            current.records = count
+            if output_file is None:
+                write(matches, sys.stdout)
+                return
+            # Line endings are written by the formats themselves
+            with open(output_file, 'w+', newline='') as f:
+                write(matches, f)
+
+    @staticmethod
+    def export_fields(text):
+        """Return the fields listed in the comma separated text of
+        --fields, or None if it was not given, exiting if one is unknown
+        """
+        from .columns import fields
+
+        if text is None:
+            return None
+        names = [name.strip() for name in text.split(',') if name.strip()]
+        for name in names:
+            if name not in fields:
+                sys.stderr.write(
+                    f'There is no field {name}, fields are '
+                    f'{", ".join(fields)}\n'
+                )
+                sys.exit(1)
+        return list(dict.fromkeys(names)) or list(fields)
 
     def edit(self, indices=None, args=None):
-        """Manually edit contacts with text editor"""
-        assert len(indices) == 1, 'You must edit exactly one contact at a time'
-        index = indices.pop()
-        with open(config['tmp_edit_path'], 'w+') as tmpfile:
-            json.dump(self.contacts[index], tmpfile)
-        process = subprocess.run([config['editor'], config['tmp_edit_path']])
-        assert process.returncode == 0, 'Editor process exited with an error'
-        with open(config['tmp_edit_path'], 'r') as tmpfile:
-            edited_contact = json.load(tmpfile)
-        self.contacts[index] = edited_contact
+        """Manually edit filtered contacts in one text editor session.
+
+        Only the contacts added, changed or removed in the editor are
+        stored, and nothing is written if none were; removed contacts are
+        archived as delete does. See contacts.editing for the layouts.
+        """
+        import subprocess
+        from .editing import diff, encode, parse
+
+        originals = self.list_matches(indices)
+        if not originals:
+            sys.stderr.write('No contacts to edit\n')
+            sys.exit(1)
+        format = getattr(args, 'format', 'ndjson')
+        path = f'{config["tmp_edit_path"]}.{format}'
+        with open(path, 'w') as f:
+            f.write(encode(originals, format))
+        editor = getattr(args, 'editor', None) or config['editor']
+        process = subprocess.run([str(editor), path])
+        if process.returncode != 0:
+            sys.stderr.write('Editor exited with an error, nothing changed\n')
+            sys.exit(1)
+        try:
+            with open(path, 'r') as f:
+                added, changed, removed = diff(originals,
+                                               parse(f.read(), format))
+        except ValueError as error:
+            sys.stderr.write(f'Nothing changed, cannot read {path}: {error}\n')
+            sys.exit(1)
+        os.remove(path)
+        if not (added or changed or removed):
+            sys.stderr.write('No changes\n')
+            return
+        sys.stderr.write(
+            f'{len(added)} added, {len(changed)} changed, {len(removed)} '
+            f'removed\n'
+        )
+        for contact in added:
+            contact['uuid'] = new_uuid()
+            self.insert(contact)
+        for original, contact in changed:
+            self.replace(self.position(original), contact)
+        if removed:
+            sys.stderr.write(f'exiling contacts to ... {args.backup}\n')
+            self.deleted_archive(args.backup).append(removed)
+            self.remove_many({contact['uuid'] for contact in removed})
         self.overwrite()
-        os.remove(config['tmp_edit_path'])
 
     def modify(self, indices=None, args=None):
         """Modify filtered contacts directly from the command line"""
         matches = self.list_matches(indices)
-        for index, match in zip(indices, matches):
+        for match in matches:
+            # Renamed contacts move, so look each one up again
+            index = self.positions()[match['uuid']]
             modified_contact = {'uuid': match['uuid']}
             for arg in ['name', 'email', 'phone', 'tags']:
                 if getattr(args, arg) is not None:
@@ -149,11 +671,11 @@ class ContactManager:
                 else:
                     modified_contact.update({arg: match[arg]})
             msg = f'Modifying contact ... \n' \
-                  f'{self.contacts[index]}\n' \
+                  f'{dict(self.contacts[index])}\n' \
                   f'to ... \n' \
                   f'{modified_contact}\n'
             sys.stderr.write(msg)
-            self.contacts[index] = modified_contact
+            self.replace(index, modified_contact)
         self.overwrite()
 
     def add(self, indices=None, args=None):
@@ -163,48 +685,354 @@ class ContactManager:
             attr = getattr(args, arg)
             new_contact.update({arg: attr})
         sys.stderr.write(f'adding contact info ... \n{new_contact}\n')
-        self.contacts.append(new_contact)
+        self.insert(new_contact)
         self.overwrite()
 
-    def import_json(self, args=None):
-        """Write a function to import contacts"""
-        pass
+    def cache(self, indices=None, args=None):
+        """Inspect or invalidate the cache of parsed contacts"""
+        cache = self.storage.cache
+        if cache is None:
+            sys.stderr.write(f'{self.storage.name} storage is not cached\n')
+            sys.exit(1)
+        if args.invalidate:
+            sys.stderr.write(f'invalidating cache ... {cache.path}\n')
+            cache.invalidate()
+        if args.info or not args.invalidate:
+            info = cache.info(self.storage.cache_source())
+            sys.stdout.write(json.dumps(info, indent=2) + '\n')
+
+    def migrate(self, indices=None, args=None):
+        """Copy every contact into another storage engine.
+
+        The current storage is compacted first so that nothing is left in
+        a journal. The storage in use is set by 'storage' in config.json.
+        """
+        target = open_storage(self.json_path, args.to)
+        if target.name == self.storage.name:
+            sys.stderr.write(f'contacts are already stored as {target.name}\n')
+            sys.exit(1)
+        contacts = self.storage.compact(self.storage.load())
+        sys.stderr.write(
+            f'\nmigrating {len(contacts)} contacts from {self.storage.name} '
+            f'to {target.name} ...\n'
+        )
+        target.replace_all(contacts)
+        sys.stderr.write(
+            f'set "storage": "{target.name}" in {config_file} to use it\n'
+        )
+
+    def serve(self, indices=None, args=None):
+        """Serve requests from other contacts processes on a unix socket"""
+        from .server import serve
+        serve(self, args.socket)
+
+    def import_json(self, indices=None, args=None):
+        """Bulk import contacts from a file, merging them in one write.
+
+        Contacts with the uuid of a stored contact replace it. Records
+        which are not valid contacts are skipped.
+        """
+        import time
+        from .importer import guess_format, open_input, read_contacts
+
+        start = time.perf_counter()
+        format = args.format or guess_format(args.input_file)
+        jobs = args.jobs or os.cpu_count() or 1
+        try:
+            with open_input(args.input_file) as f:
+                contacts, skipped = read_contacts(f, format, jobs)
+        except (OSError, ValueError) as error:
+            sys.stderr.write(f'Import failed: {error}\n')
+            sys.exit(1)
+        updated = self.merge(contacts)
+        self.overwrite()
+        elapsed = time.perf_counter() - start
+        total = len(contacts) + skipped
+        sys.stderr.write(
+            f'\nimported {len(contacts)} contacts ({updated} updated, '
+            f'{skipped} skipped) in {elapsed:.2f}s, '
+            f'{total / max(elapsed, 1e-9):.0f} records/sec\n'
+        )
 
     def get_field(self, indices=None, args=None):
-        """Write uuids of filtered contacts to stdout"""
+        """Write a field of filtered contacts to stdout, one per line.
 
-        if args.fieldname is not None:
-            matches = self.list_matches(indices)
-            for match in matches:
-                try:
-                    value = match[args.fieldname]
-                    if isinstance(value, list):
-                        value = ' '.join(value)
-                    sys.stdout.write(''.join([str(value), '\n']))
-                except KeyError(
-                    f'There is no fieldname {args.fieldname}...\n'
-                    f'Try one of [name, uuid, email, phone, tags]'
-                ):
-                    sys.exit(1)
+        Without a query, the field is read from its column, see
+        contacts.columns, rather than from every contact.
+        """
+        from .columns import field_text, fields
+
+        if args.fieldname not in fields:
+            sys.stderr.write(
+                f'There is no fieldname {args.fieldname}...\n'
+                f'Try one of [{", ".join(fields)}]\n'
+            )
+            sys.exit(1)
+        columns = None
+        if indices is None:
+            columns = self.storage.columns([args.fieldname])
+        with phase('get_field') as current:
+            if columns is not None:
+                current.records = columns.count()
+                for chunk in columns.text_chunks(args.fieldname):
+                    sys.stdout.write(chunk)
+                return
+            if indices is None:
+                indices = range(len(self.contacts))
+            current.records = len(indices)
+            for match in self.list_matches(indices):
+                sys.stdout.write(
+                    f'{field_text(match.get(args.fieldname))}\n'
+                )
 
     def delete(self, indices=None, args=None):
         """Delete filtered contacts from main data file and store in a
         deleted contacts file
         """
         matches = self.list_matches(indices)
-        sys.stderr.write('The following contacts are staged for deletion:\n')
-        self.show(indices=indices)
-        verify = input('Are you sure you want to delete these contacts? (y/n): ')
-        if verify.lower() != 'y':
-            sys.stderr.write('Exiting without deletion')
+        if not getattr(args, 'yes', False):
+            sys.stderr.write('The following contacts are staged for deletion:\n')
+            self.show(indices=indices)
+            verify = input(
+                'Are you sure you want to delete these contacts? (y/n): '
+            )
+            if verify.lower() != 'y':
+                sys.stderr.write('Exiting without deletion\n')
+                sys.exit()
         sys.stderr.write(f'exiling contacts to ... {args.backup}\n')
-        with open(args.backup, 'r+') as f:
-            try:
-                deleted = json.load(f)
-            except JSONDecodeError:
-                deleted = []
-        with open(args.backup, 'w+') as f:
-            json.dump(deleted + matches, f)
-        for index in indices:
-            self.contacts.pop(index)
+        self.deleted_archive(args.backup).append(matches)
+        self.remove_many({match['uuid'] for match in matches})
+        self.overwrite()
+
+    def undelete(self, indices=None, args=None):
+        """Restore contacts from the deleted contacts archive by uuid"""
+        found = self.deleted_archive(args.backup).get(args.uuid)
+        positions = self.positions()
+        for uuid in args.uuid:
+            if uuid not in found:
+                sys.stderr.write(f'{uuid} is not in {args.backup}\n')
+            elif uuid in positions:
+                sys.stderr.write(f'{uuid} is already a contact\n')
+            else:
+                sys.stderr.write(f'restoring contact ... {found[uuid]}\n')
+                self.insert(found.pop(uuid))
+        if not self.changes:
+            sys.exit(1)
+        self.overwrite()
+
+    def dedupe(self, indices=None, args=None):
+        """Find duplicates among filtered contacts and write a plan to merge
+        them, or apply a plan written before, see contacts.dedupe
+        """
+        import time
+        from .dedupe import plan
+
+        if args.apply is not None:
+            return self.apply_plan(args)
+        start = time.perf_counter()
+        jobs = args.jobs or os.cpu_count() or 1
+        merge_plan, stats = plan(self.list_matches(indices), args.threshold,
+                                 jobs)
+        output = json.dumps(merge_plan, indent=2) + '\n'
+        if args.plan is None:
+            sys.stdout.write(output)
+        else:
+            with open(args.plan, 'w') as f:
+                f.write(output)
+        merged = sum(len(group['merge']) for group in merge_plan['groups'])
+        sys.stderr.write(
+            f'{stats["contacts"]} contacts, {stats["pairs"]} candidate pairs '
+            f'({stats["skipped_blocks"]} blocks too large to compare), '
+            f'{stats["groups"]} groups of duplicates, {merged} contacts to '
+            f'merge, in {time.perf_counter() - start:.2f}s\n'
+        )
+
+    def apply_plan(self, args):
+        """Merge the groups of contacts in a plan written by dedupe, in one
+        write, archiving the merged contacts as delete does.
+
+        Each group is merged as it is now stored; groups whose kept
+        contact is gone, and uuids no longer stored, are left out.
+        """
+        from .dedupe import merge_contacts, read_plan
+
+        try:
+            with open(args.apply, 'r') as f:
+                groups = read_plan(f)
+        except (OSError, ValueError) as error:
+            sys.stderr.write(f'Cannot read merge plan: {error}\n')
+            sys.exit(1)
+        positions = self.positions()
+        survivors, merged = [], []
+        # Each contact is kept or merged in one group at most
+        taken = set()
+        for group in groups:
+            keep = group['keep']
+            if keep not in positions or keep in taken:
+                continue
+            others = {uuid for uuid in group['merge']
+                      if uuid in positions and uuid not in taken} - {keep}
+            if not others:
+                continue
+            taken |= others | {keep}
+            others = [self.contacts[positions[uuid]] for uuid in
+                      group['merge'] if uuid in others]
+            survivors.append(
+                merge_contacts(self.contacts[positions[keep]], others)
+            )
+            merged += others
+        if not merged:
+            sys.stderr.write('Nothing to merge\n')
+            sys.exit(1)
+        sys.stderr.write(
+            f'merging {len(merged)} contacts into {len(survivors)}, '
+            f'exiling them to ... {args.backup}\n'
+        )
+        self.deleted_archive(args.backup).append(merged)
+        self.remove_many({contact['uuid'] for contact in merged})
+        self.merge(survivors)
         self.overwrite()
+
+    def batch(self, indices=None, args=None):
+        """Apply the operations of a batch read as json lines, writing a
+        json result per operation to stdout and the contacts once at the
+        end, or nothing if any operation fails; see contacts.batch
+        """
+        from .batch import Batch
+        from .importer import open_input
+
+        batch = Batch(self)
+        applied = 0
+        with open_input(args.input_file) as f, phase('batch') as current:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                result = batch.run(line_number, line)
+                sys.stdout.write(json.dumps(result) + '\n')
+                if not result['ok']:
+                    sys.stderr.write(
+                        f'Operation on line {line_number} failed, so none '
+                        f'of the batch was written: {result["error"]}\n'
+                    )
+                    sys.exit(1)
+                applied += 1
+            current.records = applied
+        if batch.deleted:
+            sys.stderr.write(f'exiling contacts to ... {args.backup}\n')
+            self.deleted_archive(args.backup).append(batch.deleted)
+        if self.changes:
+            self.overwrite()
+            sys.stderr.write('\n')
+        sys.stderr.write(f'applied {applied} operations\n')
+
+    def sync(self, indices=None, args=None):
+        """Exchange the contacts changed since the last sync with a
+        CardDAV-style server, writing those it changed at once; see
+        contacts.sync
+        """
+        import asyncio
+        import time
+        from .sync import (
+            Client, Sync, SyncError, SyncState, digest, local_changes,
+            sync_state_path
+        )
+
+        url = getattr(args, 'url', None) or config['sync_url']
+        if url is None:
+            sys.stderr.write('No server to sync with, give --url or set '
+                             'sync_url in config.json\n')
+            sys.exit(1)
+        start = time.time()
+        state = SyncState.read(sync_state_path(self.json_path), url)
+        with phase('sync') as current:
+            changed, deleted = local_changes(self, state,
+                                             getattr(args, 'full', False))
+            try:
+                client = Client(url, args.connections, args.depth)
+                sync = Sync(client, state, args.prefer)
+
+                async def exchange():
+                    async with client:
+                        await sync.run(changed, deleted)
+
+                asyncio.run(exchange())
+            except (SyncError, OSError, ValueError) as error:
+                # ETags of contacts sent before the failure are kept, not
+                # those of the contacts fetched, which are not merged
+                state.write()
+                sys.stderr.write(f'Sync failed, no contacts were changed '
+                                 f'here: {error}\n')
+                sys.exit(1)
+            current.records = client.requests
+        positions = self.positions()
+        inbound = [
+            contact for uuid, contact in sync.pulled.items()
+            if uuid not in positions
+            or digest(self.contacts[positions[uuid]]) != digest(contact)
+        ]
+        removed = [contact for contact in self.contacts
+                   if contact['uuid'] in sync.removed]
+        self.merge(inbound)
+        if removed:
+            sys.stderr.write(f'exiling contacts to ... {args.backup}\n')
+            self.deleted_archive(args.backup).append(removed)
+            self.remove_many(sync.removed)
+        if self.changes:
+            self.overwrite()
+            sys.stderr.write('\n')
+        sync.merged()
+        state.token = sync.token
+        state.synced = start
+        state.write()
+        sys.stderr.write(
+            f'fetched {len(inbound)} contacts and removed {len(removed)}, '
+            f'sent {sync.pushed} changes ({sync.unpushed} changed on the '
+            f'server meanwhile, {sync.conflicts} conflicts kept from the '
+            f'{args.prefer}) in {client.requests} requests, '
+            f'{time.time() - start:.2f}s\n'
+        )
+
+    def owners(self, field, value):
+        """Return the contacts with a phone number or email address equal
+        to value once both are normalized, sorted by name.
+
+        Unless the contacts are already loaded, they are found through the
+        lookup index of the storage without loading them.
+        """
+        if self._contacts is None:
+            if self._lookup_index is None:
+                self._lookup_index = self.storage.lookup_index() or False
+            if self._lookup_index:
+                return sorted(self._lookup_index.find(field, value),
+                              key=sort_key)
+        value = normalize_value(field, value)
+        if self.field_index is None:
+            return [contact for contact in self.contacts
+                    if value in field_values(contact, field)]
+        uuids = self.field_index.lookup(field, value)
+        return self.list_matches(self.candidate_indices(uuids))
+
+    def lookup(self, indices=None, args=None):
+        """Write the uuid and name of the owner of each phone number and
+        email address given, a line per owner, after the value looked up
+        """
+        values = [('phone', phone) for phone in args.phone or []]
+        values += [('email', email) for email in args.email or []]
+        if args.stdin:
+            values = chain(values, (
+                ('email' if '@' in line else 'phone', line.strip())
+                for line in sys.stdin if line.strip()
+            ))
+        found, looked_up = False, 0
+        with phase('lookup') as current:
+            for field, value in values:
+                for contact in self.owners(field, value):
+                    found = True
+                    sys.stdout.write(
+                        f'{value}\t{contact["uuid"]}\t'
+                        f'{contact.get("name") or ""}\n'
+                    )
+                looked_up += 1
+            current.records = looked_up
+        if not found:
+            sys.exit(1)
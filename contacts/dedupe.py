@@ -0,0 +1,301 @@
+"""Duplicate detection and merging.
+
+Rather than comparing every pair of contacts, contacts are grouped into
+blocks by keys duplicates are likely to share: each normalized email
+address and phone number, and a phonetic key of the name. Only pairs in
+the same block are scored, so the work grows with the number of contacts
+rather than its square. Blocks larger than max_block, such as a shared
+office number, are skipped, and within a block of names only contacts
+whose names sort within window of each other are paired.
+
+A pair scores 0.5 for sharing an email address, 0.4 for sharing a phone
+number, or 0.25 if neither is shared but one of the two has neither, and
+half the similarity of their names, up to 1. Pairs scoring at least the
+threshold are duplicates, and duplicates of duplicates are grouped.
+
+Each group is merged into the contact with the most details, which keeps
+its uuid and name and gains the email addresses, phone numbers and tags
+of the others. The plan is json which may be reviewed, and edited by
+removing groups or moving uuids between keep and merge, before applying.
+"""
+import json
+import unicodedata
+from itertools import combinations
+
+from .fuzzy import edit_distance
+from .index import field_values, normalize_value
+
+# Blocks with more contacts than this are not compared within
+max_block = 100
+
+# Contacts of a name block are paired with the next window - 1 by name
+window = 10
+
+default_threshold = 0.75
+
+# Pairs scored in one task of the process pool
+chunk_size = 5000
+
+soundex_codes = {
+    **dict.fromkeys('bfpv', '1'), **dict.fromkeys('cgjkqsxz', '2'),
+    **dict.fromkeys('dt', '3'), 'l': '4', **dict.fromkeys('mn', '5'),
+    'r': '6',
+}
+
+
+def ascii_letters(text):
+    """Return the lowercase ascii letters of text, accents removed"""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(char for char in text if 'a' <= char <= 'z')
+
+
+def soundex(word):
+    """Return the American Soundex code of a word, e.g. R163 for Robert"""
+    letters = ascii_letters(word)
+    if not letters:
+        return ''
+    code = letters[0].upper()
+    previous = soundex_codes.get(letters[0])
+    for char in letters[1:]:
+        digit = soundex_codes.get(char)
+        if digit is not None and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        # h and w do not separate letters with the same code
+        if char not in 'hw':
+            previous = digit
+    return code.ljust(4, '0')
+
+
+def name_key(name):
+    """Return the phonetic key of a name: the soundex of its first and
+    last words
+    """
+    words = [word for word in (name or '').split() if ascii_letters(word)]
+    if not words:
+        return None
+    if len(words) == 1:
+        return soundex(words[0])
+    return f'{soundex(words[0])} {soundex(words[-1])}'
+
+
+def blocking_keys(contact):
+    """Return the set of keys a contact is blocked under"""
+    keys = {('email', value) for value in field_values(contact, 'email')}
+    keys |= {('phone', value) for value in field_values(contact, 'phone')}
+    keys.discard(('email', ''))
+    keys.discard(('phone', ''))
+    key = name_key(contact.get('name'))
+    if key is not None:
+        keys.add(('name', key))
+    return keys
+
+
+def candidate_pairs(contacts, max_block=max_block, window=window):
+    """Return the set of (i, j) positions, i < j, of contacts sharing a
+    block, and the number of blocks skipped for being too large
+    """
+    blocks = {}
+    for position, contact in enumerate(contacts):
+        for key in blocking_keys(contact):
+            blocks.setdefault(key, []).append(position)
+    pairs, skipped = set(), 0
+    for (field, key), block in blocks.items():
+        if field == 'name':
+            # Common names make large blocks, so only neighbours by name
+            block.sort(key=lambda i: (contacts[i].get('name') or '').lower())
+            for start in range(len(block) - 1):
+                first = block[start]
+                for other in block[start + 1:start + window]:
+                    pairs.add((min(first, other), max(first, other)))
+        elif len(block) > max_block:
+            skipped += 1
+        elif len(block) > 1:
+            pairs.update(combinations(block, 2))
+    return pairs, skipped
+
+
+def name_similarity(a, b):
+    """Return the similarity of two names from 0 to 1"""
+    a, b = (a or '').lower().strip(), (b or '').lower().strip()
+    if not a or not b:
+        return 0
+    return 1 - edit_distance(a, b) / max(len(a), len(b))
+
+
+def features(contact):
+    """Return what a contact is scored on: its sets of normalized email
+    addresses and phone numbers, and its lowercase name
+    """
+    return (
+        frozenset(field_values(contact, 'email')) - {''},
+        frozenset(field_values(contact, 'phone')) - {''},
+        (contact.get('name') or '').lower().strip(),
+    )
+
+
+def evidence(a, b):
+    """Return the part of the score of two contacts' features from their
+    email addresses and phone numbers
+    """
+    weight = 0
+    if a[0] & b[0]:
+        weight += 0.5
+    if a[1] & b[1]:
+        weight += 0.4
+    if not weight and not ((a[0] or a[1]) and (b[0] or b[1])):
+        weight = 0.25
+    return weight
+
+
+def score(a, b):
+    """Return how likely two contacts are to be the same, from 0 to 1"""
+    a, b = features(a), features(b)
+    return min(1, evidence(a, b) + name_similarity(a[2], b[2]) / 2)
+
+
+# Features of the contacts being compared, in each worker of the pool
+worker_features = None
+
+
+def set_worker_features(compared):
+    global worker_features
+    worker_features = compared
+
+
+def score_chunk(pairs, threshold, compared=None):
+    """Return the (i, j, score) of pairs of features scoring at least
+    threshold
+    """
+    if compared is None:
+        compared = worker_features
+    scored = []
+    for i, j in pairs:
+        a, b = compared[i], compared[j]
+        pair_score = evidence(a, b)
+        # Names add at most 0.5, so most pairs need not compare them
+        if pair_score + 0.5 < threshold:
+            continue
+        pair_score = min(1, pair_score + name_similarity(a[2], b[2]) / 2)
+        if pair_score >= threshold:
+            scored.append((i, j, pair_score))
+    return scored
+
+
+def score_pairs(contacts, pairs, threshold, jobs=1):
+    """Return the (i, j, score) of pairs scoring at least threshold,
+    scored in a pool of jobs processes if there are enough of them
+    """
+    pairs = sorted(pairs)
+    compared = [features(contact) for contact in contacts]
+    if jobs <= 1 or len(pairs) < 2 * chunk_size:
+        return score_chunk(pairs, threshold, compared)
+    from concurrent.futures import ProcessPoolExecutor
+
+    chunks = [pairs[i:i + chunk_size]
+              for i in range(0, len(pairs), chunk_size)]
+    with ProcessPoolExecutor(jobs, initializer=set_worker_features,
+                             initargs=(compared,)) as pool:
+        results = pool.map(score_chunk, chunks, [threshold] * len(chunks))
+        return [scored for result in results for scored in result]
+
+
+def duplicate_groups(count, scored):
+    """Return lists of positions connected by scored pairs, largest
+    first, each sorted
+    """
+    parent = list(range(count))
+
+    def root(position):
+        while parent[position] != position:
+            parent[position] = parent[parent[position]]
+            position = parent[position]
+        return position
+
+    for i, j, pair_score in scored:
+        parent[root(i)] = root(j)
+    groups = {}
+    for i, j, pair_score in scored:
+        groups.setdefault(root(i), set()).update((i, j))
+    return sorted((sorted(group) for group in groups.values()),
+                  key=lambda group: (-len(group), group))
+
+
+def details(contact):
+    """Return the number of details of a contact, to choose which of a
+    group of duplicates to keep
+    """
+    return sum(len(contact.get(field) or []) for field in
+               ('email', 'phone', 'tags')) + bool(contact.get('name'))
+
+
+def merge_contacts(keep, others):
+    """Return keep with the email addresses, phone numbers and tags of
+    others it does not have, and their name if it has none
+    """
+    merged = dict(keep)
+    for field in ('email', 'phone', 'tags'):
+        values = list(keep.get(field) or [])
+        seen = set(field_values(keep, field))
+        for other in others:
+            for value in other.get(field) or []:
+                normalized = normalize_value(field, value)
+                if normalized not in seen:
+                    seen.add(normalized)
+                    values.append(value)
+        if values or field in keep:
+            merged[field] = values
+    if not merged.get('name'):
+        merged['name'] = next(
+            (other['name'] for other in others if other.get('name')), ''
+        )
+    return merged
+
+
+def plan(contacts, threshold=default_threshold, jobs=1,
+         max_block=max_block):
+    """Return a merge plan for the duplicates among contacts and a dict
+    of statistics about finding them
+    """
+    pairs, skipped = candidate_pairs(contacts, max_block)
+    scored = score_pairs(contacts, pairs, threshold, jobs)
+    scores = {}
+    for i, j, pair_score in scored:
+        scores[i] = max(scores.get(i, 0), pair_score)
+        scores[j] = max(scores.get(j, 0), pair_score)
+    groups = []
+    for group in duplicate_groups(len(contacts), scored):
+        keep = max(group, key=lambda i: details(contacts[i]))
+        others = [i for i in group if i != keep]
+        groups.append({
+            'keep': contacts[keep]['uuid'],
+            'merge': [contacts[i]['uuid'] for i in others],
+            'score': round(min(scores[i] for i in group), 3),
+            'names': [contacts[i].get('name') for i in [keep, *others]],
+            'result': merge_contacts(contacts[keep],
+                                     [contacts[i] for i in others]),
+        })
+    stats = {
+        'contacts': len(contacts),
+        'pairs': len(pairs),
+        'skipped_blocks': skipped,
+        'duplicates': len(scored),
+        'groups': len(groups),
+    }
+    return {'threshold': threshold, 'groups': groups}, stats
+
+
+def read_plan(f):
+    """Return the groups of a plan read from f, raising ValueError if it
+    is not a plan
+    """
+    stored = json.load(f)
+    groups = stored.get('groups') if isinstance(stored, dict) else None
+    if not isinstance(groups, list) or not all(
+        isinstance(group, dict) and isinstance(group.get('keep'), str)
+        and isinstance(group.get('merge'), list)
+        for group in groups
+    ):
+        raise ValueError('not a merge plan')
+    return groups
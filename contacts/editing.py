@@ -0,0 +1,130 @@
+"""Editing many contacts in one editor session.
+
+The contacts are written to a file in one of two layouts: ndjson, a json
+object per line, or text, a block of "field: value" lines per contact
+with blocks separated by blank lines and list values by ';':
+
+    name: Rick Sanchez
+    email: rick@citadel.com; rick.sanchez@plumbus.com
+    phone: 07655266089
+    tags: family
+    uuid: ca0621e8-6b04-11eb-844f-274375519e58
+
+Lines starting with # are ignored. Once saved, the records are matched to
+the contacts by uuid: a record without a uuid is a new contact, and a
+contact without a record was removed. Records are compared with the
+contacts once both are normalized as imports are, so only records which
+really changed are stored.
+"""
+import json
+
+from .importer import list_fields, normalize
+
+formats = ('ndjson', 'text')
+
+# Fields of the text layout, in the order they are written
+text_fields = ('name', *list_fields, 'uuid')
+
+text_help = (
+    '# Edit the contacts below, one block of "field: value" lines per\n'
+    '# contact, separated by blank lines, with ; between emails, phone\n'
+    '# numbers and tags. Remove a block to delete its contact, or add one\n'
+    '# without a uuid to add a contact.\n'
+)
+
+
+def encode_text(contact):
+    """Return the block of lines of a contact in the text layout"""
+    lines = []
+    for field in text_fields:
+        value = contact.get(field)
+        if field in list_fields:
+            value = '; '.join(value or [])
+        lines.append(f'{field}: {value or ""}'.rstrip())
+    return '\n'.join(lines) + '\n'
+
+
+def encode(contacts, format):
+    """Return the contents of the file contacts are edited in"""
+    if format == 'ndjson':
+        return ''.join(f'{json.dumps(contact)}\n' for contact in contacts)
+    return text_help + ''.join(f'\n{encode_text(contact)}'
+                               for contact in contacts)
+
+
+def ndjson_records(text):
+    """Yield (line number, record) for each json object in text"""
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.strip():
+            try:
+                yield number, json.loads(line)
+            except ValueError as error:
+                raise ValueError(f'line {number}: {error}') from None
+
+
+def text_records(text):
+    """Yield (line number, record) for each block of lines in text"""
+    record, start = {}, None
+    for number, line in enumerate(text.splitlines(), 1):
+        if line.startswith('#'):
+            continue
+        if not line.strip():
+            if record:
+                yield start, record
+            record = {}
+            continue
+        field, separator, value = line.partition(':')
+        field = field.strip()
+        if not separator or field not in text_fields:
+            raise ValueError(
+                f'line {number}: expected one of {", ".join(text_fields)} '
+                f'followed by a colon'
+            )
+        if field in record:
+            raise ValueError(f'line {number}: {field} given twice')
+        if not record:
+            start = number
+        record[field] = value.strip()
+    if record:
+        yield start, record
+
+
+def parse(text, format):
+    """Return the (line number, record) pairs of an edited file, raising
+    ValueError if it cannot be read
+    """
+    records = ndjson_records if format == 'ndjson' else text_records
+    return list(records(text))
+
+
+def diff(originals, records):
+    """Return the contacts added, the (original, changed) pairs and the
+    contacts removed when originals were edited into records.
+
+    Added contacts have an empty uuid. Raise ValueError if a record is
+    not a valid contact, or has a uuid twice or not among the originals.
+    """
+    by_uuid = {contact['uuid']: contact for contact in originals}
+    seen = set()
+    added, changed = [], []
+    for number, record in records:
+        contact = normalize(record)
+        if contact is None:
+            raise ValueError(f'line {number}: a contact needs a name, and '
+                             f'lists of strings for email, phone and tags')
+        uuid = contact['uuid']
+        if not uuid:
+            added.append(contact)
+            continue
+        if uuid in seen:
+            raise ValueError(f'line {number}: {uuid} is given twice')
+        if uuid not in by_uuid:
+            raise ValueError(
+                f'line {number}: {uuid} is not one of the contacts edited'
+            )
+        seen.add(uuid)
+        original = by_uuid[uuid]
+        if contact != normalize(original):
+            changed.append((original, dict(original, **contact)))
+    removed = [contact for contact in originals if contact['uuid'] not in seen]
+    return added, changed, removed
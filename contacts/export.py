@@ -0,0 +1,147 @@
+"""Streaming export formats.
+
+Each format is a generator yielding chunks of text for an iterable of
+contacts, one record at a time, so that exporting the whole book never
+holds more than a single encoded record in memory.
+"""
+import json
+
+from .storage import encode_default
+
+formats = ('json', 'ndjson', 'csv', 'vcard')
+
+# Columns written by the csv format, list fields are joined with '; '
+csv_columns = ('uuid', 'name', 'email', 'phone', 'tags')
+
+
+def json_chunks(contacts):
+    """Yield a json array, identical to json.dumps of the whole list"""
+    separator = '['
+    for contact in contacts:
+        yield separator
+        yield json.dumps(contact, default=encode_default)
+        separator = ', '
+    yield '[]' if separator == '[' else ']'
+
+
+def ndjson_chunks(contacts):
+    """Yield one json object per line"""
+    for contact in contacts:
+        yield json.dumps(contact, default=encode_default) + '\n'
+
+
+def encoded_chunks(records, format, chunk_size=1 << 20):
+    """Yield a json array or one object per line of records already
+    encoded as json bytes, identical to json_chunks or ndjson_chunks of
+    the decoded records, several records at a time
+    """
+    if format == 'json':
+        opening, separator, closing = b'[', b', ', b']'
+    else:
+        opening, separator, closing = b'', b'\n', b'\n'
+    chunk, size = [], 0
+    for record in records:
+        chunk.append(record)
+        size += len(record)
+        if size >= chunk_size:
+            yield (opening + separator.join(chunk)).decode()
+            opening, chunk, size = separator, [], 0
+    if chunk:
+        yield (opening + separator.join(chunk) + closing).decode()
+    elif format == 'json':
+        yield '[]' if opening == b'[' else ']'
+    elif opening:
+        yield closing.decode()
+
+
+def csv_chunks(contacts, columns=csv_columns):
+    """Yield a header row followed by one row per contact"""
+    import csv
+    from io import StringIO
+
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for contact in contacts:
+        writer.writerow([
+            '; '.join(value) if isinstance(value, list) else value
+            for value in (contact.get(k) for k in columns)
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def vcard_escape(text):
+    """Escape a text value as described in RFC 6350 section 3.4"""
+    return (str(text).replace('\\', '\\\\').replace(',', '\\,')
+            .replace(';', '\\;').replace('\n', '\\n'))
+
+
+def vcard_fold(line):
+    """Fold a content line at 75 octets, continuation lines start with a space"""
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts = []
+    start, limit = 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        # Don't split a multi-byte character
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode())
+        start, limit = end, 74
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def vcard_lines(contact):
+    """Return the content lines of a vCard 4.0 for a contact"""
+    name = contact.get('name') or ''
+    lines = ['BEGIN:VCARD', 'VERSION:4.0', f'FN:{vcard_escape(name)}']
+    for email in contact.get('email') or []:
+        lines.append(f'EMAIL:{vcard_escape(email)}')
+    for phone in contact.get('phone') or []:
+        lines.append(f'TEL;VALUE=text:{vcard_escape(phone)}')
+    if contact.get('tags'):
+        tags = ','.join(vcard_escape(tag) for tag in contact['tags'])
+        lines.append(f'CATEGORIES:{tags}')
+    if contact.get('uuid'):
+        lines.append(f'UID:urn:uuid:{contact["uuid"]}')
+    lines.append('END:VCARD')
+    return lines
+
+
+def vcard_chunks(contacts):
+    """Yield one vCard per contact"""
+    for contact in contacts:
+        yield ''.join(vcard_fold(line) for line in vcard_lines(contact))
+
+
+chunk_writers = {
+    'json': json_chunks,
+    'ndjson': ndjson_chunks,
+    'csv': csv_chunks,
+    'vcard': vcard_chunks,
+}
+
+
+def write_export(contacts, f, format='json', fields=None):
+    """Write contacts to the open text file f in the given format, with
+    the csv columns being fields if given
+    """
+    if format == 'csv' and fields is not None:
+        chunks = csv_chunks(contacts, fields)
+    else:
+        chunks = chunk_writers[format](contacts)
+    for chunk in chunks:
+        f.write(chunk)
+
+
+def write_encoded(records, f, format='json'):
+    """Write records already encoded as json bytes to the open text file f
+    in the json or ndjson format
+    """
+    for chunk in encoded_chunks(records, format):
+        f.write(chunk)
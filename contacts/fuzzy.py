@@ -0,0 +1,169 @@
+"""Ranked fuzzy search over names and email addresses.
+
+Each contact is indexed under a set of terms: its lowercase name, each
+word of its name, and each email address and its local part. Terms are
+found through the padded trigrams they share with the query, so that
+only terms sharing some of its trigrams are looked at, and the best of
+those are scored by edit distance:
+
+    0     the term equals the query
+    0.5   the term starts with the query, as when completing an address
+    d     the term is d edits (including swapped letters) away from
+          the query
+    d+0.5 the term starts with something d edits away from the query
+
+A contact scores the best score of its terms and results are ranked by
+score, then name.
+"""
+from heapq import nlargest
+from pathlib import Path
+
+from .index import MappedIndex
+
+# Number of terms sharing the most trigrams with the query to score
+max_scored_terms = 200
+
+
+def fuzzy_index_path(json_path):
+    """Return the path of the fuzzy index kept next to a contacts file"""
+    return Path(f'{json_path}.fuzzy')
+
+
+def contact_terms(contact):
+    """Return the set of terms a contact is found under"""
+    terms = set()
+    name = (contact.get('name') or '').lower()
+    if name:
+        terms.add(name)
+        terms.update(name.split())
+    for email in contact.get('email') or []:
+        email = email.lower()
+        terms.add(email)
+        terms.add(email.split('@', 1)[0])
+    terms.discard('')
+    return terms
+
+
+def padded_trigrams(text):
+    """Return the trigrams of text with its start and end marked"""
+    text = f' {text} '
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def edit_distance(a, b):
+    """Return the number of insertions, deletions, substitutions and
+    transpositions of adjacent characters needed to turn a into b
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    before, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            distance = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            )
+            if (i > 1 and j > 1 and char_a == b[j - 2]
+                    and a[i - 2] == char_b):
+                distance = min(distance, before[j - 2] + 1)
+            current.append(distance)
+        before, previous = previous, current
+    return previous[-1]
+
+
+def tolerance(query):
+    """Return the number of edits allowed for a query of this length"""
+    if len(query) < 3:
+        return 0
+    return 1 if len(query) < 5 else 2
+
+
+def score(query, term, allowed):
+    """Return the score of a term for a query, or None if too different"""
+    if term == query:
+        return 0
+    if term.startswith(query):
+        return 0.5
+    best = None
+    distance = edit_distance(query, term)
+    if distance <= allowed:
+        best = distance
+    if len(term) > len(query):
+        distance = edit_distance(query, term[:len(query)])
+        if distance <= allowed and (best is None or distance + 0.5 < best):
+            best = distance + 0.5
+    return best
+
+
+class FuzzyIndex(MappedIndex):
+    """Terms of each contact, looked up by their padded trigrams.
+
+    The terms table maps each term to the contacts having it, and the
+    grams table each padded trigram to the positions of the terms having
+    it in the terms table; terms of contacts added since the index was
+    built are checked against the trigrams of the query one by one. There
+    is no scan to fall back on, so the index is built as soon as it is
+    needed.
+    """
+
+    table_names = ('terms',)
+    scans_before_build = 0
+
+    @classmethod
+    def contact_keys(cls, contact):
+        return {'terms': contact_terms(contact)}
+
+    @classmethod
+    def index_tables(cls, contacts):
+        tables = super().index_tables(contacts)
+        grams = tables['grams'] = {}
+        for i, term in enumerate(sorted(tables['terms'])):
+            for gram in padded_trigrams(term):
+                grams.setdefault(gram, []).append(i)
+        return tables
+
+    def search(self, query):
+        """Return a dict mapping uuids to their best score for query"""
+        query = query.strip().lower()
+        if not query:
+            return {}
+        terms, grams = self.tables['terms'], self.tables['grams']
+        if len(query) == 1:
+            found = grams.prefixed(f' {query}')
+            query_grams = None
+        else:
+            # The closing pad would only match terms ending with the query
+            query_grams = {gram for gram in padded_trigrams(query)
+                           if not gram.endswith(' ')}
+            found = [grams.find(gram) for gram in query_grams]
+        ordinals = {}
+        for i in found:
+            if i is None:
+                continue
+            for ordinal in grams.positions(i):
+                ordinals[ordinal] = ordinals.get(ordinal, 0) + 1
+        # The number of trigrams each term shares with the query
+        shared = {terms[ordinal]: count for ordinal, count in ordinals.items()}
+        for term in self.added['terms']:
+            if query_grams is None:
+                count = term.startswith(query)
+            else:
+                count = len(padded_trigrams(term) & query_grams)
+            if count:
+                shared[term] = max(shared.get(term, 0), count)
+        allowed = tolerance(query)
+        scores = {}
+        best_terms = nlargest(
+            max_scored_terms, shared,
+            key=lambda term: (shared[term], -abs(len(term) - len(query)))
+        )
+        for term in best_terms:
+            term_score = score(query, term, allowed)
+            if term_score is None:
+                continue
+            for uuid in self.find('terms', term):
+                if term_score < scores.get(uuid, term_score + 1):
+                    scores[uuid] = term_score
+        return scores
@@ -0,0 +1,278 @@
+"""Streaming bulk import.
+
+Input is read one record at a time in any of the export formats. Raw
+records are grouped into batches, which are decoded, validated and
+normalized in a pool of worker processes while the next batches are
+read. Only the normalized contacts are kept, to be merged into the book
+with a single write.
+"""
+import sys
+import os
+import json
+from collections import deque
+from itertools import islice
+
+suffixes = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+    '.vcf': 'vcard',
+    '.vcard': 'vcard',
+}
+
+list_fields = ('email', 'phone', 'tags')
+
+batch_size = 10000
+
+
+def guess_format(path):
+    """Return the format of an input file from its suffix, default json"""
+    return suffixes.get(os.path.splitext(str(path))[1].lower(), 'json')
+
+
+def json_records(f, chunk_size=1 << 16):
+    """Yield the items of a json array read incrementally from f"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = '', 0, False
+    started = False
+
+    def skip(chars):
+        nonlocal pos
+        while pos < len(buffer) and buffer[pos] in chars:
+            pos += 1
+
+    while True:
+        skip(' \t\r\n,' if started else ' \t\r\n')
+        if pos == len(buffer) or not started and buffer[pos] != '[':
+            if eof:
+                raise ValueError('Expected a json array of contacts')
+        elif not started:
+            started, pos = True, pos + 1
+            continue
+        elif buffer[pos] == ']':
+            return
+        else:
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as error:
+                if eof:
+                    raise ValueError(f'Invalid json: {error}') from None
+            else:
+                # A record ending at the end of the buffer may be cut short
+                if end < len(buffer) or eof:
+                    pos = end
+                    yield record
+                    continue
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer, pos = buffer[pos:] + chunk, 0
+
+
+def ndjson_records(f):
+    """Yield each non-blank line of f, to be decoded by a worker"""
+    for line in f:
+        if line.strip():
+            yield line
+
+
+def csv_records(f):
+    """Yield each row of a csv file with a header row as a dict"""
+    import csv
+
+    reader = csv.DictReader(f)
+    if reader.fieldnames is not None:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    yield from reader
+
+
+def vcard_records(f):
+    """Yield the unfolded content lines of each vCard in f"""
+    card = None
+    for line in f:
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t'):
+            if card:
+                card[-1] += line[1:]
+            continue
+        if line.upper() == 'BEGIN:VCARD':
+            card = []
+        elif line.upper() == 'END:VCARD':
+            if card is not None:
+                yield card
+            card = None
+        elif card is not None and line:
+            card.append(line)
+
+
+def vcard_split(value, separator):
+    """Split a vCard value on unescaped separators and unescape the parts"""
+    parts, part, escaped = [], [], False
+    for char in value:
+        if escaped:
+            part.append('\n' if char in 'nN' else char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char == separator:
+            parts.append(''.join(part))
+            part = []
+        else:
+            part.append(char)
+    parts.append(''.join(part))
+    return parts
+
+
+def decode_vcard(lines):
+    """Return a contact record from the content lines of a vCard"""
+    record = {'email': [], 'phone': [], 'tags': []}
+    for line in lines:
+        name, _, value = line.partition(':')
+        # Drop any group prefix and parameters from the property name
+        name = name.split(';', 1)[0].rsplit('.', 1)[-1].upper()
+        if name == 'FN':
+            record['name'] = vcard_split(value, None)[0]
+        elif name == 'EMAIL':
+            record['email'].append(vcard_split(value, None)[0])
+        elif name == 'TEL':
+            record['phone'].append(vcard_split(value, None)[0])
+        elif name == 'CATEGORIES':
+            record['tags'].extend(vcard_split(value, ','))
+        elif name == 'UID':
+            uid = vcard_split(value, None)[0]
+            record['uuid'] = uid[9:] if uid.startswith('urn:uuid:') else uid
+    return record
+
+
+decoders = {
+    'json': lambda record: record,
+    'ndjson': json.loads,
+    'csv': lambda record: record,
+    'vcard': decode_vcard,
+}
+
+readers = {
+    'json': json_records,
+    'ndjson': ndjson_records,
+    'csv': csv_records,
+    'vcard': vcard_records,
+}
+
+
+def normalize_list(value):
+    """Return a list of unique, stripped, non-empty strings, or None"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    elif not isinstance(value, list):
+        return None
+    values = []
+    for item in value:
+        if not isinstance(item, str):
+            return None
+        item = item.strip()
+        if item and item not in values:
+            values.append(item)
+    return values
+
+
+def normalize(record):
+    """Return a contact built from a decoded record, or None if invalid.
+
+    A contact must have a name. Only the known fields are kept. List
+    fields may also be given as strings separated by ';'.
+    """
+    if not isinstance(record, dict):
+        return None
+    name = record.get('name')
+    if not isinstance(name, str) or not name.strip():
+        return None
+    contact = {'name': name.strip()}
+    for field in list_fields:
+        values = normalize_list(record.get(field))
+        if values is None:
+            return None
+        contact[field] = values
+    uuid = record.get('uuid')
+    contact['uuid'] = uuid.strip() if isinstance(uuid, str) else ''
+    return contact
+
+
+def prepare_batch(format, records):
+    """Decode and normalize a batch of raw records.
+
+    Return the valid contacts and the number of records skipped.
+    """
+    decode = decoders[format]
+    contacts = []
+    for record in records:
+        try:
+            contact = normalize(decode(record))
+        except ValueError:
+            contact = None
+        if contact is not None:
+            contacts.append(contact)
+    return contacts, len(records) - len(contacts)
+
+
+def batches(records, size):
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield batch
+
+
+def prepared_batches(records, format, jobs=1, size=batch_size):
+    """Yield the prepared batches of records, in order.
+
+    With more than one job, batches are prepared in a process pool with
+    a bounded number in flight, so the input is never read far ahead.
+    """
+    if jobs <= 1:
+        for batch in batches(records, size):
+            yield prepare_batch(format, batch)
+        return
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(jobs) as pool:
+        pending = deque()
+        for batch in batches(records, size):
+            pending.append(pool.submit(prepare_batch, format, batch))
+            if len(pending) >= 2 * jobs:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def new_uuids(count):
+    """Return count random (version 4) uuids from a single urandom call"""
+    data = os.urandom(16 * count).hex()
+    return [
+        f'{data[i:i + 8]}-{data[i + 8:i + 12]}-4{data[i + 13:i + 16]}-'
+        f'{"89ab"[int(data[i + 16], 16) & 3]}{data[i + 17:i + 20]}-'
+        f'{data[i + 20:i + 32]}'
+        for i in range(0, 32 * count, 32)
+    ]
+
+
+def read_contacts(f, format, jobs=1):
+    """Return the valid contacts read from f and the number skipped.
+
+    Contacts without a uuid are given one, in batch as they arrive.
+    """
+    contacts, skipped = [], 0
+    for batch, batch_skipped in prepared_batches(readers[format](f), format,
+                                                 jobs):
+        missing = [contact for contact in batch if not contact['uuid']]
+        for contact, uuid in zip(missing, new_uuids(len(missing))):
+            contact['uuid'] = uuid
+        contacts.extend(batch)
+        skipped += batch_skipped
+    return contacts, skipped
+
+
+def open_input(path):
+    """Open path for reading as text, or stdin if path is '-'"""
+    if str(path) == '-':
+        return sys.stdin
+    return open(path, 'r', newline='')
@@ -0,0 +1,636 @@
+"""Persistent indexes used to narrow down contact queries.
+
+Each index is kept next to the contacts file in a compact binary layout
+which is memory mapped rather than read, so opening one costs the same
+whatever the size of the book. An index holds the uuids of the contacts
+indexed, in order, and one or more tables of sorted keys, each with the
+positions of the contacts having it in that order. Integers are little
+endian:
+
+    magic       4 bytes, b'CIX1'
+    length      uint32, the length of meta
+    meta        json: the fingerprint of the stored contacts indexed
+                (source), and the offset after meta and the size of the
+                uuids and of each table
+    uuids       strings
+    tables      for each table:
+        keys        strings, in sorted order
+        starts      uint32 * (keys + 1), where the positions of each key
+                    start in positions
+        positions   uint32 * entries
+
+where strings are uint32 * (strings + 1), where each string starts in
+the utf-8 strings that follow.
+
+The file is never patched. A process changing the contacts follows its
+changes in memory, beside the mapped tables, see MappedIndex, and each
+write is recorded in a log kept next to the indexes, from the
+fingerprint of the contacts before to that after it. An index written
+for an earlier version is used with the changes the log has since, and
+only a version the log does not lead to needs a new index. Building one
+costs as much as a few dozen scans, so it is only built once the same
+version has been queried scans_before_index times, and so is likely to
+be queried again; until then the file holds the number of those queries
+instead of tables.
+"""
+import json
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+
+from .cache import paused_gc
+from .conf import config
+
+magic = b'CIX1'
+
+# Queries of an unchanged version of the contacts scanning them before
+# they are indexed
+scans_before_index = 8
+
+# Bytes of changes kept in the index log
+max_log_bytes = 1 << 18
+
+
+def index_path(json_path):
+    """Return the path of the index file kept next to a contacts file"""
+    return Path(f'{json_path}.idx')
+
+
+def index_log_path(json_path):
+    """Return the path of the log of changes followed by the indexes kept
+    next to a contacts file
+    """
+    return Path(f'{json_path}.idx.log')
+
+
+def field_index_path(json_path):
+    """Return the path of the field index kept next to a contacts file"""
+    return Path(f'{json_path}.fields')
+
+
+def searchable_values(contact):
+    """Yield each field of a contact as the string matched by a query.
+
+    Lists of phone numbers, emails and tags are joined into a single
+    string so that queries behave the same with or without the index.
+    """
+    for value in contact.values():
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = ', '.join(value)
+        yield value
+
+
+def trigrams(text):
+    """Return the set of lowercase three character substrings of text"""
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def contact_trigrams(contact):
+    """Return the set of trigrams found in any field of a contact"""
+    grams = set()
+    for value in searchable_values(contact):
+        grams |= trigrams(value)
+    return grams
+
+
+def little_endian(values):
+    """Return the bytes of an array in little endian order"""
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def encode_strings(strings):
+    """Return the bytes of a list of strings"""
+    encoded = [string.encode(errors='surrogatepass') for string in strings]
+    starts = array('I', [0])
+    for string in encoded:
+        starts.append(starts[-1] + len(string))
+    return b''.join([little_endian(starts), *encoded])
+
+
+def encode_table(entries):
+    """Return the bytes of a table of a dict mapping keys to lists of
+    positions
+    """
+    keys = sorted(entries)
+    starts = array('I', [0])
+    positions = array('I')
+    for key in keys:
+        positions.extend(entries[key])
+        starts.append(len(positions))
+    return b''.join([encode_strings(keys), little_endian(starts),
+                     little_endian(positions)])
+
+
+def encode_index(meta, uuids, tables):
+    """Return the bytes of an index with meta of the contacts with uuids,
+    in order, and tables, a dict mapping table names to the dicts
+    encode_table takes
+    """
+    encoded = [encode_strings(uuids)]
+    meta = dict(meta, uuids=[0, len(uuids)], tables={})
+    offset = len(encoded[0])
+    for name, entries in tables.items():
+        meta['tables'][name] = [offset, len(entries)]
+        encoded.append(encode_table(entries))
+        offset += len(encoded[-1])
+    meta = json.dumps(meta).encode()
+    return b''.join([magic, struct.pack('<I', len(meta)), meta, *encoded])
+
+
+def index_meta(data):
+    """Return the meta of the bytes of an index, or None if they are not
+    one
+    """
+    try:
+        length, = struct.unpack_from('<I', data, 4)
+        meta = json.loads(data[8:8 + length])
+    except (struct.error, ValueError):
+        return None
+    if data[:4] != magic or not isinstance(meta, dict):
+        return None
+    return meta
+
+
+def read_index(path):
+    """Return (mapped file, meta) of the index at path, or None if it is
+    missing or unreadable
+    """
+    import mmap
+
+    try:
+        with open(path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    meta = index_meta(data)
+    if meta is None:
+        data.close()
+        return None
+    return data, meta
+
+
+def replace_file(path, data):
+    """Replace the file at path with data, ignoring failures, as an index
+    can always be rebuilt.
+
+    Like atomic_write the file is renamed into place, as other processes
+    may have the index mapped, but through a file named after the process
+    rather than one from tempfile, which queries do not otherwise import.
+    """
+    tmp_path = Path(f'{path}.{os.getpid()}.tmp')
+    try:
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+
+
+def write_stub(path, meta):
+    """Replace the index at path with meta alone"""
+    meta = json.dumps(meta).encode()
+    replace_file(path, b''.join([magic, struct.pack('<I', len(meta)), meta]))
+
+
+class Strings:
+    """A list of strings in an index, each decoded when it is read"""
+
+    def __init__(self, data, offset, size):
+        self.data = data
+        self.size = size
+        self.starts = offset
+        self.strings_start = offset + 4 * (size + 1)
+        self.end = self.strings_start + struct.unpack_from(
+            '<I', data, self.starts + 4 * size
+        )[0]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        start, end = struct.unpack_from('<2I', self.data,
+                                        self.starts + 4 * i)
+        return self.data[self.strings_start + start:self.strings_start + end] \
+            .decode(errors='surrogatepass')
+
+
+class Table:
+    """Sorted keys of an index, each with a list of positions.
+
+    Keys are looked up by bisecting the table itself, so only the keys
+    compared are decoded.
+    """
+
+    def __init__(self, data, offset, size):
+        self.data = data
+        self.size = size
+        self.keys = Strings(data, offset, size)
+        self.starts = self.keys.end
+        self.positions_start = self.starts + 4 * (size + 1)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        """Return the key at i"""
+        return self.keys[i]
+
+    def positions(self, i):
+        """Return the positions of the key at i as an array"""
+        start, end = struct.unpack_from('<2I', self.data, self.starts + 4 * i)
+        positions = array('I')
+        positions.frombytes(self.data[self.positions_start + 4 * start:
+                                      self.positions_start + 4 * end])
+        if sys.byteorder == 'big':
+            positions.byteswap()
+        return positions
+
+    def find(self, key):
+        """Return where key is in the table, or None if it is not"""
+        i = bisect_left(self, key)
+        if i < self.size and self[i] == key:
+            return i
+        return None
+
+    def get(self, key):
+        """Return the positions of key, empty if it is not in the table"""
+        i = self.find(key)
+        return () if i is None else self.positions(i)
+
+    def prefixed(self, prefix):
+        """Return the range of keys starting with prefix"""
+        start = end = bisect_left(self, prefix)
+        while end < self.size and self[end].startswith(prefix):
+            end += 1
+        return range(start, end)
+
+
+def append_log(path, before, after, changes):
+    """Record in the index log at path that the stored contacts with
+    fingerprint before became those with fingerprint after through changes,
+    a list of (op, contact).
+
+    The log is started again once it would grow past max_log_bytes, which
+    leaves indexes of versions before that to be rebuilt.
+    """
+    line = json.dumps({'from': before, 'to': after, 'changes': changes})
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        size = 0
+    try:
+        if size + len(line) < max_log_bytes:
+            with open(path, 'a') as f:
+                f.write(f'{line}\n')
+        elif len(line) < max_log_bytes:
+            with open(path, 'w') as f:
+                f.write(f'{line}\n')
+        else:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def logged_changes(path, before, after):
+    """Return the changes the index log at path has from the stored
+    contacts with fingerprint before to those with fingerprint after, or
+    None if it does not lead from one to the other
+    """
+    links = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    links[json.dumps(entry['from'])] = \
+                        (entry['to'], entry['changes'])
+                except (ValueError, KeyError, TypeError):
+                    continue
+    except OSError:
+        return None
+    changes = []
+    for step in range(len(links)):
+        if before == after:
+            return changes
+        before, step_changes = links.get(json.dumps(before), (None, ()))
+        if before is None:
+            return None
+        changes.extend(step_changes)
+    return changes if before == after else None
+
+
+class MappedIndex:
+    """An index in the layout described above, with the changes made to
+    the contacts since it was built.
+
+    Subclasses give the keys each contact is indexed under in each table.
+    Contacts added or changed since the index was built are indexed in
+    memory, and those removed or changed are left out of what the mapped
+    tables give, so that the index follows the contacts list without
+    being rebuilt.
+    """
+
+    # Names of the tables of the index
+    table_names = ()
+
+    # Queries scanning the contacts before they are indexed
+    scans_before_build = scans_before_index
+
+    def __init__(self, path, data, meta):
+        self.path = path
+        self.data = data
+        self.source = meta['source']
+        base = 8 + struct.unpack_from('<I', data, 4)[0]
+        self.indexed = Strings(data, base + meta['uuids'][0],
+                               meta['uuids'][1])
+        self.tables = {
+            name: Table(data, base + offset, size)
+            for name, (offset, size) in meta['tables'].items()
+        }
+        # uuids of the contacts indexed which were changed or removed since
+        self.removed = set()
+        # Contacts added or changed since by uuid, and their keys in each
+        # table mapped to sets of their uuids
+        self.added_contacts = {}
+        self.added = {name: {} for name in self.tables}
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.path})'
+
+    @classmethod
+    def meta(cls, source):
+        """Return what an index must have been written with to be used for
+        the stored contacts with fingerprint source
+        """
+        return {'source': source}
+
+    @classmethod
+    def contact_keys(cls, contact):
+        """Return a dict mapping table names to the set of keys a contact
+        is indexed under in each
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def index_tables(cls, contacts):
+        """Return the tables of an index of contacts, see encode_index"""
+        tables = {name: {} for name in cls.table_names}
+        for position, contact in enumerate(contacts):
+            for name, keys in cls.contact_keys(contact).items():
+                entries = tables[name]
+                for key in keys:
+                    entries.setdefault(key, []).append(position)
+        return tables
+
+    @classmethod
+    def build(cls, path, source, contacts):
+        """Build the index of a list of contacts, and save it unless source,
+        the fingerprint of the stored contacts, is None
+        """
+        # Like decoding, building makes many small sets and lists
+        with paused_gc():
+            tables = cls.index_tables(contacts)
+        data = encode_index(cls.meta(source),
+                            [contact['uuid'] for contact in contacts], tables)
+        if source is not None:
+            replace_file(path, data)
+        return cls(path, data, index_meta(data))
+
+    @classmethod
+    def open(cls, path, source, contacts, log_path, changes=()):
+        """Return the index of contacts, or None if they are to be scanned.
+
+        contacts are the stored contacts with fingerprint source, taken
+        when they were loaded, and changes the (op, contact) changes made
+        to them since. The index at path is used if it was written for
+        source, or for an earlier version the index log at log_path leads
+        from. Otherwise the query is counted in its place, and once there
+        were scans_before_build of them the index is built, and saved
+        unless there are changes.
+        """
+        expected = cls.meta(source)
+        scans = 0
+        stored = read_index(path)
+        if stored is not None:
+            data, meta = stored
+            if all(meta.get(key) == value for key, value in expected.items()
+                   if key != 'source'):
+                if 'tables' not in meta:
+                    if meta.get('source') == source:
+                        scans = meta.get('scans', 0)
+                elif meta['source'] == source:
+                    return cls(path, data, meta).apply(changes)
+                else:
+                    logged = logged_changes(log_path, meta['source'], source)
+                    if logged is not None:
+                        return cls(path, data, meta).apply(logged) \
+                            .apply(changes)
+            data.close()
+        if scans >= cls.scans_before_build:
+            return cls.build(path, None if changes else source, contacts)
+        write_stub(path, dict(expected, scans=scans + 1))
+        return None
+
+    def apply(self, changes):
+        """Follow (op, contact) changes made to the contacts, returning the
+        index
+        """
+        for op, contact in changes:
+            if op == 'delete':
+                self.remove(contact['uuid'])
+            else:
+                self.add(contact)
+        return self
+
+    def add(self, contact):
+        """Index a contact added to the contacts list, or replacing the
+        contact with its uuid
+        """
+        uuid = contact['uuid']
+        self.remove(uuid)
+        self.added_contacts[uuid] = contact
+        for name, keys in self.contact_keys(contact).items():
+            added = self.added[name]
+            for key in keys:
+                added.setdefault(key, set()).add(uuid)
+
+    def remove(self, uuid):
+        """Leave out the contact with uuid, removed from the contacts list"""
+        self.removed.add(uuid)
+        contact = self.added_contacts.pop(uuid, None)
+        if contact is None:
+            return
+        for name, keys in self.contact_keys(contact).items():
+            added = self.added[name]
+            for key in keys:
+                uuids = added[key]
+                uuids.discard(uuid)
+                if not uuids:
+                    del added[key]
+
+    def uuids(self, positions):
+        """Return the set of uuids of the contacts indexed at positions
+        which were not changed or removed since
+        """
+        indexed = self.indexed
+        uuids = {indexed[position] for position in positions}
+        if self.removed:
+            uuids -= self.removed
+        return uuids
+
+    def find(self, name, key):
+        """Return the uuids of the contacts with key in a table"""
+        return self.uuids(self.tables[name].get(key)) \
+            | self.added[name].get(key, set())
+
+    def select(self, name, test, keys=None):
+        """Return the uuids of the contacts with a key in a table for which
+        test is true, testing only the range keys of the mapped table if
+        given
+        """
+        table = self.tables[name]
+        if keys is None:
+            keys = range(len(table))
+        uuids = self.uuids(
+            position for i in keys if test(table[i])
+            for position in table.positions(i)
+        )
+        for key, added in self.added[name].items():
+            if test(key):
+                uuids |= added
+        return uuids
+
+
+class TrigramIndex(MappedIndex):
+    """Inverted index from trigrams to the contacts having them"""
+
+    table_names = ('grams',)
+
+    @classmethod
+    def contact_keys(cls, contact):
+        return {'grams': contact_trigrams(contact)}
+
+    def candidates(self, query):
+        """Return uuids of contacts which may contain query.
+
+        Return None if the query is too short to be looked up, in which
+        case every contact is a candidate.
+        """
+        grams = trigrams(query)
+        if not grams:
+            return None
+        # Contacts are either indexed in the mapped table or added since,
+        # so each side is intersected on its own
+        postings = sorted(
+            (self.tables['grams'].get(gram) for gram in grams), key=len
+        )
+        result = set(postings[0])
+        for positions in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(positions)
+        added = self.added['grams']
+        uuids = set(added.get(grams.pop(), ()))
+        for gram in grams:
+            if not uuids:
+                break
+            uuids &= added.get(gram, set())
+        return self.uuids(result) | uuids
+
+
+# List fields with a hash index from normalized value to uuids
+indexed_fields = ('email', 'phone', 'tags')
+
+# Changed whenever normalize_value does, so stored field indexes are rebuilt
+normalize_version = 2
+
+
+def normalize_phone(value, country_code=None):
+    """Return the digits of a phone number in E.164 form, without the +.
+
+    Numbers written with + or the 00 international prefix keep their
+    country code. Numbers with a national 0 prefix are given country_code
+    in its place, if there is one; otherwise they, like numbers with no
+    prefix at all, are left as digits.
+    """
+    digits = ''.join(char for char in value if char.isdigit())
+    if value.lstrip().startswith('+'):
+        return digits
+    if digits.startswith('00'):
+        return digits[2:]
+    if country_code and digits.startswith('0'):
+        return country_code + digits[1:]
+    return digits
+
+
+def normalization():
+    """Return what normalized values depend on, stored with indexes of them
+    so that they are rebuilt when it changes
+    """
+    return [normalize_version, config['country_code']]
+
+
+def normalize_value(field, value):
+    """Return a field value in the form it is indexed and compared in"""
+    if field == 'phone':
+        return normalize_phone(value, config['country_code'])
+    if field == 'email':
+        return value.strip().casefold()
+    return value.lower()
+
+
+def field_values(contact, field):
+    """Return the normalized values of a field of a contact as a list"""
+    value = contact.get(field)
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        value = [value]
+    return [normalize_value(field, item) for item in value]
+
+
+class FieldIndex(MappedIndex):
+    """Per-field indexes of the contacts list.
+
+    Lowercase names are kept sorted for prefix search, as are each
+    normalized email, phone number and tag, each with the contacts which
+    have it.
+    """
+
+    table_names = ('name', *indexed_fields)
+
+    @classmethod
+    def meta(cls, source):
+        return dict(super().meta(source), normalization=normalization())
+
+    @classmethod
+    def contact_keys(cls, contact):
+        return {field: set(field_values(contact, field))
+                for field in cls.table_names}
+
+    def name_prefix(self, prefix, exact=False):
+        """Return uuids of contacts whose lowercase name starts with prefix,
+        or equals it if exact
+        """
+        return self.lookup('name', prefix, 'exact' if exact else 'prefix')
+
+    def lookup(self, field, value, op='exact'):
+        """Return uuids of contacts with a field value matching value.
+
+        op is 'exact', 'prefix' or 'contains'. Exact and prefix lookups
+        bisect the sorted values; contains checks each distinct value.
+        """
+        if op == 'exact':
+            return self.find(field, value)
+        if op == 'prefix':
+            return self.select(field, lambda key: key.startswith(value),
+                               self.tables[field].prefixed(value))
+        return self.select(field, lambda key: value in key)
@@ -0,0 +1,203 @@
+"""Reverse lookup of the contacts owning phone numbers and email addresses.
+
+The lookup index is a hash table kept next to the contacts file, from each
+normalized phone number and email address (see index.normalize_value) to
+the byte offsets of the lines of the contacts having it in the snapshot
+written by storage.encode_lines. Finding the owners of a value reads one
+bucket of the table and decodes only the lines it points to, each checked
+to really have the value, so a lookup costs the same whatever the size of
+the book. Both files are memory mapped rather than read.
+
+Layout of the index, integers being little endian:
+
+    magic       4 bytes, b'CLK1'
+    length      uint32, the length of meta
+    meta        json: the fingerprint of the snapshot indexed (source), the
+                normalization of values, and the number of buckets and of
+                entries
+    starts      uint64 * (buckets + 1), where each bucket's entries start
+    hashes      uint32 * entries, the crc32 of 'field:value' of each entry
+    offsets     uint64 * entries, the offset of the line of each entry
+
+Once the index exists it is written with every snapshot, and it is rebuilt
+from the snapshot when it was written for another one, or before the
+country code phone numbers are normalized with was changed.
+"""
+import json
+import struct
+import zlib
+from array import array
+from pathlib import Path
+
+from .index import (
+    field_values, little_endian, normalization, normalize_value
+)
+from .storage import atomic_write
+
+lookup_fields = ('phone', 'email')
+magic = b'CLK1'
+
+
+def lookup_index_path(json_path):
+    """Return the path of the lookup index kept next to a contacts file"""
+    return Path(f'{json_path}.lookup')
+
+
+def key_hash(field, value):
+    """Return the hash a normalized field value is stored under"""
+    return zlib.crc32(f'{field}:{value}'.encode())
+
+
+def line_offsets(lines):
+    """Yield the byte offset of each line in storage.join_lines(lines)"""
+    offset = 2
+    for line in lines:
+        yield offset
+        offset += len(line) + 2
+
+
+def snapshot_lines(path):
+    """Yield (offset, contact) for each line of a file written by
+    storage.encode_lines. Raise ValueError if the file has another layout.
+    """
+    with open(path, 'rb') as f:
+        line = f.readline()
+        if line != b'[\n':
+            raise ValueError(f'{path} does not have one contact per line')
+        offset = len(line)
+        for line in f:
+            if line.startswith(b'{'):
+                yield offset, json.loads(line.rstrip(b',\n'))
+            elif line not in (b'\n', b']\n'):
+                raise ValueError(f'{path} does not have one contact per line')
+            offset += len(line)
+
+
+def encode_index(source, located):
+    """Return the bytes of an index of (offset, contact) pairs"""
+    entries = []
+    for offset, contact in located:
+        for field in lookup_fields:
+            for value in set(field_values(contact, field)):
+                if value:
+                    entries.append((key_hash(field, value), offset))
+    buckets = max(len(entries), 1)
+    starts = array('Q', bytes(8 * (buckets + 1)))
+    for key, offset in entries:
+        starts[key % buckets + 1] += 1
+    for bucket in range(buckets):
+        starts[bucket + 1] += starts[bucket]
+    entries.sort(key=lambda entry: entry[0] % buckets)
+    hashes = array('I', [key for key, offset in entries])
+    offsets = array('Q', [offset for key, offset in entries])
+    meta = json.dumps({
+        'source': source, 'normalization': normalization(),
+        'buckets': buckets, 'entries': len(entries),
+    }).encode()
+    return b''.join([
+        magic, struct.pack('<I', len(meta)), meta,
+        little_endian(starts), little_endian(hashes), little_endian(offsets),
+    ])
+
+
+class LookupIndex:
+    """Memory mapped hash table from phone numbers and emails to lines of
+    a snapshot
+    """
+
+    def __init__(self, path, table, snapshot, meta):
+        self.path = path
+        self.table = table
+        self.snapshot = snapshot
+        self.buckets = meta['buckets']
+        self.source = meta['source']
+        # Where the starts, hashes and offsets arrays begin in table
+        self.starts_start = 8 + struct.unpack_from('<I', table, 4)[0]
+        self.hashes_start = self.starts_start + 8 * (self.buckets + 1)
+        self.offsets_start = self.hashes_start + 4 * meta['entries']
+
+    def __repr__(self):
+        return f'LookupIndex({self.path})'
+
+    @classmethod
+    def write(cls, path, source, located):
+        """Write an index of (offset, contact) pairs for the snapshot with
+        fingerprint source
+        """
+        data = encode_index(source, located)
+        atomic_write(path, lambda f: f.write(data), sync=False, mode='wb')
+
+    @classmethod
+    def read(cls, path, snapshot, source):
+        """Return the index at path if it was written for source, else None"""
+        import mmap
+
+        try:
+            with open(path, 'rb') as f:
+                table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            length, = struct.unpack_from('<I', table, 4)
+            meta = json.loads(table[8:8 + length])
+        except (struct.error, ValueError):
+            meta = None
+        if table[:4] != magic or meta is None \
+                or meta.get('source') != source \
+                or meta.get('normalization') != normalization():
+            table.close()
+            return None
+        with open(snapshot, 'rb') as f:
+            lines = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(path, table, lines, meta)
+
+    @classmethod
+    def open(cls, path, snapshot, source):
+        """Return the index of the snapshot with fingerprint source,
+        rebuilding it from the snapshot if it is missing or out of date.
+
+        Raise ValueError if the snapshot is not one contact per line. The
+        snapshot must not be replaced while the index is opened.
+        """
+        index = cls.read(path, snapshot, source)
+        if index is None:
+            cls.write(path, source, snapshot_lines(snapshot))
+            index = cls.read(path, snapshot, source)
+        return index
+
+    def close(self):
+        self.table.close()
+        self.snapshot.close()
+
+    def line(self, offset):
+        """Return the contact on the line of the snapshot at offset"""
+        end = self.snapshot.find(b'\n', offset)
+        return json.loads(self.snapshot[offset:end].rstrip(b','))
+
+    def find(self, field, value):
+        """Return the contacts having a phone number or email address
+        equal to value once both are normalized
+        """
+        value = normalize_value(field, value)
+        if not value:
+            return []
+        key = key_hash(field, value)
+        bucket = key % self.buckets
+        start, end = struct.unpack_from(
+            '<2Q', self.table, self.starts_start + 8 * bucket
+        )
+        contacts = []
+        for entry in range(start, end):
+            stored, = struct.unpack_from(
+                '<I', self.table, self.hashes_start + 4 * entry
+            )
+            if stored != key:
+                continue
+            offset, = struct.unpack_from(
+                '<Q', self.table, self.offsets_start + 8 * entry
+            )
+            contact = self.line(offset)
+            # Different values may share a hash
+            if value in field_values(contact, field):
+                contacts.append(contact)
+        return contacts
@@ -0,0 +1,76 @@
+"""Secondary orders of the contacts list.
+
+Contacts are always kept sorted by name. Other orders are given as sort
+keys here and computed by ContactManager.order, which caches the result
+until the contacts change.
+
+The time each contact was last changed is kept in an append-only log
+next to the contacts file, written as part of every commit, so ordering
+by recently modified costs O(changes) per write rather than keeping a
+timestamp in every stored record.
+"""
+import json
+import time
+from pathlib import Path
+
+orders = ('name', 'tags', 'modified')
+
+
+def modified_log_path(json_path):
+    """Return the path of the modification log kept next to a contacts file"""
+    return Path(f'{json_path}.modified')
+
+
+def tags_key(contact):
+    """Sort key grouping contacts by their first tag, untagged last"""
+    tags = sorted(tag.lower() for tag in contact.get('tags') or [])
+    return (0, tags[0]) if tags else (1, '')
+
+
+class ModifiedLog:
+    """Append-only log of the times contacts were last modified"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __repr__(self):
+        return f'ModifiedLog({self.path})'
+
+    def read(self):
+        """Return a dict mapping uuids to the time they were last modified.
+
+        The log is rewritten with only the latest entries once most of
+        its lines are out of date.
+        """
+        times, lines = {}, 0
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        uuid, modified = json.loads(line)
+                    except ValueError:
+                        continue
+                    times[uuid] = modified
+                    lines += 1
+        except FileNotFoundError:
+            return times
+        if lines > 2 * len(times) + 1000:
+            self.rewrite(times)
+        return times
+
+    def touch(self, uuids, modified=None):
+        """Record that the contacts with uuids were modified now"""
+        if modified is None:
+            modified = time.time()
+        lines = ''.join(json.dumps([uuid, modified]) + '\n' for uuid in uuids)
+        if lines:
+            with open(self.path, 'a') as f:
+                f.write(lines)
+
+    def rewrite(self, times):
+        from .storage import atomic_write
+
+        atomic_write(self.path, lambda f: f.write(''.join(
+            json.dumps([uuid, modified]) + '\n'
+            for uuid, modified in times.items()
+        )), sync=False)
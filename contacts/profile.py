@@ -0,0 +1,171 @@
+"""Per-phase timing of a contacts command.
+
+Code which may be slow is wrapped in a phase:
+
+    with phase('load') as current:
+        contacts = read()
+        current.records = len(contacts)
+
+When profiling is enabled, with --profile or the CONTACTS_PROFILE
+environment variable, each phase records its wall and CPU time, the bytes
+the process read and wrote, the number of records it handled and the
+peak memory of the process when it ended. The phases are written to
+stderr as json when the command exits. Phases may be nested, in which
+case the time of the inner phase is also counted in the outer one.
+
+--profile-dump FILE, or CONTACTS_PROFILE_DUMP, also runs the command under
+cProfile and writes its stats to FILE, to be read with pstats.
+
+When profiling is disabled phase returns the same do-nothing object every
+time, so the hooks cost a function call each.
+"""
+import json
+import os
+import sys
+import time
+
+profiling = False
+phases = []
+started = None
+profiler = None
+dump_path = None
+
+
+class NullPhase:
+    """Phase used when profiling is disabled, which records nothing"""
+
+    records = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+null_phase = NullPhase()
+
+
+def io_bytes():
+    """Return the (read, written) byte counts of this process, or Nones
+    where the platform does not report them
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            counts = dict(line.split(': ') for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return None, None
+    return int(counts['rchar']), int(counts['wchar'])
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of this process"""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return round(peak / 2**20 if sys.platform == 'darwin' else peak / 2**10, 1)
+
+
+class Phase:
+    """A timed part of a command"""
+
+    def __init__(self, name):
+        self.name = name
+        self.records = None
+
+    def __enter__(self):
+        self.read, self.written = io_bytes()
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        read, written = io_bytes()
+        phases.append({
+            'phase': self.name,
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'read_bytes': None if read is None else read - self.read,
+            'written_bytes': None if written is None
+                             else written - self.written,
+            'records': self.records,
+            'peak_rss_mb': peak_rss_mb(),
+        })
+        return False
+
+
+def phase(name):
+    """Return a context manager timing the named phase of the command"""
+    if not profiling:
+        return null_phase
+    return Phase(name)
+
+
+def requested(argv, value_options=(), environ=os.environ):
+    """Return (enabled, dump path) as asked for by the options before the
+    subcommand in argv or by the environment. value_options are the other
+    options taking a value, which is skipped.
+    """
+    enabled = environ.get('CONTACTS_PROFILE', '') not in ('', '0')
+    dump = environ.get('CONTACTS_PROFILE_DUMP') or None
+    args = iter(argv)
+    for arg in args:
+        if arg == '--profile':
+            enabled = True
+        elif arg == '--profile-dump':
+            dump = next(args, None)
+        elif arg.startswith('--profile-dump='):
+            dump = arg.split('=', 1)[1]
+        elif arg in value_options:
+            next(args, None)
+        elif not arg.startswith('-'):
+            break
+    return enabled or dump is not None, dump
+
+
+def start(argv=None, value_options=()):
+    """Start profiling if it was requested, before any other work is done"""
+    global profiling, started, profiler, dump_path
+
+    if argv is None:
+        argv = sys.argv[1:]
+    profiling, dump_path = requested(argv, value_options)
+    if not profiling:
+        return
+    del phases[:]
+    started = (time.perf_counter(), time.process_time())
+    if dump_path is not None:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+
+def report():
+    """Write the recorded phases to stderr as json and dump the cProfile
+    stats, if profiling
+    """
+    if not profiling:
+        return
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(dump_path)
+    from .cache import stats
+
+    wall, cpu = started
+    sys.stderr.write(json.dumps({
+        'phases': phases,
+        'total': {
+            'wall_s': round(time.perf_counter() - wall, 6),
+            'cpu_s': round(time.process_time() - cpu, 6),
+            'peak_rss_mb': peak_rss_mb(),
+        },
+        'cache': dict(stats),
+        'profile_dump': None if dump_path is None else str(dump_path),
+    }) + '\n')
@@ -0,0 +1,279 @@
+"""Field-scoped query language.
+
+A query is a list of terms, all of which must match:
+
+    name:smith tag:work email:@acme.com -tag:archived
+
+A term is either a bare word, matched against every field as before, or
+field:value for one of the fields name, email, phone, tag and uuid. The
+value matches if it is contained in the field, starts it if it ends with
+'*' (name:rick*) or equals it if it begins with '=' (email:=rick@c137.com).
+Values are case insensitive, phone numbers are compared by their digits
+and values with spaces may be quoted (name:="Rick Sanchez").
+
+Terms are combined with AND (implied), OR and NOT, or negated with a
+leading '-', and may be grouped with parentheses.
+
+A query is planned by asking each term for the uuids of the contacts it
+can match, using the field index where it can and the trigram index for
+substrings, or the storage if it is searchable and nothing was loaded
+yet. Conjunctions intersect these starting from the smallest set and
+anything the indexes cannot narrow down falls back to a scan. Each
+candidate is then checked against the whole query.
+"""
+import re
+from math import inf
+
+from .index import field_values, normalize_value, searchable_values
+
+# Field names used in queries and the contact fields they refer to
+fields = {
+    'name': 'name',
+    'email': 'email',
+    'phone': 'phone',
+    'tag': 'tags',
+    'tags': 'tags',
+    'uuid': 'uuid',
+}
+
+keywords = ('AND', 'OR', 'NOT')
+
+quoted = r'"(?:[^"\\]|\\.)*"'
+token_pattern = re.compile(
+    rf'\s*(?:(\()|(\))|({quoted})|([^\s()"]+(?:{quoted})?))'
+)
+structured_pattern = re.compile(
+    rf'(?:^|[\s(])-?(?:{"|".join(fields)}):|(?:^|\s)(?:{"|".join(keywords)})'
+    rf'(?:\s|$)|[()]'
+)
+
+
+class QueryError(ValueError):
+    """Raised for a query which cannot be parsed"""
+
+
+def is_structured(query):
+    """Return True if query uses the query language rather than being a
+    plain substring
+    """
+    return structured_pattern.search(query) is not None
+
+
+def unquote(text):
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        return re.sub(r'\\(.)', r'\1', text[1:-1])
+    return text
+
+
+class Term:
+    """Match a value against one field, or any field if field is None"""
+
+    def __init__(self, field, op, value):
+        self.field = field
+        self.op = op
+        self.value = value
+
+    def __repr__(self):
+        return f'Term({self.field}, {self.op}, {self.value!r})'
+
+    def test(self, text):
+        if self.op == 'exact':
+            return text == self.value
+        if self.op == 'prefix':
+            return text.startswith(self.value)
+        return self.value in text
+
+    def matches(self, contact):
+        if self.field is None:
+            values = (value.lower() for value in searchable_values(contact))
+        else:
+            values = field_values(contact, self.field)
+        return any(self.test(value) for value in values)
+
+    def candidates(self, manager):
+        if manager.storage.searchable and manager._contacts is None:
+            return manager.storage.field_search(self.field, self.value,
+                                                self.op)
+        # Loaded contacts may have been changed since they were stored, so
+        # they are left to the indexes, which the storage has none of unless
+        # built in memory, as a batch does
+        if self.field is None or self.field == 'name' and self.op == 'contains':
+            index = manager.index
+            return None if index is None else index.candidates(self.value)
+        if self.field == 'uuid':
+            return {uuid for uuid in manager.positions() if self.test(uuid)}
+        index = manager.field_index
+        if index is None:
+            return None
+        if self.field == 'name':
+            return index.name_prefix(self.value, exact=self.op == 'exact')
+        return index.lookup(self.field, self.value, self.op)
+
+
+class Not:
+    """Match contacts which do not match a query"""
+
+    def __init__(self, child):
+        self.child = child
+
+    def __repr__(self):
+        return f'Not({self.child})'
+
+    def matches(self, contact):
+        return not self.child.matches(contact)
+
+    def candidates(self, manager):
+        return None
+
+
+class And:
+    """Match contacts matching every one of a list of queries"""
+
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f'And({self.children})'
+
+    def matches(self, contact):
+        return all(child.matches(contact) for child in self.children)
+
+    def candidates(self, manager):
+        """Intersect the candidates of each child, smallest first.
+
+        The children are also reordered so that the most selective are
+        checked first when matching.
+        """
+        sizes = {}
+        found = []
+        for child in self.children:
+            uuids = child.candidates(manager)
+            if uuids is not None:
+                sizes[id(child)] = len(uuids)
+                found.append(uuids)
+        self.children.sort(key=lambda child: sizes.get(id(child), inf))
+        if not found:
+            return None
+        found.sort(key=len)
+        result = set(found[0])
+        for uuids in found[1:]:
+            if not result:
+                break
+            result &= uuids
+        return result
+
+
+class Or:
+    """Match contacts matching any of a list of queries"""
+
+    def __init__(self, children):
+        self.children = children
+
+    def __repr__(self):
+        return f'Or({self.children})'
+
+    def matches(self, contact):
+        return any(child.matches(contact) for child in self.children)
+
+    def candidates(self, manager):
+        result = set()
+        for child in self.children:
+            uuids = child.candidates(manager)
+            if uuids is None:
+                return None
+            result |= uuids
+        return result
+
+
+def tokenize(query):
+    """Return the list of tokens in a query"""
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = token_pattern.match(query, position)
+        if match is None or match.end() == position:
+            raise QueryError(f'Unexpected text at {query[position:]!r}')
+        tokens.append(next(group for group in match.groups() if group))
+        position = match.end()
+    return tokens
+
+
+def parse_term(token):
+    """Return the query matching a single term"""
+    negated = token.startswith('-') and len(token) > 1
+    if negated:
+        token = token[1:]
+    field = None
+    name, colon, value = token.partition(':')
+    if colon and name.lower() in fields:
+        field = fields[name.lower()]
+        token = value
+    op = 'contains'
+    if token.startswith('=') and field is not None:
+        op, token = 'exact', token[1:]
+    token = unquote(token)
+    if token.endswith('*'):
+        op, token = 'prefix', token[:-1]
+    value = normalize_value(field, token)
+    if not value:
+        raise QueryError(f'Missing value in {name}{colon}{token}')
+    term = Term(field, op, value)
+    return Not(term) if negated else term
+
+
+class Parser:
+    """Recursive descent parser for the query language"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        query = self.parse_or()
+        if self.peek() is not None:
+            raise QueryError(f'Unexpected {self.peek()!r}')
+        return query
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == 'OR':
+            self.take()
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek() not in (None, ')', 'OR'):
+            if self.peek() == 'AND':
+                self.take()
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        token = self.take()
+        if token is None or token in (')', 'AND', 'OR'):
+            raise QueryError(f'Expected a term, not {token or "the end"}')
+        if token == 'NOT':
+            return Not(self.parse_not())
+        if token == '(':
+            query = self.parse_or()
+            if self.take() != ')':
+                raise QueryError('Missing )')
+            return query
+        return parse_term(token)
+
+
+def parse(query):
+    """Return the parsed form of a query string"""
+    return Parser(tokenize(query)).parse()
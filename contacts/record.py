@@ -0,0 +1,247 @@
+"""Compact in-memory representations of contacts.
+
+Contacts are normally held as dicts of lists, as they are stored. For
+large books held in memory for a long time this module provides two
+smaller forms, both read through the same mapping interface and both
+converting back to exactly the stored json shape:
+
+Contact is a record with __slots__, tuples in place of lists, interned
+tags and the uuid kept as its 16 bytes. The server holds its resident
+book as Contact records, see compact.
+
+ContactTable holds a whole book column by column: strings are packed into
+a single buffer per field with an array of offsets, uuids into one
+bytearray and tags into an array of ids into a table of distinct tags.
+Rows are decoded into dicts when read.
+"""
+import sys
+from array import array
+from collections.abc import Mapping, Sequence
+
+# Fields in the order they are stored in
+fields = ('name', 'email', 'phone', 'uuid', 'tags')
+list_fields = ('email', 'phone', 'tags')
+
+# Marks a field a contact does not have
+absent = object()
+
+
+def pack_uuid(uuid):
+    """Return the 16 bytes of a uuid string, or the string itself if it
+    is not in the canonical form
+    """
+    if type(uuid) is not str or len(uuid) != 36:
+        return uuid
+    try:
+        packed = bytes.fromhex(uuid.replace('-', ''))
+    except ValueError:
+        return uuid
+    # Dashes elsewhere, or upper case digits, would not be written back
+    return packed if unpack_uuid(packed) == uuid else uuid
+
+
+def unpack_uuid(uuid):
+    """Return the string form of a uuid returned by pack_uuid"""
+    if type(uuid) is not bytes:
+        return uuid
+    # Several times faster than str(uuid.UUID(bytes=uuid))
+    digits = uuid.hex()
+    return f'{digits[:8]}-{digits[8:12]}-{digits[12:16]}-' \
+           f'{digits[16:20]}-{digits[20:]}'
+
+
+class Contact(Mapping):
+    """A contact record using as little memory as a python object can.
+
+    Reads like the dict it was made from: list fields are returned as
+    new lists and the uuid as a string.
+    """
+
+    __slots__ = ('name', 'email', 'phone', '_uuid', 'tags')
+
+    def __init__(self, name=absent, email=absent, phone=absent, uuid=absent,
+                 tags=absent):
+        self.name = name
+        self.email = email if email is None or email is absent \
+            else tuple(email)
+        self.phone = phone if phone is None or phone is absent \
+            else tuple(phone)
+        self._uuid = uuid if uuid is absent else pack_uuid(uuid)
+        self.tags = tags if tags is None or tags is absent \
+            else tuple(sys.intern(tag) for tag in tags)
+
+    @classmethod
+    def from_dict(cls, contact):
+        """Return a Contact holding the known fields of a dict"""
+        return cls(**{k: v for k, v in contact.items() if k in fields})
+
+    def __repr__(self):
+        return f'Contact({dict(self)})'
+
+    def _get(self, key):
+        if key == 'name':
+            return self.name
+        if key == 'uuid':
+            return unpack_uuid(self._uuid)
+        if key in list_fields:
+            value = getattr(self, key)
+            return list(value) if type(value) is tuple else value
+        return absent
+
+    def __getitem__(self, key):
+        value = self._get(key)
+        if value is absent:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key in fields if self._get(key) is not absent)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        return default if value is absent else value
+
+    def values(self):
+        # Read without _get, as queries scan every value, see
+        # index.searchable_values
+        return [list(value) if type(value) is tuple else value
+                for value in (self.name, self.email, self.phone,
+                              unpack_uuid(self._uuid), self.tags)
+                if value is not absent]
+
+    def to_dict(self):
+        """Return the contact in its stored json shape"""
+        return dict(self)
+
+
+def compact(contact):
+    """Return a Contact holding a contact loaded as a dict, or the dict
+    itself if it has other fields, or fields in another order or of other
+    types, which a Contact would not write back the same
+    """
+    if type(contact) is not dict or tuple(contact) != fields \
+            or not isinstance(contact['name'], str) \
+            or not isinstance(contact['uuid'], str) \
+            or not all(isinstance(contact[field], list)
+                       and all(isinstance(value, str)
+                               for value in contact[field])
+                       for field in list_fields):
+        return contact
+    return Contact(**contact)
+
+
+class StringColumn:
+    """Strings packed into one utf-8 buffer, with an array of offsets"""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('Q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, position):
+        start, end = self.offsets[position], self.offsets[position + 1]
+        return self.data[start:end].decode()
+
+    def append(self, text):
+        self.data += text.encode()
+        self.offsets.append(len(self.data))
+
+
+class ContactTable(Sequence):
+    """A whole book of contacts stored column by column.
+
+    List fields are flattened into one column of values, with a per row
+    offset into it. Fields a row does not have, or which are None, are
+    recorded in the sparse dict missing, so rows decode to exactly the
+    dicts they were made from.
+    """
+
+    def __init__(self, contacts=()):
+        self.names = StringColumn()
+        self.uuids = bytearray()
+        self.other_uuids = {}
+        self.emails = StringColumn()
+        self.phones = StringColumn()
+        self.tag_ids = array('I')
+        self.tags = []
+        self.tag_positions = {}
+        self.list_offsets = {field: array('Q', [0]) for field in list_fields}
+        self.missing = {}
+        for contact in contacts:
+            self.append(contact)
+
+    def __repr__(self):
+        return f'ContactTable({len(self)} contacts)'
+
+    def __len__(self):
+        return len(self.names)
+
+    def tag_id(self, tag):
+        position = self.tag_positions.get(tag)
+        if position is None:
+            position = self.tag_positions[tag] = len(self.tags)
+            self.tags.append(sys.intern(tag))
+        return position
+
+    def append(self, contact):
+        """Add a contact, given as a dict in its stored shape"""
+        row = len(self)
+        missing = tuple(
+            (field, contact.get(field, absent)) for field in fields
+            if contact.get(field) is None
+        )
+        if missing:
+            self.missing[row] = missing
+        self.names.append(contact.get('name') or '')
+        uuid = pack_uuid(contact.get('uuid') or '')
+        if isinstance(uuid, bytes):
+            self.uuids += uuid
+        else:
+            self.uuids += bytes(16)
+            self.other_uuids[row] = uuid
+        for value in contact.get('email') or []:
+            self.emails.append(value)
+        for value in contact.get('phone') or []:
+            self.phones.append(value)
+        for value in contact.get('tags') or []:
+            self.tag_ids.append(self.tag_id(value))
+        for field, column in (('email', self.emails), ('phone', self.phones),
+                              ('tags', self.tag_ids)):
+            self.list_offsets[field].append(len(column))
+
+    def row_values(self, field, row):
+        offsets = self.list_offsets[field]
+        positions = range(offsets[row], offsets[row + 1])
+        if field == 'tags':
+            return [self.tags[self.tag_ids[i]] for i in positions]
+        column = self.emails if field == 'email' else self.phones
+        return [column[i] for i in positions]
+
+    def __getitem__(self, row):
+        """Return the contact at row as a dict in its stored shape"""
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        if not 0 <= row < len(self):
+            raise IndexError(row)
+        missing = dict(self.missing.get(row, ()))
+        contact = {}
+        for field in fields:
+            if field in missing:
+                if missing[field] is not absent:
+                    contact[field] = missing[field]
+            elif field == 'name':
+                contact[field] = self.names[row]
+            elif field == 'uuid':
+                contact[field] = self.other_uuids.get(row) or unpack_uuid(
+                    bytes(self.uuids[16 * row:16 * row + 16])
+                )
+            else:
+                contact[field] = self.row_values(field, row)
+        return contact
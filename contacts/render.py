@@ -0,0 +1,90 @@
+"""Streaming table renderer used by the show subcommand.
+
+Rows are formatted one at a time from a generator. Column widths are
+taken from a bounded sample of the first rows, capped at max_widths, so
+time and memory depend on the rows displayed rather than on the number
+of matching contacts.
+"""
+import os
+from itertools import chain, islice
+
+from .contacts import colors
+
+columns = ('#', 'name', 'email', 'phone')
+max_widths = {'#': 7, 'name': 30, 'email': 40, 'phone': 18}
+sample_size = 100
+
+
+def cell(value):
+    """Return the text shown for a field value"""
+    if value is None or value == []:
+        return '...'
+    if isinstance(value, list):
+        return value[0] if len(value) == 1 else f'{value[0]}, ...'
+    return str(value)
+
+
+def table_rows(contacts, indices):
+    """Yield a tuple of cells for the contact at each index"""
+    for index in indices:
+        contact = contacts[index]
+        yield (str(index), *(cell(contact.get(k)) for k in columns[1:]))
+
+
+def column_widths(rows):
+    """Return column widths fitting the headers and a sample of rows"""
+    widths = [len(heading) for heading in columns]
+    for row in rows:
+        widths = [max(width, len(text)) for width, text in zip(widths, row)]
+    return [min(width, max_widths[k]) for width, k in zip(widths, columns)]
+
+
+def fit(text, width):
+    """Return text padded or shortened to exactly width characters"""
+    if len(text) > width:
+        return text[:width - 1] + '…'
+    return text.ljust(width)
+
+
+def format_row(row, widths, color=False):
+    cells = [row[0].rjust(widths[0])]
+    for k, text, width in zip(columns[1:], row[1:], widths[1:]):
+        text = fit(text, width)
+        if color:
+            text = f'{colors[k]}{text}{colors["no_color"]}'
+        cells.append(text)
+    return '  '.join(cells).rstrip()
+
+
+def render(rows, color=False):
+    """Yield the lines of a table for an iterable of rows"""
+    rows = iter(rows)
+    sample = list(islice(rows, sample_size))
+    widths = column_widths(sample)
+    yield '  '.join(
+        [columns[0].rjust(widths[0])]
+        + [fit(k, width) for k, width in zip(columns[1:], widths[1:])]
+    ).rstrip()
+    yield '  '.join('-' * width for width in widths)
+    for row in chain(sample, rows):
+        yield format_row(row, widths, color)
+
+
+def page(lines):
+    """Write lines through the user's pager, stopping if it is closed"""
+    import shlex
+    import subprocess
+
+    env = dict(os.environ)
+    env.setdefault('LESS', 'FRX')
+    pager = subprocess.Popen(
+        shlex.split(os.environ.get('PAGER', 'less')),
+        stdin=subprocess.PIPE, text=True, env=env
+    )
+    try:
+        for line in lines:
+            pager.stdin.write(f'{line}\n')
+        pager.stdin.close()
+    except BrokenPipeError:
+        pass
+    pager.wait()
@@ -0,0 +1,209 @@
+"""Long-running server keeping a ContactManager resident in memory.
+
+`contacts serve` loads the contacts once and answers requests on a local
+unix socket. Each request is a single json line holding the query string,
+subcommand and its arguments; the response is a single json line holding
+the captured stdout, stderr and exit status. Subcommands in
+remote_subcommands transparently use the server when it is running.
+
+The resident contacts are held as contacts.record.Contact records rather
+than dicts, which take a third less memory. They are decoded straight into
+records, so that every contact is never held as a dict at once; contacts
+the server adds or modifies are kept as they are made, with their fields
+in another order than a record's.
+
+Clients import this module on every run, so anything only the server or
+a connected client needs is imported where it is used.
+"""
+import sys
+import os
+import json
+
+# Subcommands which are safe to run in the server, i.e. which do not need
+# to interact with the user's terminal
+remote_subcommands = ('show', 'export', 'get_field', 'add', 'modify',
+                      'compact')
+
+
+def is_remote(args):
+    """Return True if args can be handled by a running server"""
+    return (args.subcommand in remote_subcommands
+            and not getattr(args, 'pager', False))
+
+
+def encode_args(args):
+    """Return a json serialisable request for parsed command line args"""
+    from shutil import get_terminal_size
+
+    request = dict(vars(args))
+    if request.get('output_file') is not None:
+        request['output_file'] = os.path.abspath(request['output_file'])
+    request['term_lines'] = get_terminal_size().lines
+    return request
+
+
+def request(socket_path, args):
+    """Send args to the server listening on socket_path.
+
+    Return the decoded response, or None if no server is running.
+    """
+    if not os.path.exists(socket_path):
+        return None
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(socket_path))
+            payload = json.dumps(encode_args(args), default=str)
+            sock.sendall(payload.encode() + b'\n')
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while chunk := sock.recv(65536):
+                chunks.append(chunk)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return None
+    return json.loads(b''.join(chunks))
+
+
+def is_serving(socket_path):
+    """Return True if a server is accepting connections on socket_path"""
+    import socket
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(socket_path))
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+    return True
+
+
+class ContactServer:
+    """Serve requests from a single in-memory ContactManager"""
+
+    def __init__(self, contact_manager, socket_path):
+        self.contact_manager = contact_manager
+        self.socket_path = socket_path
+        # The contacts list held as records, see load and compact
+        self.compacted = None
+
+    def __repr__(self):
+        return f'ContactServer({self.socket_path})'
+
+    def refresh(self):
+        """Reload contacts if they were changed without going through us.
+
+        Searchable storages only load the contacts matching each query,
+        so they get a fresh ContactManager for every request.
+        """
+        from .contacts import ContactManager
+
+        manager = self.contact_manager
+        storage = manager.storage
+        if storage.searchable or storage.fingerprint() != storage.loaded:
+            self.contact_manager = ContactManager(manager.json_path, storage)
+
+    def load(self):
+        """Load the resident contacts as records, unless they are loaded"""
+        from .profile import phase
+        from .record import compact
+
+        manager = self.contact_manager
+        if manager._contacts is not None or manager.storage.searchable:
+            return
+        with phase('load') as current:
+            manager.contacts = manager.storage.load(record=compact)
+            current.records = len(manager.contacts)
+        self.compacted = manager.contacts
+
+    def compact(self):
+        """Turn the resident contacts into records if a write replaced them
+        with those another process wrote
+        """
+        from .record import compact
+
+        manager = self.contact_manager
+        contacts = manager._contacts
+        if contacts is None or contacts is self.compacted \
+                or manager.partial or manager.storage.searchable:
+            return
+        contacts[:] = map(compact, contacts)
+        self.compacted = contacts
+
+    def handle(self, request):
+        """Run the subcommand described by request and capture its output"""
+        import traceback
+        from argparse import Namespace
+        from contextlib import redirect_stdout, redirect_stderr
+        from io import StringIO
+
+        stdout, stderr = StringIO(), StringIO()
+        status = 0
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            try:
+                self.refresh()
+                self.load()
+                args = Namespace(**request)
+                if args.subcommand not in remote_subcommands:
+                    raise ValueError(
+                        f'{args.subcommand} cannot be run by the server'
+                    )
+                manager = self.contact_manager
+                indices = manager.find(args)
+                getattr(manager, args.subcommand)(indices=indices, args=args)
+            except SystemExit as exit:
+                status = exit.code if isinstance(exit.code, int) else 1
+            except Exception:
+                traceback.print_exc()
+                status = 1
+        self.compact()
+        return {
+            'stdout': stdout.getvalue(),
+            'stderr': stderr.getvalue(),
+            'status': status,
+        }
+
+    async def handle_connection(self, reader, writer):
+        try:
+            line = await reader.readline()
+            response = self.handle(json.loads(line))
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self):
+        """Start listening, replacing a stale socket left by a dead server"""
+        import asyncio
+
+        if is_serving(self.socket_path):
+            raise RuntimeError(f'Already serving on {self.socket_path}')
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        return await asyncio.start_unix_server(
+            self.handle_connection, path=str(self.socket_path)
+        )
+
+    async def serve_forever(self):
+        """Serve until SIGINT or SIGTERM, then remove the socket"""
+        import asyncio
+        import signal
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        server = await self.start()
+        sys.stderr.write(f'serving contacts on ... {self.socket_path}\n')
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def serve(contact_manager, socket_path):
+    """Serve contact_manager on socket_path until interrupted"""
+    import asyncio
+
+    asyncio.run(ContactServer(contact_manager, socket_path).serve_forever())
@@ -0,0 +1,288 @@
+"""SQLite storage backend.
+
+Each contact is stored as a row keyed by uuid, holding its json, with
+indexed side tables for names, emails, phone numbers and tags and an FTS5
+trigram table used to answer queries without loading the whole book.
+Changes are applied row by row in a single transaction.
+
+The side tables hold values normalized as index.normalize_value does,
+so that field terms of the query language and reverse lookups are
+answered with SQL on them. They are refilled from the contacts when the
+normalization changes, e.g. with the country code of phone numbers.
+"""
+import os
+import json
+import sqlite3
+
+from .cache import paused_gc
+from .conf import config
+from .index import (
+    field_values, normalization, normalize_value, searchable_values
+)
+from .storage import StorageEngine, fingerprint, sort_contacts
+
+schema = '''
+CREATE TABLE IF NOT EXISTS contacts (
+    uuid TEXT PRIMARY KEY,
+    name TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS contacts_name ON contacts (name);
+CREATE TABLE IF NOT EXISTS names (uuid TEXT NOT NULL, name TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS names_uuid ON names (uuid);
+CREATE INDEX IF NOT EXISTS names_name ON names (name);
+CREATE TABLE IF NOT EXISTS emails (uuid TEXT NOT NULL, email TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS emails_uuid ON emails (uuid);
+CREATE INDEX IF NOT EXISTS emails_email ON emails (email);
+CREATE TABLE IF NOT EXISTS phones (uuid TEXT NOT NULL, phone TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS phones_uuid ON phones (uuid);
+CREATE INDEX IF NOT EXISTS phones_phone ON phones (phone);
+CREATE TABLE IF NOT EXISTS tags (uuid TEXT NOT NULL, tag TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS tags_uuid ON tags (uuid);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5(
+    text, tokenize='trigram'
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+'''
+
+# Side tables holding one row per normalized value of a contact's fields
+side_tables = {'name': 'names', 'email': 'emails', 'phone': 'phones',
+               'tags': 'tags'}
+side_columns = {'name': 'name', 'email': 'email', 'phone': 'phone',
+                'tags': 'tag'}
+
+# Bound parameters per statement, below SQLite's lowest limit
+batch_size = 900
+
+
+def prefix_bounds(prefix):
+    """Return (low, high) such that the strings starting with prefix are
+    those at least low and less than high, high being None if every
+    string from low on starts with it
+    """
+    last = ord(prefix[-1]) + 1
+    if 0xd800 <= last < 0xe000:
+        # Surrogates are not valid in utf-8, the text encoding compared
+        last = 0xe000
+    if last > 0x10ffff:
+        return prefix, None
+    return prefix, prefix[:-1] + chr(last)
+
+
+def db_path(json_path):
+    """Return the path of the database kept next to a contacts file"""
+    return f'{os.path.splitext(json_path)[0]}.db'
+
+
+class SQLiteStorage(StorageEngine):
+    """Store contacts in an SQLite database with per-row updates"""
+
+    name = 'sqlite'
+    searchable = True
+
+    def __init__(self, json_path):
+        super().__init__(json_path)
+        self.db_path = db_path(json_path)
+        self._connection = None
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.db_path, timeout=config['lock_timeout']
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.executescript(schema)
+            self.normalize(connection)
+            self._connection = connection
+        return self._connection
+
+    def normalize(self, connection):
+        """Refill the side tables unless their values were normalized as
+        they are now
+        """
+        current = json.dumps(normalization())
+        stored = connection.execute(
+            "SELECT value FROM meta WHERE key = 'normalization'"
+        ).fetchone()
+        if stored is not None and stored[0] == current:
+            return
+        with connection as db:
+            for table in side_tables.values():
+                db.execute(f'DELETE FROM {table}')
+            self.insert_values(db, self.decode(
+                db.execute('SELECT data FROM contacts').fetchall()
+            ))
+            db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('normalization', ?)",
+                (current,)
+            )
+
+    def fingerprint(self):
+        return [fingerprint(self.db_path), fingerprint(f'{self.db_path}-wal')]
+
+    def decode(self, rows):
+        with paused_gc():
+            return [json.loads(data) for data, in rows]
+
+    def load(self):
+        contacts = self.decode(self.connection.execute(
+            'SELECT data FROM contacts ORDER BY name'
+        ))
+        self.loaded = self.fingerprint()
+        return contacts
+
+    def search(self, query):
+        # The trigram tokenizer cannot match fewer than three characters
+        if len(query) < 3:
+            return None
+        phrase = '"{}"'.format(query.replace('"', '""'))
+        contacts = self.decode(self.connection.execute(
+            'SELECT c.data FROM contacts_fts AS f '
+            'JOIN contacts AS c ON c.rowid = f.rowid '
+            'WHERE contacts_fts MATCH ? ORDER BY c.name',
+            (phrase,)
+        ))
+        self.loaded = self.fingerprint()
+        return contacts
+
+    def field_search(self, field, value, op):
+        """Return the uuids of the contacts with a value of field matching
+        the normalized value, exactly or as a prefix or substring as op
+        says; for a bare term (field None) only those the full text
+        search finds. Return None if every contact may match.
+        """
+        if field is None or field == 'name' and op == 'contains':
+            if len(value) < 3:
+                return None
+            phrase = '"{}"'.format(value.replace('"', '""'))
+            rows = self.connection.execute(
+                'SELECT c.uuid FROM contacts_fts AS f '
+                'JOIN contacts AS c ON c.rowid = f.rowid '
+                'WHERE contacts_fts MATCH ?', (phrase,)
+            )
+            return {uuid for uuid, in rows}
+        if field == 'uuid':
+            table, column = 'contacts', 'lower(uuid)'
+        else:
+            table, column = side_tables[field], side_columns[field]
+        if op == 'exact':
+            where, parameters = f'{column} = ?', (value,)
+        elif op == 'prefix':
+            low, high = prefix_bounds(value)
+            where, parameters = f'{column} >= ?', (low,)
+            if high is not None:
+                where, parameters = f'{where} AND {column} < ?', (low, high)
+        else:
+            where, parameters = f'instr({column}, ?) > 0', (value,)
+        rows = self.connection.execute(
+            f'SELECT uuid FROM {table} WHERE {where}', parameters
+        )
+        return {uuid for uuid, in rows}
+
+    def load_uuids(self, uuids):
+        """Return the stored contacts with the given uuids, sorted by name"""
+        uuids = list(uuids)
+        rows = []
+        for start in range(0, len(uuids), batch_size):
+            batch = uuids[start:start + batch_size]
+            rows += self.connection.execute(
+                f'SELECT data FROM contacts WHERE uuid IN '
+                f'({", ".join("?" * len(batch))})', batch
+            )
+        contacts = sort_contacts(self.decode(rows))
+        self.loaded = self.fingerprint()
+        return contacts
+
+    def lookup_index(self):
+        """Return the side tables of emails and phone numbers, used to find
+        the owners of a value as a LookupIndex is
+        """
+        return SQLiteLookup(self)
+
+    def commit(self, contacts, changes):
+        if not changes:
+            return contacts
+        with self.connection as db:
+            for op, contact in changes:
+                self.delete_rows(db, contact['uuid'])
+                if op != 'delete':
+                    self.insert_rows(db, [contact])
+        self.loaded = self.fingerprint()
+        return contacts
+
+    def compact(self, contacts):
+        with self.connection as db:
+            db.execute(
+                "INSERT INTO contacts_fts (contacts_fts) VALUES ('optimize')"
+            )
+        self.connection.execute('VACUUM')
+        self.loaded = self.fingerprint()
+        return contacts
+
+    def replace_all(self, contacts):
+        with self.connection as db:
+            for table in ('contacts', 'contacts_fts',
+                          *side_tables.values()):
+                db.execute(f'DELETE FROM {table}')
+            self.insert_rows(db, contacts)
+        self.loaded = self.fingerprint()
+
+    def delete_rows(self, db, uuid):
+        # Rows in contacts_fts share their rowid with the contacts table
+        db.execute(
+            'DELETE FROM contacts_fts WHERE rowid IN '
+            '(SELECT rowid FROM contacts WHERE uuid = ?)', (uuid,)
+        )
+        for table in ('contacts', *side_tables.values()):
+            db.execute(f'DELETE FROM {table} WHERE uuid = ?', (uuid,))
+
+    def insert_rows(self, db, contacts):
+        db.executemany(
+            'INSERT INTO contacts (uuid, name, data) VALUES (?, ?, ?)',
+            ((c['uuid'], c.get('name'), json.dumps(c)) for c in contacts)
+        )
+        self.insert_values(db, contacts)
+        # Fields are separated by newlines so a match rarely spans two of
+        # them; ContactManager.query checks every match afterwards anyway
+        db.executemany(
+            'INSERT INTO contacts_fts (rowid, text) '
+            'SELECT rowid, ? FROM contacts WHERE uuid = ?',
+            (('\n'.join(searchable_values(c)), c['uuid']) for c in contacts)
+        )
+
+    def insert_values(self, db, contacts):
+        """Insert the normalized values of contacts into the side tables"""
+        for field, table in side_tables.items():
+            db.executemany(
+                f'INSERT INTO {table} (uuid, {side_columns[field]}) '
+                f'VALUES (?, ?)',
+                ((c['uuid'], value) for c in contacts
+                 for value in set(field_values(c, field)) if value)
+            )
+
+
+class SQLiteLookup:
+    """Reverse lookup of phone numbers and emails in the side tables of a
+    database, with the interface of lookup.LookupIndex
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def __repr__(self):
+        return f'SQLiteLookup({self.storage.db_path})'
+
+    def find(self, field, value):
+        """Return the contacts having a phone number or email address
+        equal to value once both are normalized
+        """
+        value = normalize_value(field, value)
+        if not value:
+            return []
+        table, column = side_tables[field], side_columns[field]
+        return self.storage.decode(self.storage.connection.execute(
+            f'SELECT data FROM contacts WHERE uuid IN '
+            f'(SELECT uuid FROM {table} WHERE {column} = ?)', (value,)
+        ))
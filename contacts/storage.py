@@ -0,0 +1,663 @@
+"""Storage backends used by ContactManager to load and persist contacts"""
+import sys
+import os
+import json
+import time
+import fcntl
+from bisect import insort
+from contextlib import contextmanager
+from operator import itemgetter, le
+from pathlib import Path
+
+from .cache import ContactCache, cache_path, paused_gc
+from .conf import config
+from .profile import phase
+
+
+def fingerprint(path):
+    """Return a value which changes whenever the file at path is rewritten"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+def read_json(path, record=None):
+    """Read existing contact list from json file.
+
+    Return existing contacts as a list of dicts (assuming json file is in
+    the correct format), or of what record returns for each dict if given.
+    """
+    with phase('read_json') as current:
+        with open(path, 'r') as f:
+            data = f.read()
+        with paused_gc():
+            contacts = json.loads(data, object_hook=record)
+        current.records = len(contacts)
+    return contacts
+
+
+def atomic_write(path, write, sync=True, mode='w'):
+    """Replace the file at path with the output of write(f).
+
+    The new content is written to a temporary file in the same directory,
+    synced to disk and renamed over path, so readers only ever see the
+    old or the new file, never a partially written one. Files which can be
+    rebuilt, like indexes, may skip the sync with sync=False.
+    """
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp'
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    if not sync:
+        return
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+@contextmanager
+def locked(lock_path, shared=False, timeout=None):
+    """Hold an advisory lock on lock_path for the duration of the block.
+
+    Readers take a shared lock and writers an exclusive one. Waiting for
+    the lock backs off exponentially and gives up with TimeoutError after
+    timeout seconds (default from config).
+    """
+    if timeout is None:
+        timeout = config['lock_timeout']
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    with open(lock_path, 'a') as f:
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(f, operation | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(
+                        f'Timed out after {timeout}s waiting for {lock_path}'
+                    ) from None
+                time.sleep(delay)
+                delay = min(delay * 2, 0.005)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# Contacts are stored, and kept in memory, in this order
+sort_key = itemgetter('name')
+
+
+def sort_contacts(contacts):
+    """Sort contacts in place into the order they are stored in"""
+    contacts.sort(key=sort_key)
+    return contacts
+
+
+def is_sorted(contacts):
+    """Return True if contacts are in the order they are stored in"""
+    keys = list(map(sort_key, contacts))
+    return all(map(le, keys, keys[1:]))
+
+
+def apply_changes(contacts, changes):
+    """Return contacts with a list of (op, contact) changes applied by uuid.
+
+    The result is sorted. Sorted contacts stay sorted by inserting the
+    added and updated contacts in place, unless there are many of them.
+    """
+    latest = {contact['uuid']: (op, contact) for op, contact in changes}
+    result = [
+        contact for contact in contacts if contact['uuid'] not in latest
+    ]
+    added = [contact for op, contact in latest.values() if op != 'delete']
+    if len(added) > len(result) // 16 or not is_sorted(result):
+        result += added
+        return sort_contacts(result)
+    for contact in added:
+        insort(result, contact, key=sort_key)
+    return result
+
+
+def encode_default(value):
+    """Return a mapping other than a dict, such as a contacts.record.Contact,
+    as the dict json encodes in its place
+    """
+    from collections.abc import Mapping
+
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(
+        f'Object of type {type(value).__name__} is not JSON serializable'
+    )
+
+
+def line_encoder():
+    """Return a function encoding a value as json on one line, exactly as
+    json.dumps does.
+
+    One C encoder is reused for every value, where json.dumps would build
+    a new one per call.
+    """
+    from json.encoder import c_make_encoder, encode_basestring_ascii
+
+    if c_make_encoder is None:
+        return lambda value: json.dumps(value, default=encode_default)
+    encode = c_make_encoder(
+        None, encode_default, encode_basestring_ascii, None,
+        ': ', ', ', False, False, True
+    )
+    return lambda value: ''.join(encode(value, 0))
+
+
+def contact_lines(contacts):
+    """Return an iterator of each contact encoded as json on one line"""
+    return map(line_encoder(), contacts)
+
+
+def join_lines(lines):
+    """Return lines from contact_lines as a json array, one on each line.
+
+    The line starting at byte offset o is followed by the next at
+    o + len(line) + 2, the first being at 2. Lines are ascii, as json
+    escapes everything else.
+    """
+    return '[\n' + ',\n'.join(lines) + '\n]\n'
+
+
+def encode_lines(contacts):
+    """Return contacts as a json array with one record on each line.
+
+    The layout is what lets scan_json find matching records without
+    decoding the others, and contacts.lookup find them by offset.
+    """
+    return join_lines(contact_lines(contacts))
+
+
+def scan_pattern(query):
+    """Return a bytes regular expression finding the ascii query in
+    lowercased json written by encode_lines, as matched by query in
+    value.lower()
+    """
+    import re
+
+    parts = []
+    for position, char in enumerate(query):
+        part = re.escape(char)
+        # The kelvin sign, and a dotted capital I followed by a combining
+        # dot, are the only escaped characters which lower to ascii
+        if char == 'k':
+            part = r'(?:k|\\u212a)'
+        elif char == 'i' and position == len(query) - 1:
+            part = r'(?:i|\\u0130)'
+        parts.append(part)
+    return ''.join(parts).encode()
+
+
+def scan_json(path, query, chunk_size=1 << 22):
+    """Return the contacts in a file written by encode_lines whose line
+    contains the lowercase query, sorted.
+
+    The file is memory mapped and searched a few MB of whole lines at a
+    time, lowercased, and only the lines found are decoded, so the result
+    may include contacts which only matched in a field name and must still
+    be checked. Return None if the file or query does not allow this:
+    queries which are not plain ascii, or which contain characters json
+    escapes or the ', ' lists are searched as, files in another layout,
+    and queries found in so much of the file, as field names are, that
+    loading every contact would be quicker.
+    """
+    import mmap
+    import re
+
+    if not query or not query.isascii() or not query.isprintable() \
+            or any(char in query for char in '"\\,'):
+        return None
+    pattern = re.compile(scan_pattern(query))
+    contacts, decoded = [], 0
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < 4:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if buffer[:2] != b'[\n':
+                return None
+            chunk_start = 2
+            while chunk_start < len(buffer):
+                # Chunks end at a line end, as no match spans two lines
+                chunk_end = buffer.find(b'\n', chunk_start + chunk_size)
+                if chunk_end == -1:
+                    chunk_end = len(buffer)
+                chunk = buffer[chunk_start:chunk_end].lower()
+                position = 0
+                while True:
+                    match = pattern.search(chunk, position)
+                    if match is None:
+                        break
+                    start = chunk.rfind(b'\n', 0, match.start()) + 1
+                    end = chunk.find(b'\n', match.end())
+                    if end == -1:
+                        end = len(chunk)
+                    line = buffer[chunk_start + start:chunk_start + end]
+                    line = line.rstrip(b',')
+                    if not line.startswith(b'{'):
+                        return None
+                    try:
+                        contacts.append(json.loads(line))
+                    except ValueError:
+                        return None
+                    decoded += len(line)
+                    position = end + 1
+                # Small files are as quick to decode as to load
+                if decoded > chunk_end // 4 and chunk_end >= chunk_size:
+                    return None
+                chunk_start = chunk_end + 1
+    if not is_sorted(contacts):
+        sort_contacts(contacts)
+    return contacts
+
+
+class StorageEngine:
+    """Interface between ContactManager and the place contacts are stored.
+
+    Changes are passed to commit as a list of (op, contact) tuples, where
+    op is 'add', 'update' or 'delete', so that engines which can update
+    single records need not rewrite everything. Engines which can find
+    matching contacts themselves set searchable and implement search.
+    """
+
+    name = None
+    searchable = False
+    cache = None
+
+    def __init__(self, json_path):
+        self.json_path = json_path
+        # Fingerprint of the stored data when it was last loaded or written
+        self.loaded = None
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.json_path})'
+
+    def fingerprint(self):
+        """Return a value which changes whenever the stored data changes"""
+        raise NotImplementedError
+
+    def load(self):
+        """Return all stored contacts as a list of dicts, sorted by name"""
+        raise NotImplementedError
+
+    def search(self, query):
+        """Return stored contacts which may contain the lowercase query.
+
+        Return None if the query cannot be answered, in which case the
+        caller loads and checks every contact.
+        """
+        return None
+
+    def field_search(self, field, value, op):
+        """Return the uuids of the stored contacts which may match a term
+        of the query language, see query.Term, or None if the engine
+        cannot tell. Only used if the engine is searchable.
+        """
+        return None
+
+    def load_uuids(self, uuids):
+        """Return the stored contacts with the given uuids, sorted by name.
+        Only used if the engine is searchable.
+        """
+        raise NotImplementedError
+
+    def scan(self, query):
+        """Return stored contacts which may contain the lowercase query,
+        found without loading every contact, or None as search does.
+
+        Unlike search, this is only for commands which do not write, as
+        the engine may not be able to commit changes to the contacts
+        returned.
+        """
+        return None
+
+    def snapshot_path(self):
+        """Return the path of a file written by encode_lines holding
+        exactly the stored contacts, or None if there is none.
+
+        Call with a lock held, so that the file is not replaced meanwhile.
+        """
+        return None
+
+    def lookup_index(self):
+        """Return a LookupIndex of the stored contacts, or None if the
+        engine has none
+        """
+        return None
+
+    def columns(self, fields):
+        """Return a ColumnStore of fields of the stored contacts, or None
+        if the engine has none
+        """
+        return None
+
+    def commit(self, contacts, changes):
+        """Persist changes made to contacts since they were loaded.
+
+        Return the contacts which were stored, which are only different
+        from contacts if another process wrote in the meantime.
+        """
+        raise NotImplementedError
+
+    def compact(self, contacts):
+        """Fold pending changes into compact storage, return contacts"""
+        return contacts
+
+    def replace_all(self, contacts):
+        """Replace everything stored with contacts, sorted by name"""
+        raise NotImplementedError
+
+
+class JSONStorage(StorageEngine):
+    """Store contacts as a single json array, rewritten on every change.
+
+    Every read holds a shared lock and every write an exclusive lock on a
+    lock file next to the contacts file. Writes are atomic. If another
+    process changed the file since it was loaded, the pending changes are
+    reapplied on top of the stored contacts rather than overwriting them.
+    Parsed contacts are cached, see contacts.cache.
+    """
+
+    name = 'json'
+
+    def __init__(self, json_path):
+        super().__init__(json_path)
+        self.lock_path = Path(f'{json_path}.lock')
+        self.cache = ContactCache(cache_path(json_path))
+
+    def fingerprint(self):
+        return fingerprint(self.json_path)
+
+    def lock(self, shared=False):
+        return locked(self.lock_path, shared=shared)
+
+    def load(self, record=None):
+        """Return all stored contacts, sorted by name.
+
+        If record is given each contact is replaced by what it returns for
+        it as soon as it is decoded, see contacts.record, and the cache is
+        not used.
+        """
+        with self.lock(shared=True):
+            contacts = self.cached(record)
+            self.loaded = self.fingerprint()
+        return contacts
+
+    def cache_source(self):
+        """Return the fingerprint of the snapshot, which the cache holds"""
+        return fingerprint(self.json_path)
+
+    def cached(self, record=None):
+        """Return the contacts of the snapshot, sorted, from the cache if
+        it was built from the snapshot as it is, unless record is given,
+        see load
+        """
+        source = self.cache_source()
+        contacts = None if record is not None else self.cache.get(source)
+        if contacts is None:
+            # Snapshots are written sorted, so this rarely has to sort
+            contacts = read_json(self.json_path, record)
+            if not is_sorted(contacts):
+                with phase('sort') as current:
+                    sort_contacts(contacts)
+                    current.records = len(contacts)
+            if record is None:
+                self.cache.put(source, contacts)
+        return contacts
+
+    def read(self):
+        return read_json(self.json_path)
+
+    def scan(self, query):
+        with self.lock(shared=True):
+            path = self.snapshot_path()
+            return None if path is None else scan_json(path, query)
+
+    def snapshot_path(self):
+        return self.json_path
+
+    def lookup_index(self):
+        """Return the lookup index of the snapshot, see contacts.lookup, or
+        None if there is no snapshot holding every contact to index
+        """
+        from .lookup import LookupIndex, lookup_index_path
+
+        with self.lock(shared=True):
+            snapshot = self.snapshot_path()
+            if snapshot is None:
+                return None
+            try:
+                return LookupIndex.open(
+                    lookup_index_path(self.json_path), snapshot,
+                    fingerprint(snapshot)
+                )
+            except ValueError:
+                return None
+
+    def columns(self, fields):
+        """Return the columns of fields of the snapshot, see
+        contacts.columns, or None if there is no snapshot holding every
+        contact
+        """
+        from .columns import ColumnStore
+
+        with self.lock(shared=True):
+            snapshot = self.snapshot_path()
+            if snapshot is None:
+                return None
+            try:
+                return ColumnStore.open(self.json_path, snapshot,
+                                        fingerprint(snapshot), fields)
+            except ValueError:
+                return None
+
+    def commit(self, contacts, changes):
+        with self.lock():
+            if self.fingerprint() != self.loaded:
+                contacts = apply_changes(self.read(), changes)
+            sys.stderr.write(f'overwriting ... {self.json_path}')
+            self.write_snapshot(contacts)
+            self.loaded = self.fingerprint()
+            self.cache.put(self.cache_source(), contacts)
+        return contacts
+
+    def compact(self, contacts):
+        return self.commit(contacts, [])
+
+    def replace_all(self, contacts):
+        with self.lock():
+            self.write_snapshot(contacts)
+            self.loaded = self.fingerprint()
+            self.cache.put(self.cache_source(), contacts)
+
+    def write_snapshot(self, contacts):
+        """Write contacts as the snapshot, one record per line so that
+        read-only queries can use scan, and update the lookup index and
+        columns if there are any
+        """
+        from .columns import update_columns
+        from .lookup import LookupIndex, line_offsets, lookup_index_path
+
+        lookup_path = lookup_index_path(self.json_path)
+        if not lookup_path.exists():
+            atomic_write(
+                self.json_path, lambda f: f.write(encode_lines(contacts))
+            )
+        else:
+            lines = list(contact_lines(contacts))
+            atomic_write(self.json_path, lambda f: f.write(join_lines(lines)))
+            LookupIndex.write(
+                lookup_path, fingerprint(self.json_path),
+                zip(line_offsets(lines), contacts)
+            )
+        update_columns(self.json_path, fingerprint(self.json_path), contacts)
+
+
+class JournalStorage(JSONStorage):
+    """Store contacts as a json snapshot plus an append-only journal.
+
+    Each change is appended to the journal as one json record, keyed by
+    uuid, so a mutation costs O(changes) rather than O(contacts). Loading
+    replays the journal on top of the snapshot, which is what the cache
+    holds, so appending to the journal leaves the cache valid. Once the
+    journal grows past max_journal_bytes it is folded back into the
+    snapshot.
+    """
+
+    name = 'journal'
+
+    def __init__(self, json_path, max_journal_bytes=None):
+        super().__init__(json_path)
+        self.journal_path = Path(f'{json_path}.journal')
+        if max_journal_bytes is None:
+            max_journal_bytes = config['max_journal_bytes']
+        self.max_journal_bytes = max_journal_bytes
+
+    def fingerprint(self):
+        return [fingerprint(self.json_path), fingerprint(self.journal_path)]
+
+    def load(self, record=None):
+        with self.lock(shared=True):
+            contacts = self.replay(self.cached(record))
+            self.loaded = self.fingerprint()
+        return contacts
+
+    def read(self):
+        return self.replay(super().read())
+
+    def replay(self, contacts):
+        """Return the contacts of the snapshot with the journal applied"""
+        # Delete records carry the uuid at the top level
+        changes = [
+            (record['op'], record.get('contact', record))
+            for record in self.read_journal()
+        ]
+        return apply_changes(contacts, changes) if changes else contacts
+
+    def snapshot_path(self):
+        # Changes in the journal are not in the snapshot
+        if self.journal_path.exists() and os.path.getsize(self.journal_path):
+            return None
+        return self.json_path
+
+    def read_journal(self):
+        """Yield journal records in the order they were written.
+
+        A partially written final record, left by an interrupted append,
+        is ignored.
+        """
+        try:
+            f = open(self.journal_path, 'r')
+        except FileNotFoundError:
+            return
+        with f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    if line.endswith('\n'):
+                        raise
+                    return
+
+    def commit(self, contacts, changes):
+        if not changes:
+            return contacts
+        with self.lock():
+            current = self.fingerprint() == self.loaded
+            sys.stderr.write(
+                f'journaling {len(changes)} changes ... {self.journal_path}'
+            )
+            with open(self.journal_path, 'a') as f:
+                for op, contact in changes:
+                    if op == 'delete':
+                        record = {'op': op, 'uuid': contact['uuid']}
+                    else:
+                        record = {'op': op, 'contact': contact}
+                    f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            if not current:
+                contacts = self.replay(self.cached())
+            if os.path.getsize(self.journal_path) > self.max_journal_bytes:
+                self.fold(contacts)
+            self.loaded = self.fingerprint()
+        return contacts
+
+    def compact(self, contacts):
+        with self.lock():
+            if self.fingerprint() != self.loaded:
+                contacts = self.replay(self.cached())
+            self.fold(contacts)
+            self.loaded = self.fingerprint()
+        return contacts
+
+    def replace_all(self, contacts):
+        with self.lock():
+            self.fold(contacts)
+            self.loaded = self.fingerprint()
+
+    def fold(self, contacts):
+        """Write contacts as the snapshot, cache them and discard the
+        journal
+        """
+        sys.stderr.write(f'\ncompacting ... {self.journal_path}')
+        self.write_snapshot(contacts)
+        self.cache.put(self.cache_source(), contacts)
+        # The journal is only removed once the snapshot has been written;
+        # replaying it twice is harmless as every record is keyed by uuid.
+        if self.journal_path.exists():
+            os.remove(self.journal_path)
+
+
+def sqlite_storage(json_path):
+    # sqlite3 is only imported by those using it
+    from .sqlite import SQLiteStorage
+
+    return SQLiteStorage(json_path)
+
+
+storages = {
+    JSONStorage.name: JSONStorage,
+    JournalStorage.name: JournalStorage,
+    'sqlite': sqlite_storage,
+}
+
+
+def open_storage(json_path, name=None):
+    """Return the storage backend called name (default from config)"""
+    if name is None:
+        name = config['storage']
+    try:
+        storage_class = storages[name]
+    except KeyError:
+        raise ValueError(
+            f'Unknown storage {name}, try one of {list(storages)}'
+        ) from None
+    return storage_class(json_path)
@@ -0,0 +1,428 @@
+"""Incremental sync of a book with a CardDAV-style server.
+
+The server holds each contact as a json resource named by its uuid under
+the url of the book, with an ETag which changes whenever the contact
+does. It answers, in the manner of a CardDAV sync-collection report,
+with the uuids and ETags of the contacts changed and the uuids of those
+deleted since a sync token, along with a new token:
+
+    REPORT /book/             {"sync-token": "41"}
+    200 OK                    {"sync-token": "57", "changed": [[uuid, etag]],
+                               "deleted": [uuid]}
+    GET    /book/<uuid>       200 with the contact and its ETag
+    PUT    /book/<uuid>       If-Match: etag, or If-None-Match: * for a new
+                              contact; 201 or 204 with the new ETag
+    DELETE /book/<uuid>       If-Match: etag; 204
+
+A PUT or DELETE whose ETag is out of date fails with 412, and a token
+the server no longer knows with 410, after which every contact is
+listed. contacts.syncserver is a stand-in for such a server.
+
+The token and the ETag and a digest of each contact as it was last
+synced are kept next to the contacts file. A sync sends the contacts
+changed since then, found through the modification log (see
+contacts.order) and confirmed by their digest, and fetches the contacts
+the server reports changed. Contacts changed on both sides are taken
+from the server, or with prefer='local' from the book. Requests are
+pipelined over a small pool of persistent connections, and the changes
+fetched are written to the book at once.
+"""
+import json
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+from .storage import atomic_write
+
+prefer_choices = ('server', 'local')
+
+# Persistent connections to the server, and requests in flight on each
+connections = 4
+depth = 16
+
+Response = namedtuple('Response', ['status', 'headers', 'body'])
+
+
+class SyncError(Exception):
+    """The server answered a request with an unexpected status"""
+
+
+def sync_state_path(json_path):
+    """Return the path of the sync state kept next to a contacts file"""
+    return Path(f'{json_path}.sync')
+
+
+def digest(contact):
+    """Return a digest of a contact, compared to tell whether it changed
+    since it was last synced
+    """
+    from hashlib import blake2b
+
+    encoded = json.dumps(contact, sort_keys=True).encode()
+    return blake2b(encoded, digest_size=8).hexdigest()
+
+
+def encode_message(start_line, headers, body=b''):
+    """Return the bytes of an http/1.1 request or response"""
+    lines = [start_line, *(f'{name}: {value}'
+                           for name, value in headers.items()),
+             f'Content-Length: {len(body)}', '', '']
+    return '\r\n'.join(lines).encode('latin-1') + body
+
+
+async def read_message(reader):
+    """Return (start line, headers, body) of the next http/1.1 message
+    read from a stream, with lowercase header names, or None at its end
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    headers = {}
+    while (header := await reader.readline()) not in (b'\r\n', b'\n', b''):
+        name, _, value = header.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    return line.decode('latin-1').rstrip('\r\n'), headers, body
+
+
+class SyncState:
+    """The sync token and the ETag and digest of each contact as it was
+    last synced with the server at url
+    """
+
+    def __init__(self, path, url, token=None, synced=0, etags=None):
+        self.path = path
+        self.url = url
+        self.token = token
+        # Time the last sync started
+        self.synced = synced
+        # Map of uuids to [etag, digest]
+        self.etags = {} if etags is None else etags
+
+    def __repr__(self):
+        return f'SyncState({self.path}, {self.url})'
+
+    @classmethod
+    def read(cls, path, url):
+        """Return the state saved at path, or an empty one if there is
+        none or it was saved for another server
+        """
+        try:
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if saved['url'] == url:
+                return cls(path, url, saved['token'], saved['synced'],
+                           saved['etags'])
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return cls(path, url)
+
+    def write(self):
+        state = {'url': self.url, 'token': self.token,
+                 'synced': self.synced, 'etags': self.etags}
+        atomic_write(self.path, lambda f: json.dump(state, f))
+
+
+def local_changes(manager, state, full=False):
+    """Return the contacts of a ContactManager changed or added since the
+    last sync, as a dict keyed by uuid, and the set of uuids of those
+    deleted.
+
+    Only contacts modified since the last sync are compared, unless full.
+    """
+    from .order import ModifiedLog, modified_log_path
+
+    times = {} if full else ModifiedLog(
+        modified_log_path(manager.json_path)
+    ).read()
+    changed, present = {}, set()
+    for contact in manager.contacts:
+        uuid = contact['uuid']
+        present.add(uuid)
+        synced = state.etags.get(uuid)
+        if synced is None:
+            changed[uuid] = contact
+        elif full or times.get(uuid, 0) >= state.synced:
+            if digest(contact) != synced[1]:
+                changed[uuid] = contact
+    # Contacts the server sent which were not valid have no digest
+    deleted = {uuid for uuid, (etag, synced) in state.etags.items()
+               if uuid not in present and synced is not None}
+    return changed, deleted
+
+
+class Client:
+    """A pool of persistent http/1.1 connections to the server of a url,
+    with up to depth requests pipelined on each.
+
+    Use as an async context manager; requests are queued and taken by
+    whichever connection has room.
+    """
+
+    def __init__(self, url, connections=connections, depth=depth):
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        if parts.scheme != 'http' or not parts.hostname:
+            raise SyncError(f'Only http:// urls are supported, not {url}')
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.base = parts.path.rstrip('/')
+        self.connections = connections
+        self.depth = depth
+        self.requests = 0
+        self.queue = None
+        self.workers = []
+        # Error which stopped a connection, failing every later request
+        self.error = None
+
+    def __repr__(self):
+        return f'Client({self.host}:{self.port}{self.base})'
+
+    async def __aenter__(self):
+        import asyncio
+
+        self.queue = asyncio.Queue()
+        self.workers = [asyncio.create_task(self.connection())
+                        for _ in range(self.connections)]
+        return self
+
+    async def __aexit__(self, *exc_info):
+        import asyncio
+
+        for worker in self.workers:
+            if exc_info[0] is None:
+                self.queue.put_nowait(None)
+            else:
+                worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+    def fail(self, error):
+        """Fail every queued request and any made later, as a connection
+        failed
+        """
+        self.error = error
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None and not item[1].done():
+                item[1].set_exception(error)
+
+    async def connection(self):
+        """Send queued requests on one connection, pipelining up to depth
+        of them, and resolve each with its response
+        """
+        import asyncio
+
+        try:
+            reader, writer = await asyncio.open_connection(self.host,
+                                                           self.port)
+        except OSError as error:
+            self.fail(error)
+            return
+        in_flight = asyncio.Queue(self.depth)
+
+        async def send():
+            while (item := await self.queue.get()) is not None:
+                data, future = item
+                await in_flight.put(future)
+                writer.write(data)
+                await writer.drain()
+            await in_flight.put(None)
+
+        sending = asyncio.create_task(send())
+        future = None
+        try:
+            while (future := await in_flight.get()) is not None:
+                message = await read_message(reader)
+                if message is None:
+                    raise ConnectionError('The server closed the connection')
+                start_line, headers, body = message
+                if not future.done():
+                    future.set_result(
+                        Response(int(start_line.split()[1]), headers, body)
+                    )
+            await sending
+        except (OSError, ValueError, IndexError,
+                asyncio.IncompleteReadError) as error:
+            sending.cancel()
+            if future is not None and not future.done():
+                future.set_exception(error)
+            while not in_flight.empty():
+                future = in_flight.get_nowait()
+                if future is not None and not future.done():
+                    future.set_exception(error)
+            self.fail(error)
+        finally:
+            writer.close()
+
+    async def request(self, method, name='', headers=None, body=b''):
+        """Return the Response to a request for a resource of the book"""
+        import asyncio
+        from urllib.parse import quote
+
+        if self.error is not None:
+            raise self.error
+        headers = {'Host': f'{self.host}:{self.port}', **(headers or {})}
+        if body:
+            headers['Content-Type'] = 'application/json'
+        data = encode_message(
+            f'{method} {self.base}/{quote(name)} HTTP/1.1', headers, body
+        )
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((data, future))
+        self.requests += 1
+        return await future
+
+
+def unexpected(method, uuid, response):
+    """Return a SyncError for a response with an unexpected status"""
+    return SyncError(f'{method} {uuid or "report"} answered with status '
+                     f'{response.status}: {response.body[:200].decode()}')
+
+
+class Sync:
+    """One exchange of changes between a book and the server"""
+
+    def __init__(self, client, state, prefer='server'):
+        self.client = client
+        self.state = state
+        self.prefer = prefer
+        # Contacts fetched from the server, keyed by uuid, and the uuids
+        # of those it deleted
+        self.pulled = {}
+        self.removed = set()
+        # ETags and digests of the contacts fetched, or None for those
+        # removed, kept out of the state until they are in the book
+        self.fetched = {}
+        self.pushed = 0
+        self.unpushed = 0
+        self.conflicts = 0
+        self.token = state.token
+
+    def __repr__(self):
+        return f'Sync({self.client}, {self.state})'
+
+    async def report(self):
+        """Return the uuids and ETags of the contacts changed on the
+        server since the last sync, and the uuids of those deleted
+        """
+        body = json.dumps({'sync-token': self.state.token}).encode()
+        response = await self.client.request('REPORT', body=body)
+        full = self.state.token is None
+        if response.status == 410 and not full:
+            # The server forgot the token, so it lists every contact
+            body = json.dumps({'sync-token': None}).encode()
+            response = await self.client.request('REPORT', body=body)
+            full = True
+        if response.status != 200:
+            raise unexpected('REPORT', None, response)
+        report = json.loads(response.body)
+        self.token = report['sync-token']
+        etags = self.state.etags
+        changed = {uuid: etag for uuid, etag in report['changed']
+                   if etags.get(uuid, [None])[0] != etag}
+        if full:
+            listed = {uuid for uuid, etag in report['changed']}
+            deleted = {uuid for uuid in etags if uuid not in listed}
+        else:
+            deleted = {uuid for uuid in report['deleted'] if uuid in etags}
+        return changed, deleted
+
+    async def fetch(self, uuid):
+        """Fetch a contact changed on the server"""
+        from .importer import normalize
+
+        response = await self.client.request('GET', uuid)
+        if response.status == 404:
+            self.removed.add(uuid)
+            self.fetched[uuid] = None
+            return
+        if response.status != 200:
+            raise unexpected('GET', uuid, response)
+        try:
+            record = dict(json.loads(response.body), uuid=uuid)
+        except (ValueError, TypeError):
+            record = {}
+        contact = normalize(record)
+        etag = response.headers.get('etag')
+        if contact is None:
+            sys.stderr.write(f'Skipped {uuid}, which is not a valid '
+                             f'contact on the server\n')
+            self.fetched[uuid] = [etag, None]
+            return
+        self.pulled[uuid] = contact
+        self.fetched[uuid] = [etag, digest(contact)]
+
+    async def push(self, uuid, contact, etag):
+        """Send a contact changed in the book, or delete it on the server
+        if contact is None, unless it changed there since etag
+        """
+        headers = ({'If-None-Match': '*'} if etag is None
+                   else {'If-Match': etag})
+        if contact is None:
+            response = await self.client.request('DELETE', uuid, headers)
+            if response.status in (204, 404):
+                self.state.etags.pop(uuid, None)
+                self.pushed += 1
+                return
+        else:
+            response = await self.client.request(
+                'PUT', uuid, headers, json.dumps(contact).encode()
+            )
+            if response.status in (200, 201, 204):
+                self.state.etags[uuid] = [response.headers.get('etag'),
+                                          digest(contact)]
+                self.pushed += 1
+                return
+        if response.status != 412:
+            method = 'DELETE' if contact is None else 'PUT'
+            raise unexpected(method, uuid, response)
+        # Changed on the server since the report, so it is fetched by
+        # the next sync
+        self.unpushed += 1
+
+    def merged(self):
+        """Record in the state the ETags of the contacts fetched and
+        removed, once the book has been written with them. Until then
+        only those of the contacts sent are, so that a sync which fails
+        fetches the same contacts again.
+        """
+        for uuid, synced in self.fetched.items():
+            if synced is None:
+                self.state.etags.pop(uuid, None)
+            else:
+                self.state.etags[uuid] = synced
+
+    async def run(self, changed, deleted):
+        """Exchange the contacts changed and deleted in the book since
+        the last sync for those changed on the server
+        """
+        import asyncio
+
+        server_changed, server_deleted = await self.report()
+        # Contacts deleted on both sides are forgotten
+        for uuid in server_deleted & deleted:
+            self.state.etags.pop(uuid, None)
+        server_deleted -= deleted
+        deleted -= server_deleted
+        conflicts = (server_changed.keys() | server_deleted) \
+            & (changed.keys() | deleted)
+        self.conflicts = len(conflicts)
+        etags = {uuid: etag for uuid, (etag, synced)
+                 in self.state.etags.items()}
+        for uuid in conflicts:
+            if self.prefer == 'server':
+                changed.pop(uuid, None)
+                deleted.discard(uuid)
+            else:
+                etags[uuid] = server_changed.pop(uuid, None)
+                server_deleted.discard(uuid)
+        self.removed |= server_deleted
+        self.fetched.update(dict.fromkeys(server_deleted))
+        await asyncio.gather(
+            *(self.fetch(uuid) for uuid in server_changed),
+            *(self.push(uuid, contact, etags.get(uuid))
+              for uuid, contact in changed.items()),
+            *(self.push(uuid, None, etags[uuid]) for uuid in deleted),
+        )
@@ -0,0 +1,193 @@
+"""Local stand-in for the CardDAV-style server contacts.sync talks to.
+
+Contacts are kept in memory, each with an ETag which is the sequence
+number of its last change. Every change is logged, so a sync token is
+the number of changes seen and a report lists those made after it;
+expire_tokens makes the server forget every token given so far, as real
+servers do after a while. Connections are kept alive and pipelined
+requests answered in order.
+
+Run one in a thread of this process with running(), or on its own:
+
+    python -m contacts.syncserver --port 8008 [--book contacts.json]
+
+and sync with http://127.0.0.1:8008/contacts/ as the url.
+"""
+import json
+from contextlib import contextmanager
+from http import HTTPStatus
+from urllib.parse import unquote, urlsplit
+
+from .sync import encode_message, read_message
+
+
+class SyncServer:
+    """An in-memory book served over http"""
+
+    def __init__(self, contacts=()):
+        # Map of uuids to (etag, body)
+        self.records = {}
+        # uuid changed by each change, in order
+        self.log = []
+        # Tokens before this one are no longer known
+        self.oldest = 0
+        self.requests = 0
+        self.url = None
+        for contact in contacts:
+            self.store(contact['uuid'], json.dumps(contact).encode())
+
+    def __repr__(self):
+        return f'SyncServer({self.url})'
+
+    def store(self, uuid, body):
+        """Store a contact, returning its new etag"""
+        self.log.append(uuid)
+        etag = f'"{len(self.log)}"'
+        self.records[uuid] = (etag, body)
+        return etag
+
+    def remove(self, uuid):
+        del self.records[uuid]
+        self.log.append(uuid)
+
+    def contacts(self):
+        """Return every contact stored, with the uuid it is stored under"""
+        return [dict(json.loads(body), uuid=uuid)
+                for uuid, (etag, body) in self.records.items()]
+
+    def expire_tokens(self):
+        self.oldest = len(self.log)
+
+    def report(self, token):
+        """Return the changes since a token, or None if it is unknown"""
+        if token is None:
+            start = 0
+            uuids = list(self.records)
+        else:
+            try:
+                start = int(token)
+            except (TypeError, ValueError):
+                return None
+            if not self.oldest <= start <= len(self.log):
+                return None
+            uuids = list(dict.fromkeys(self.log[start:]))
+        return {
+            'sync-token': str(len(self.log)),
+            'changed': [[uuid, self.records[uuid][0]] for uuid in uuids
+                        if uuid in self.records],
+            'deleted': [uuid for uuid in uuids if uuid not in self.records],
+        }
+
+    def handle(self, method, target, headers, body):
+        """Return the (status, headers, body) of the response to a request"""
+        uuid = unquote(urlsplit(target).path.rpartition('/')[2])
+        if method == 'REPORT':
+            try:
+                token = json.loads(body)['sync-token']
+            except (ValueError, KeyError, TypeError):
+                return 400, {}, b''
+            report = self.report(token)
+            if report is None:
+                return 410, {}, b''
+            return 200, {}, json.dumps(report).encode()
+        if not uuid:
+            return 405, {}, b''
+        etag, stored = self.records.get(uuid, (None, None))
+        match = headers.get('if-match')
+        if match is not None and match != etag \
+                or headers.get('if-none-match') == '*' and etag is not None:
+            return 412, {}, b''
+        if method == 'GET':
+            if etag is None:
+                return 404, {}, b''
+            return 200, {'ETag': etag}, stored
+        if method == 'PUT':
+            try:
+                if not isinstance(json.loads(body), dict):
+                    raise ValueError
+            except ValueError:
+                return 400, {}, b''
+            status = 201 if etag is None else 204
+            return status, {'ETag': self.store(uuid, body)}, b''
+        if method == 'DELETE':
+            if etag is None:
+                return 404, {}, b''
+            self.remove(uuid)
+            return 204, {}, b''
+        return 405, {}, b''
+
+    async def handle_connection(self, reader, writer):
+        """Answer the requests of a connection in order until it closes"""
+        import asyncio
+
+        try:
+            while (message := await read_message(reader)) is not None:
+                start_line, headers, body = message
+                method, target, version = start_line.split(' ', 2)
+                status, response_headers, response_body = self.handle(
+                    method, target, headers, body
+                )
+                self.requests += 1
+                writer.write(encode_message(
+                    f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+                    response_headers, response_body
+                ))
+                await writer.drain()
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+@contextmanager
+def running(server, host='127.0.0.1', port=0, path='/contacts/'):
+    """Serve server from a thread with its own event loop, giving the url
+    of its book
+    """
+    import asyncio
+    import threading
+
+    loop = asyncio.new_event_loop()
+    listener = loop.run_until_complete(
+        asyncio.start_server(server.handle_connection, host, port)
+    )
+    host, port = listener.sockets[0].getsockname()[:2]
+    server.url = f'http://{host}:{port}{path}'
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.url
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        listener.close()
+        loop.close()
+
+
+def main():
+    import argparse
+    import sys
+    import time
+
+    from .storage import read_json
+
+    parser = argparse.ArgumentParser(
+        description='Serve an in-memory book to sync contacts with'
+    )
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--book', help='json file of contacts to start with')
+    args = parser.parse_args()
+    server = SyncServer(read_json(args.book) if args.book else ())
+    with running(server, args.host, args.port) as url:
+        sys.stderr.write(f'serving {len(server.records)} contacts on ... '
+                         f'{url}\n')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
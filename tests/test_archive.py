@@ -0,0 +1,138 @@
+"""Tests for the archive module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.archive import DeletedArchive
+from contacts.contacts import ContactManager
+
+
+class TestDelete(unittest.TestCase):
+    """Test deleting contacts to the archive and restoring them"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_archive_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.backup = f'{self.json_file}.deleted.ndjson'
+        self.data = ContactManager(self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def delete(self, indices, answer='y', yes=False):
+        args = Namespace(backup=self.backup, yes=yes)
+        with patch('sys.stderr', new=StringIO()), \
+                patch('sys.stdout', new=StringIO()), \
+                patch('builtins.input', return_value=answer):
+            self.data.delete(indices, args)
+
+    def undelete(self, uuids, status=None):
+        args = Namespace(backup=self.backup, uuid=uuids)
+        with patch('sys.stderr', new=StringIO()) as mock_stderr:
+            try:
+                self.data.undelete(args=args)
+            except SystemExit as exit:
+                self.assertEqual(exit.code, status)
+            else:
+                self.assertIsNone(status)
+        return mock_stderr.getvalue()
+
+    def test_delete(self):
+        """Test exactly the selected contacts are deleted and archived."""
+        indices = [0, 1, 5, 80]
+        deleted = [self.data.contacts[i] for i in indices]
+        kept = [c for i, c in enumerate(self.data.contacts)
+                if i not in indices]
+        self.delete(indices)
+
+        self.assertEqual(ContactManager(self.json_file).contacts, kept)
+        with open(self.backup, 'r') as f:
+            self.assertEqual([json.loads(line) for line in f], deleted)
+
+    def test_delete_declined(self):
+        """Test nothing is deleted unless the deletion is confirmed."""
+        with self.assertRaises(SystemExit):
+            self.delete([0], answer='n')
+        self.assertEqual(len(ContactManager(self.json_file).contacts), 81)
+        self.assertFalse(os.path.exists(self.backup))
+
+    def test_undelete(self):
+        """Test deleted contacts are restored from the archive."""
+        contact = self.data.contacts[3]
+        self.delete([3], yes=True)
+        self.delete([0], yes=True)
+        self.assertIn('restoring contact', self.undelete([contact['uuid']]))
+        self.assertIn('already a contact',
+                      self.undelete([contact['uuid']], status=1))
+
+        reloaded = ContactManager(self.json_file)
+        self.assertEqual(len(reloaded.contacts), 80)
+        self.assertEqual(reloaded.contacts[2], contact)
+        self.assertIn('not-a-uuid is not in',
+                      self.undelete(['not-a-uuid'], status=1))
+
+    def test_index_catches_up(self):
+        """Test the archive index only reads lines appended since saved."""
+        archive = DeletedArchive(self.backup)
+        archive.append(self.data.contacts[:2])
+        self.assertEqual(len(archive.index()), 2)
+        size, offsets = archive.read_index()
+        self.assertEqual(size, os.path.getsize(self.backup))
+
+        archive.append(self.data.contacts[2:3])
+        with open(self.backup, 'a') as f:
+            f.write('{"uuid": "trunc')
+        uuid = self.data.contacts[2]['uuid']
+        self.assertEqual(archive.get([uuid]), {uuid: self.data.contacts[2]})
+        self.assertEqual(archive.read_index()[0], size + len(
+            json.dumps(self.data.contacts[2]) + '\n'
+        ))
+
+    def test_legacy_archive(self):
+        """Test a json array archive is converted before lines are added."""
+        legacy = self.data.contacts[5:7]
+        deleted = self.data.contacts[0]
+        with open(self.backup, 'w') as f:
+            json.dump(legacy, f)
+        self.delete([0], yes=True)
+        with open(self.backup, 'r') as f:
+            self.assertEqual([json.loads(line) for line in f],
+                             legacy + [deleted])
+
+    def test_legacy_default_archive(self):
+        """Test contacts deleted to the .json archive used before can be
+        restored through the .ndjson one.
+        """
+        contact = self.data.contacts[3]
+        with open(Path(self.backup).with_suffix('.json'), 'w') as f:
+            json.dump([contact], f)
+        self.data.remove(3)
+        self.data.overwrite()
+        self.data = ContactManager(self.json_file)
+        self.assertIn('restoring contact', self.undelete([contact['uuid']]))
+        self.assertEqual(ContactManager(self.json_file).contacts[3], contact)
+
+    def test_unreadable_archive(self):
+        """Test nothing is deleted if the archive is a broken array."""
+        with open(self.backup, 'w') as f:
+            f.write('[{"uuid": "trunc')
+        args = Namespace(backup=self.backup, yes=True)
+        with patch('sys.stderr', new=StringIO()) as mock_stderr, \
+                self.assertRaises(SystemExit):
+            self.data.delete([0], args)
+        self.assertIn('neither ndjson nor', mock_stderr.getvalue())
+        self.assertEqual(len(ContactManager(self.json_file).contacts), 81)
+
+
+if __name__ == '__main__':
+    unittest.main()
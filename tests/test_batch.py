@@ -0,0 +1,156 @@
+"""Tests for the batch module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from io import StringIO
+from pathlib import Path
+from shutil import copyfile
+from unittest.mock import patch
+
+from contacts.batch import BatchError, parse_operation
+from contacts.contacts import ContactManager
+from contacts.index import scans_before_index
+
+
+class TestBatch(unittest.TestCase):
+    """Test applying batches of operations with a single write"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_batch_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.ops_file = f'{self.json_file}.ops.jsonl'
+        self.backup = f'{self.json_file}.deleted.ndjson'
+        self.data = ContactManager(self.json_file)
+        self.abradolf = self.data.contacts[0]['uuid']
+        self.alan = self.data.contacts[1]['uuid']
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def run_batch(self, operations, status=None):
+        """Run a batch of operations, returning the decoded results"""
+        with open(self.ops_file, 'w') as f:
+            for operation in operations:
+                f.write(f'{json.dumps(operation)}\n')
+        args = Namespace(input_file=self.ops_file, backup=self.backup)
+        with patch('sys.stdout', new=StringIO()) as mock_stdout, \
+                patch('sys.stderr', new=StringIO()), \
+                patch.object(self.data.storage, 'commit',
+                             wraps=self.data.storage.commit) as commit:
+            try:
+                self.data.batch(args=args)
+            except SystemExit as exit:
+                self.assertEqual(exit.code, status)
+            else:
+                self.assertIsNone(status)
+        self.commits = commit.call_count
+        return [json.loads(line) for line in
+                mock_stdout.getvalue().splitlines()]
+
+    def test_parse_operation(self):
+        """Test lines which are not valid operations are refused."""
+        self.assertEqual(parse_operation('{"op": "delete", "uuid": "a"}'),
+                         {'op': 'delete', 'uuid': 'a'})
+        for line in ('{"op": "delete"', '[]', '{"op": "show"}',
+                     '{"op": "delete"}',
+                     '{"op": "delete", "uuid": "a", "query": "b"}',
+                     '{"op": "add", "name": "x", "emails": []}'):
+            with self.subTest(line=line):
+                with self.assertRaises(BatchError):
+                    parse_operation(line)
+
+    def test_batch(self):
+        """Test operations see each other's changes and are written once."""
+        results = self.run_batch([
+            {'op': 'add', 'name': 'Birdperson', 'email': ['bp@bird.world'],
+             'id': 'new'},
+            {'op': 'modify', 'query': 'name:=Birdperson',
+             'phone': '0700 1; 0700 2'},
+            {'op': 'get_field', 'query': 'bird', 'field': 'phone'},
+            {'op': 'delete', 'uuid': self.abradolf},
+            {'op': 'modify', 'uuid': [self.alan], 'name': 'Zeep Xanflorp'},
+            {'op': 'get_field', 'query': 'plumbus', 'field': 'name'},
+        ])
+        self.assertTrue(all(result['ok'] for result in results))
+        self.assertEqual([result['line'] for result in results],
+                         [1, 2, 3, 4, 5, 6])
+        self.assertEqual(results[0]['id'], 'new')
+        self.assertEqual(results[1]['uuids'], results[0]['uuids'])
+        self.assertEqual(results[2]['values'], [['0700 1', '0700 2']])
+        self.assertNotIn('Abradolf Lincler', results[5]['values'])
+        self.assertEqual(results[5]['values'][-1], 'Zeep Xanflorp')
+        self.assertEqual(self.commits, 1)
+
+        contacts = ContactManager(self.json_file).contacts
+        self.assertEqual(len(contacts), 81)
+        self.assertEqual(contacts[-1]['uuid'], self.alan)
+        self.assertNotIn(self.abradolf,
+                         [contact['uuid'] for contact in contacts])
+        with open(self.backup) as f:
+            self.assertEqual(json.loads(f.readline())['uuid'], self.abradolf)
+
+    def test_indexed_queries(self):
+        """Test queries after changes are answered from indexes following
+        the changes, without finding positions again.
+        """
+        operations = []
+        for i in range(scans_before_index + 2):
+            operations += [
+                {'op': 'add', 'name': f'Squanchy {i}', 'tags': [f'cat{i}']},
+                {'op': 'get_field', 'query': f'tag:=cat{i}', 'field': 'name'},
+                {'op': 'get_field', 'query': f'squanchy {i}',
+                 'field': 'tags'},
+            ]
+        with patch.object(ContactManager, 'positions') as positions:
+            results = self.run_batch(operations)
+        positions.assert_not_called()
+        for i in range(scans_before_index + 2):
+            self.assertEqual(results[3 * i + 1]['values'], [f'Squanchy {i}'])
+            self.assertEqual(results[3 * i + 2]['values'], [[f'cat{i}']])
+        self.assertIsNotNone(self.data._index)
+        self.assertIsNotNone(self.data._field_index)
+
+    def test_failed_batch(self):
+        """Test nothing is written if any operation fails."""
+        with open(self.json_file, 'rb') as f:
+            stored = f.read()
+        results = self.run_batch([
+            {'op': 'delete', 'uuid': self.abradolf},
+            {'op': 'add', 'name': 'Birdperson'},
+            {'op': 'modify', 'uuid': 'not-a-uuid', 'name': 'Nobody'},
+            {'op': 'delete', 'uuid': self.alan},
+        ], status=1)
+        self.assertEqual([result['ok'] for result in results],
+                         [True, True, False])
+        self.assertEqual(results[2]['error'], 'no contact with uuid not-a-uuid')
+        self.assertEqual(self.commits, 0)
+        with open(self.json_file, 'rb') as f:
+            self.assertEqual(f.read(), stored)
+        self.assertFalse(os.path.exists(self.backup))
+
+    def test_invalid_operations(self):
+        """Test invalid fields and queries fail the batch."""
+        for operation, error in [
+            ({'op': 'add', 'email': ['a@b.c']}, 'a contact needs a name'),
+            ({'op': 'add', 'name': 'x', 'uuid': self.alan},
+             'is already a contact'),
+            ({'op': 'modify', 'uuid': self.alan}, 'needs a field'),
+            ({'op': 'modify', 'uuid': self.alan, 'tags': [1]},
+             'tags must be a list of strings'),
+            ({'op': 'delete', 'query': 'name:('}, 'invalid query'),
+            ({'op': 'get_field', 'uuid': self.alan, 'field': 'age'},
+             'field must be one of'),
+        ]:
+            with self.subTest(operation=operation):
+                result, = self.run_batch([operation], status=1)
+                self.assertIn(error, result['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
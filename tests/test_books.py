@@ -0,0 +1,110 @@
+"""Tests for the books module."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from argparse import Namespace
+from pathlib import Path
+from unittest.mock import patch
+
+from contacts import books
+from contacts.index import searchable_values
+from contacts.storage import read_json
+
+
+class TestBooks(unittest.TestCase):
+    """Test querying and changing contacts split over several books"""
+
+    def setUp(self):
+        """Set up for testing with the example dataset split in two books."""
+        self.contacts = read_json('tests/test_data/example_contacts.json')
+        self.paths = [Path('tests/test_data/test_books_personal.json'),
+                      Path('tests/test_data/test_books_work.json')]
+        for path, contacts in zip(self.paths, (self.contacts[::2],
+                                               self.contacts[1::2])):
+            with open(path, 'w') as f:
+                json.dump(contacts, f)
+        self.config = {
+            'books': {'personal': str(self.paths[0].resolve()),
+                      'work': str(self.paths[1].resolve())},
+            'default_book': 'work',
+        }
+
+    def tearDown(self):
+        """Remove the books and anything written next to them."""
+        for book in self.paths:
+            for path in book.parent.glob(f'{book.name}*'):
+                os.remove(path)
+
+    def test_selected(self):
+        """Test which books each subcommand uses."""
+        personal, work = (path.resolve() for path in self.paths)
+        with patch('contacts.books.config', self.config):
+            for subcommand, names, expected in [
+                ('show', None, [personal, work]),
+                ('lookup', None, [personal, work]),
+                ('modify', ['work'], [work]),
+                ('add', None, [work]),
+                ('import', ['personal', 'personal'], [personal]),
+            ]:
+                with self.subTest(subcommand=subcommand, names=names):
+                    args = Namespace(subcommand=subcommand, book=names)
+                    self.assertEqual(books.selected(args), expected)
+            for names in (['nope'], ['personal', 'work']):
+                with self.assertRaises(SystemExit):
+                    books.selected(Namespace(subcommand='add', book=names))
+
+    def test_fan_out(self):
+        """Test matches from every book are merged by name."""
+        args = Namespace(query_str='rick', fuzzy=False)
+        expected = [
+            contact for contact in self.contacts
+            if any('rick' in value.lower()
+                   for value in searchable_values(contact))
+        ]
+        for cpus in (1, 2):
+            with self.subTest(cpus=cpus), \
+                    patch('os.cpu_count', return_value=cpus):
+                matches = books.fan_out(self.paths, args)
+                self.assertTrue(all(matches))
+                self.assertEqual(books.merge_matches(matches, args), expected)
+
+    def test_command(self):
+        """Test only the book owning a contact is written."""
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'contacts').mkdir()
+            with open(Path(directory, 'contacts', 'config.json'), 'w') as f:
+                json.dump(self.config, f)
+            env = dict(os.environ, XDG_CONFIG_HOME=directory)
+
+            def contacts(*argv):
+                return subprocess.run(
+                    [sys.executable, '-m', 'contacts', *argv],
+                    env=env, capture_output=True, text=True, check=True
+                ).stdout.splitlines()
+
+            work = self.paths[1].read_bytes()
+            contacts('-b', 'personal', 'add', '-n', 'Birdperson')
+            self.assertEqual(self.paths[1].read_bytes(), work)
+            contacts('-q', 'name:=Birdperson', 'modify', '-t', 'bird')
+            self.assertEqual(self.paths[1].read_bytes(), work)
+            names = contacts('-q', 'plumbus', 'get_field', 'name')
+            self.assertEqual(names, [contact['name']
+                                     for contact in self.contacts])
+            self.assertEqual(contacts('-q', 'bird', 'get_field', 'tags'),
+                             ['bird'])
+            rick, alan = self.contacts[56], self.contacts[1]
+            self.assertEqual(
+                contacts('lookup', '-e', rick['email'][0],
+                         '-p', alan['phone'][0]),
+                [f'{alan["phone"][0]}\t{alan["uuid"]}\t{alan["name"]}',
+                 f'{rick["email"][0]}\t{rick["uuid"]}\tRick Sanchez']
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
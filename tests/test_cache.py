@@ -0,0 +1,83 @@
+"""Tests for the cache module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts import cache
+from contacts.contacts import ContactManager
+from contacts.storage import JSONStorage
+
+
+class TestContactCache(unittest.TestCase):
+    """Test the cache of parsed and sorted contacts"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_cache_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.storage = JSONStorage(self.json_file)
+        cache.stats.update(hits=0, misses=0)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def test_hit_after_miss(self):
+        """Test the second load is served from the cache."""
+        first = self.storage.load()
+        second = JSONStorage(self.json_file).load()
+        self.assertEqual(first, second)
+        self.assertEqual(cache.stats, {'hits': 1, 'misses': 1})
+        self.assertEqual(second, sorted(second, key=lambda c: c['name']))
+
+    def test_stale_after_change(self):
+        """Test the cache is not used once the json file changes."""
+        self.storage.load()
+        with open(self.json_file, 'w+') as f:
+            json.dump([], f)
+        self.assertEqual(JSONStorage(self.json_file).load(), [])
+        self.assertEqual(cache.stats, {'hits': 0, 'misses': 2})
+
+    def test_updated_on_commit(self):
+        """Test writes leave a valid cache behind."""
+        data = ContactManager(self.json_file, self.storage)
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Birdperson', email=None,
+                                    phone=None, tags=None))
+        reloaded = JSONStorage(self.json_file).load()
+        self.assertEqual(cache.stats['hits'], 1)
+        self.assertIn('Birdperson', [c['name'] for c in reloaded])
+
+    def test_corrupt_cache(self):
+        """Test an unreadable cache is treated as a miss."""
+        with open(self.storage.cache.path, 'wb') as f:
+            f.write(b'\x00garbage')
+        self.assertEqual(len(self.storage.load()), 81)
+        self.assertEqual(cache.stats['misses'], 1)
+
+    def test_cache_subcommand(self):
+        """Test the cache subcommand reports and invalidates the cache."""
+        data = ContactManager(self.json_file, self.storage)
+        data.query(None)
+        with patch('sys.stdout', new=StringIO()) as mock_stdout:
+            data.cache(args=Namespace(info=True, invalidate=False))
+        info = json.loads(mock_stdout.getvalue())
+        self.assertTrue(info['valid'])
+        self.assertEqual(info['records'], 81)
+        self.assertEqual(info['misses'], 1)
+
+        with patch('sys.stderr', new=StringIO()):
+            data.cache(args=Namespace(info=False, invalidate=True))
+        self.assertFalse(self.storage.cache.path.exists())
+
+
+if __name__ == '__main__':
+    unittest.main()
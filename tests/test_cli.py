@@ -0,0 +1,49 @@
+"""Tests for the cli module."""
+
+import subprocess
+import sys
+import unittest
+
+from contacts.cli import CLI
+
+
+class TestCLI(unittest.TestCase):
+    """Test command line parsing"""
+
+    def test_find_subcommand(self):
+        """Test the subcommand is found without parsing arguments."""
+        cli = CLI(['get_field', 'email'])
+        self.assertEqual(cli.find_subcommand(['-q', 'show', 'get_field']),
+                         'get_field')
+        self.assertEqual(cli.find_subcommand(['--query_str=x', 'show']),
+                         'show')
+        self.assertIsNone(cli.find_subcommand(['-q', 'rick']))
+        self.assertIsNone(cli.find_subcommand(['-h', 'show']))
+
+    def test_only_selected_parser_built(self):
+        """Test only the parser for the subcommand being run is built."""
+        cli = CLI(['-q', 'rick', 'get_field', 'email'])
+        self.assertEqual(list(cli.subparsers.choices), ['get_field'])
+        self.assertEqual(cli.args.query_str, 'rick')
+        self.assertEqual(cli.args.fieldname, 'email')
+
+    def test_all_parsers_built_without_subcommand(self):
+        """Test every subcommand is listed when none is given."""
+        cli = CLI(['-q', 'rick'])
+        self.assertEqual(list(cli.subparsers.choices), list(CLI.subcommands))
+        self.assertIsNone(cli.args.subcommand)
+
+    def test_lazy_imports(self):
+        """Test importing the package does not import heavy modules."""
+        code = 'import sys, contacts.__main__, contacts.server; ' \
+               'print(sorted({"tabulate", "asyncio", "subprocess"} ' \
+               '& set(sys.modules)))'
+        output = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True, text=True, check=True
+        ).stdout
+        self.assertEqual(output, '[]\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+"""Tests for the columns module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from contextlib import redirect_stdout
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from contacts.columns import (
+    ColumnStore, column_path, field_text, fields, read_column
+)
+from contacts.contacts import ContactManager
+from contacts.export import formats
+from contacts.storage import (
+    JSONStorage, JournalStorage, encode_lines, fingerprint, read_json
+)
+
+# Values which cannot all be sliced from their json encoding
+awkward = [
+    {'name': 'Quote " and \\ backslash', 'email': ['a", "b@c.com', 'x'],
+     'phone': [], 'tags': ['[]', ''], 'uuid': 'u1'},
+    {'name': 'Müller \U0001f600', 'email': ['é@x.fr'],
+     'phone': ['1', 2], 'tags': None, 'uuid': 'u2'},
+    {'name': '', 'email': ['tab\there'], 'phone': ['"1"'], 'uuid': 'u3'},
+]
+
+
+class TestColumns(unittest.TestCase):
+    """Test reading single fields of every contact from their columns"""
+
+    def setUp(self):
+        """Set up for testing with a line-delimited copy of the example
+        dataset.
+        """
+        self.json_file = Path('tests/test_data/test_columns_contacts.json')
+        self.contacts = read_json('tests/test_data/example_contacts.json')
+        self.write(self.contacts)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def write(self, contacts):
+        with open(self.json_file, 'w') as f:
+            f.write(encode_lines(contacts))
+
+    def store(self, fields=fields):
+        return ColumnStore.open(self.json_file, self.json_file,
+                                fingerprint(self.json_file), fields)
+
+    def run_command(self, method, args, columns=True):
+        """Return what a subcommand writes to stdout, given every contact
+        unless it may read columns
+        """
+        data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        indices = None if columns else range(len(data.contacts))
+        output = StringIO()
+        with redirect_stdout(output):
+            getattr(data, method)(indices, args)
+        return output.getvalue()
+
+    def test_text(self):
+        """Test get_field text is written as if values were decoded."""
+        contacts = self.contacts + awkward
+        self.write(contacts)
+        store = self.store()
+        for size in (1 << 20, 64):
+            for field in fields:
+                with self.subTest(size=size, field=field), \
+                        patch('contacts.columns.chunk_size', size):
+                    self.assertEqual(
+                        ''.join(store.text_chunks(field)),
+                        ''.join(f'{field_text(contact.get(field))}\n'
+                                for contact in contacts)
+                    )
+        self.assertEqual(store.count(), len(contacts))
+        encoded = [json.dumps({'name': contact['name'],
+                               'tags': contact.get('tags')})
+                   for contact in contacts]
+        self.assertEqual([record.decode() for record in
+                          store.records(['name', 'tags'])], encoded)
+        store.close()
+
+    def test_commands(self):
+        """Test output read from columns is the same as from contacts."""
+        for field in fields:
+            with self.subTest(field=field):
+                args = Namespace(fieldname=field)
+                self.assertEqual(self.run_command('get_field', args),
+                                 self.run_command('get_field', args, False))
+        for format in formats:
+            with self.subTest(format=format):
+                args = Namespace(format=format, fields='tags,name',
+                                 order='name', output_file=None)
+                self.assertEqual(self.run_command('export', args),
+                                 self.run_command('export', args, False))
+        self.assertTrue(column_path(self.json_file, 'tags').exists())
+        with patch('sys.stderr', new=StringIO()):
+            for method, args in [
+                ('get_field', Namespace(fieldname='nickname')),
+                ('export', Namespace(fields='name,nickname')),
+            ]:
+                with self.assertRaises(SystemExit):
+                    self.run_command(method, args)
+
+    def test_kept_up_to_date(self):
+        """Test columns are rewritten with the snapshot, and rebuilt if
+        the snapshot was written without them.
+        """
+        self.store(['name']).close()
+        data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Birdperson', email=None,
+                                    phone=None, tags=None))
+        path = column_path(self.json_file, 'name')
+        column = read_column(path, fingerprint(self.json_file))
+        self.assertIsNotNone(column)
+        column[0].close()
+        self.assertFalse(column_path(self.json_file, 'email').exists())
+        names = self.run_command('get_field', Namespace(fieldname='name'))
+        self.assertIn('Birdperson\n', names)
+        self.write(self.contacts)
+        self.assertIsNone(read_column(path, fingerprint(self.json_file)))
+        names = self.run_command('get_field', Namespace(fieldname='name'))
+        self.assertNotIn('Birdperson\n', names)
+
+    def test_journal(self):
+        """Test changes waiting in the journal are not missed."""
+        data = ContactManager(self.json_file, JournalStorage(self.json_file))
+        self.assertIsNotNone(data.storage.columns(['name']))
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Birdperson', email=None,
+                                    phone=None, tags=None))
+        data = ContactManager(self.json_file, JournalStorage(self.json_file))
+        self.assertIsNone(data.storage.columns(['name']))
+        output = StringIO()
+        with redirect_stdout(output):
+            data.get_field(None, Namespace(fieldname='name'))
+        self.assertIn('Birdperson\n', output.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
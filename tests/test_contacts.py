@@ -4,12 +4,14 @@ import json
 import os
 import unittest
 
+from argparse import Namespace
 from unittest.mock import patch
 from shutil import copyfile#, get_terminal_size
 from io import StringIO
 from pathlib import Path
 
 from contacts.contacts import ContactManager
+from contacts.index import TrigramIndex
 
 class TestContacts(unittest.TestCase):
     """Test contact management utilities"""
@@ -33,9 +35,11 @@ class TestContacts(unittest.TestCase):
         """Tear down after testing.
 
         Remove test_contacts.json file which may or may not have been
-        edited by the preceding test.
+        edited by the preceding test, along with any index files written
+        next to it.
         """
-        os.remove(self.json_file)
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
 
     def test_read_json(self):
         """Test read_json method (used in ContactManager constructor)."""
@@ -85,8 +89,34 @@ class TestContacts(unittest.TestCase):
         query_string = 'Rick'
         test_indices = self.data.query(query_string)
         correct_indices = {68, 13, 15, 18, 21, 56, 59}
+        self.assertEqual(set(test_indices), correct_indices)
+        self.assertEqual(test_indices, sorted(test_indices))
+
+    def test_query_short(self):
+        """Test queries shorter than a trigram fall back to a scan."""
+        test_indices = self.data.query('Ri')
+        correct_indices = [
+            index for index, contact in enumerate(self.data.contacts)
+            if 'ri' in json.dumps(list(contact.values())).lower()
+        ]
         self.assertEqual(test_indices, correct_indices)
 
+    def test_query_after_add(self):
+        """Test the index is updated incrementally when adding."""
+        with patch.object(TrigramIndex, 'scans_before_build', 0):
+            index = self.data.index
+        self.assertIsNotNone(index)
+        args = Namespace(name='Squanchy Junior', email=None, phone=None,
+                         tags=['squanch'])
+        with patch('sys.stderr', new=StringIO()):
+            self.data.add(args=args)
+        self.assertIs(self.data.index, index)
+        matches = self.data.list_matches(self.data.query('squanch'))
+        self.assertEqual(
+            [match['name'] for match in matches],
+            ['Squanchy', 'Squanchy Junior']
+        )
+
     def test_list_matches(self):
         """Test list_matches method."""
         test_indices = {56, 46}
@@ -0,0 +1,168 @@
+"""Tests for the dedupe module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from io import StringIO
+from pathlib import Path
+from shutil import copyfile
+from unittest.mock import patch
+
+from contacts import dedupe
+from contacts.contacts import ContactManager
+from contacts.storage import read_json
+
+
+class TestScoring(unittest.TestCase):
+    """Test blocking and scoring of candidate duplicates"""
+
+    def test_soundex(self):
+        """Test names sounding alike have the same key."""
+        self.assertEqual(dedupe.soundex('Robert'), 'R163')
+        self.assertEqual(dedupe.soundex('Rupert'), 'R163')
+        self.assertEqual(dedupe.soundex('Ashcraft'), 'A261')
+        self.assertEqual(dedupe.soundex('Tymczak'), 'T522')
+        self.assertEqual(dedupe.name_key('Rick  Sanchez'),
+                         dedupe.name_key('Rik Sánchez'))
+        self.assertIsNone(dedupe.name_key(''))
+
+    def test_candidate_pairs(self):
+        """Test only contacts sharing a block are paired."""
+        contacts = [
+            {'name': 'Rick Sanchez', 'email': ['rick@citadel.com']},
+            {'name': 'Morty Smith', 'email': ['Rick@Citadel.com']},
+            {'name': 'Rik Sanchez', 'phone': ['0700 000 0001']},
+            {'name': 'Summer Smith', 'phone': ['07000000002']},
+        ]
+        pairs, skipped = dedupe.candidate_pairs(contacts)
+        self.assertEqual(pairs, {(0, 1), (0, 2)})
+        self.assertEqual(skipped, 0)
+        pairs, skipped = dedupe.candidate_pairs(contacts, max_block=1)
+        self.assertEqual(pairs, {(0, 2)})
+        self.assertEqual(skipped, 1)
+
+    def test_score(self):
+        """Test shared details and similar names add up to a score."""
+        rick = {'name': 'Rick Sanchez', 'email': ['rick@citadel.com'],
+                'phone': ['07000000001']}
+        self.assertEqual(dedupe.score(rick, rick), 1)
+        self.assertAlmostEqual(dedupe.score(rick, {
+            'name': 'Rick Sanchez', 'email': ['RICK@citadel.com'],
+        }), 1)
+        # The same name with different details is someone else
+        self.assertEqual(dedupe.score(rick, {
+            'name': 'Rick Sanchez', 'email': ['rick@earth.com'],
+        }), 0.5)
+        # The same name without details may be the same person
+        self.assertEqual(dedupe.score(rick, {'name': 'Rick Sanchez'}), 0.75)
+
+
+class TestDedupe(unittest.TestCase):
+    """Test planning and applying the merge of duplicates"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset with
+        duplicates of some of its contacts added.
+        """
+        self.json_file = Path('tests/test_data/test_dedupe_contacts.json')
+        self.plan_file = f'{self.json_file}.plan.json'
+        self.backup = f'{self.json_file}.deleted.ndjson'
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.contacts = read_json(self.json_file)
+        data = ContactManager(self.json_file)
+        self.duplicates = [
+            # A new email address, the same phone number and a tag
+            dict(self.contacts[0], uuid='dupe-0', email=['abradolf@home.com'],
+                 phone=['0700 793-7005'], tags=['home']),
+            # The same email address and a typo in the name
+            dict(self.contacts[1], uuid='dupe-1', name='Alan Rials',
+                 phone=[]),
+        ]
+        data.merge(self.duplicates)
+        with patch('sys.stderr', new=StringIO()):
+            data.overwrite()
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def run_dedupe(self, apply=None, status=None):
+        data = ContactManager(self.json_file)
+        args = Namespace(apply=apply, plan=self.plan_file, threshold=0.75,
+                         jobs=1, backup=self.backup)
+        with patch('sys.stderr', new=StringIO()) as mock_stderr:
+            try:
+                data.dedupe(range(len(data.contacts)), args)
+            except SystemExit as exit:
+                self.assertEqual(exit.code, status)
+            else:
+                self.assertIsNone(status)
+        return mock_stderr.getvalue()
+
+    def test_plan(self):
+        """Test each duplicate is planned to merge into its original."""
+        self.run_dedupe()
+        with open(self.plan_file) as f:
+            groups = json.load(f)['groups']
+        self.assertEqual(
+            sorted((group['keep'], group['merge']) for group in groups),
+            [(self.contacts[1]['uuid'], ['dupe-1']),
+             ('dupe-0', [self.contacts[0]['uuid']])]
+        )
+        # The contact with the most details is kept
+        first = next(group for group in groups if group['keep'] == 'dupe-0')
+        self.assertEqual(first['result']['email'], [
+            'abradolf@home.com', 'abradolf.lincler@plumbus.com'
+        ])
+        self.assertEqual(first['result']['phone'], ['0700 793-7005'])
+        self.assertEqual(first['result']['tags'], ['home'])
+
+    def test_apply(self):
+        """Test applying a plan merges each group and archives the rest."""
+        self.run_dedupe()
+        self.assertIn('merging 2 contacts into 2',
+                      self.run_dedupe(apply=self.plan_file))
+        contacts = ContactManager(self.json_file).contacts
+        self.assertEqual(len(contacts), 81)
+        uuids = {contact['uuid'] for contact in contacts}
+        self.assertIn('dupe-0', uuids)
+        self.assertIn(self.contacts[1]['uuid'], uuids)
+        self.assertNotIn(self.contacts[0]['uuid'], uuids)
+        self.assertNotIn('dupe-1', uuids)
+        with open(self.backup) as f:
+            archived = [json.loads(line)['uuid'] for line in f]
+        self.assertEqual(sorted(archived),
+                         sorted([self.contacts[0]['uuid'], 'dupe-1']))
+        # Applied again there is nothing left to merge
+        self.run_dedupe(apply=self.plan_file, status=1)
+
+    def test_apply_edited(self):
+        """Test groups removed from a plan or overlapping are not merged."""
+        self.run_dedupe()
+        with open(self.plan_file) as f:
+            plan = json.load(f)
+        plan['groups'] = [
+            group for group in plan['groups'] if group['keep'] == 'dupe-0'
+        ] * 2
+        with open(self.plan_file, 'w') as f:
+            json.dump(plan, f)
+        self.run_dedupe(apply=self.plan_file)
+        uuids = {contact['uuid'] for contact in
+                 ContactManager(self.json_file).contacts}
+        self.assertEqual(len(uuids), 82)
+        self.assertNotIn(self.contacts[0]['uuid'], uuids)
+        self.assertIn('dupe-1', uuids)
+
+    def test_bad_plan(self):
+        """Test a file which is not a plan is refused."""
+        with open(self.plan_file, 'w') as f:
+            json.dump([1, 2], f)
+        self.assertIn('Cannot read merge plan',
+                      self.run_dedupe(apply=self.plan_file, status=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+"""Tests for the editing module."""
+
+import json
+import os
+import sys
+import unittest
+
+from argparse import Namespace
+from io import StringIO
+from pathlib import Path
+from shutil import copyfile
+from unittest.mock import patch
+
+from contacts.contacts import ContactManager
+from contacts.editing import diff, encode, parse
+from contacts.storage import read_json
+
+
+class TestEditing(unittest.TestCase):
+    """Test editing many contacts at once and storing only the changes"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_editing_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.contacts = read_json(self.json_file)
+        self.editor = Path(f'{self.json_file}.editor')
+        self.backup = f'{self.json_file}.deleted.ndjson'
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def test_round_trip(self):
+        """Test contacts saved unchanged are not changed."""
+        for format in ('ndjson', 'text'):
+            with self.subTest(format=format):
+                records = parse(encode(self.contacts, format), format)
+                self.assertEqual(len(records), len(self.contacts))
+                self.assertEqual(diff(self.contacts, records), ([], [], []))
+
+    def test_diff(self):
+        """Test added, changed and removed records are told apart."""
+        # The first contact is removed
+        text = encode(self.contacts[1:3], 'text')
+        text = text.replace('Alan Rails', 'Alan Rails Jr')
+        text = text.replace('phone: 07043015449\n', 'phone: 1; 2\n')
+        text += '\nname: Birdperson\ntags: bird\n'
+        added, changed, removed = diff(self.contacts[:3],
+                                       parse(text, 'text'))
+        self.assertEqual(added, [{'name': 'Birdperson', 'email': [],
+                                  'phone': [], 'tags': ['bird'], 'uuid': ''}])
+        self.assertEqual([contact for original, contact in changed], [
+            dict(self.contacts[1], name='Alan Rails Jr'),
+            dict(self.contacts[2], phone=['1', '2']),
+        ])
+        self.assertEqual(removed, self.contacts[:1])
+        uuid = self.contacts[0]['uuid']
+        for text, error in [
+            ('name: x\nuuid: not-edited\n', 'not one of the contacts'),
+            (f'name: x\nuuid: {uuid}\n\nname: y\nuuid: {uuid}\n',
+             'given twice'),
+            ('name: x\nname: y\n', 'line 2: name given twice'),
+            ('nickname: x\n', 'line 1: expected one of'),
+            ('email: x\n', 'a contact needs a name'),
+        ]:
+            with self.subTest(text=text):
+                with self.assertRaisesRegex(ValueError, error):
+                    diff(self.contacts[:1], parse(text, 'text'))
+        with self.assertRaisesRegex(ValueError, 'line 2'):
+            parse('{}\n{"name"\n', 'ndjson')
+
+    def edit(self, indices, code='', format='ndjson', status=None):
+        """Edit contacts with an editor running code on the text of the
+        file, returning the calls to the storage's commit
+        """
+        with open(self.editor, 'w') as f:
+            f.write(f'#!{sys.executable}\n'
+                    f'import sys\n'
+                    f'text = open(sys.argv[1]).read()\n'
+                    f'{code}\n'
+                    f'open(sys.argv[1], "w").write(text)\n')
+        os.chmod(self.editor, 0o755)
+        data = ContactManager(self.json_file)
+        settings = {'tmp_edit_path': f'{self.json_file}.tmp'}
+        args = Namespace(editor=self.editor, format=format,
+                         backup=self.backup)
+        with patch('contacts.contacts.config', settings), \
+                patch('sys.stderr', new=StringIO()), \
+                patch.object(data.storage, 'commit',
+                             wraps=data.storage.commit) as commit:
+            try:
+                data.edit(indices, args)
+            except SystemExit as exit:
+                self.assertEqual(exit.code, status)
+            else:
+                self.assertIsNone(status)
+        return commit.call_args_list
+
+    def test_unchanged(self):
+        """Test nothing is written if nothing was changed."""
+        with open(self.json_file, 'rb') as f:
+            stored = f.read()
+        self.assertEqual(self.edit(range(len(self.contacts))), [])
+        self.assertEqual(self.edit([0, 1], format='text'), [])
+        with open(self.json_file, 'rb') as f:
+            self.assertEqual(f.read(), stored)
+
+    def test_edit(self):
+        """Test only the changed contacts are stored."""
+        code = ('lines = text.splitlines(True)\n'
+                'text = lines[0].replace("Abradolf Lincler", "Zed") '
+                '+ "".join(lines[2:]) + \'{"name": "Birdperson"}\\n\'')
+        call, = self.edit(range(5), code)
+        changes = call.args[1]
+        self.assertEqual([(op, contact['name']) for op, contact in changes], [
+            ('add', 'Birdperson'),
+            ('update', 'Zed'),
+            ('delete', 'Alan Rails'),
+        ])
+        contacts = ContactManager(self.json_file).contacts
+        self.assertEqual(len(contacts), 81)
+        self.assertIn(dict(self.contacts[0], name='Zed'), contacts)
+        with open(self.backup) as f:
+            self.assertEqual(json.loads(f.read()), self.contacts[1])
+        self.assertFalse(os.path.exists(f'{self.json_file}.tmp.ndjson'))
+
+    def test_invalid_edit(self):
+        """Test an unreadable edit changes nothing and is kept."""
+        calls = self.edit([0], 'text += "name: x\\nuuid: nope\\n"', 'text', 1)
+        self.assertEqual(calls, [])
+        self.assertTrue(os.path.exists(f'{self.json_file}.tmp.text'))
+
+
+if __name__ == '__main__':
+    unittest.main()
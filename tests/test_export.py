@@ -0,0 +1,85 @@
+"""Tests for the export module."""
+
+import csv
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.export import vcard_fold, vcard_lines
+
+
+class TestExport(unittest.TestCase):
+    """Test streaming export in each format"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_export_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.data = ContactManager(self.json_file)
+        self.indices = range(len(self.data.contacts))
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def export(self, indices, format):
+        args = Namespace(output_file=None, format=format)
+        with patch('sys.stdout', new=StringIO()) as mock_stdout:
+            self.data.export(indices, args)
+        return mock_stdout.getvalue()
+
+    def test_json_empty(self):
+        """Test exporting no contacts gives an empty array."""
+        self.assertEqual(self.export([], 'json'), '[]')
+
+    def test_ndjson(self):
+        """Test ndjson export writes one contact per line."""
+        lines = self.export(self.indices, 'ndjson').splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         self.data.contacts)
+
+    def test_csv(self):
+        """Test csv export writes a header and one row per contact."""
+        rows = list(csv.DictReader(StringIO(self.export(self.indices, 'csv'))))
+        self.assertEqual(len(rows), 81)
+        for row, contact in zip(rows, self.data.contacts):
+            self.assertEqual(row['uuid'], contact['uuid'])
+            self.assertEqual(row['email'], '; '.join(contact['email']))
+
+    def test_vcard(self):
+        """Test vcard export writes one card per contact."""
+        output = self.export(self.indices, 'vcard')
+        self.assertEqual(output.count('BEGIN:VCARD\r\n'), 81)
+        self.assertEqual(output.count('END:VCARD\r\n'), 81)
+
+    def test_vcard_escaping(self):
+        """Test special characters are escaped and long lines folded."""
+        contact = {'name': 'Smith, John; Jr.', 'email': [], 'phone': [],
+                   'tags': ['a,b'], 'uuid': 'x'}
+        lines = vcard_lines(contact)
+        self.assertIn('FN:Smith\\, John\\; Jr.', lines)
+        self.assertIn('CATEGORIES:a\\,b', lines)
+        folded = vcard_fold('FN:' + 'é' * 60)
+        parts = folded.split('\r\n ')
+        self.assertTrue(all(len(p.encode()) <= 75 for p in parts))
+        self.assertEqual(''.join(parts), 'FN:' + 'é' * 60 + '\r\n')
+
+    def test_output_file(self):
+        """Test export to a file."""
+        output = self.json_file.with_name(f'{self.json_file.name}.out')
+        args = Namespace(output_file=str(output), format='json')
+        self.data.export(self.indices, args)
+        with open(output, 'r') as f:
+            self.assertEqual(json.load(f), self.data.contacts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Tests for the fuzzy module."""
+
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.fuzzy import FuzzyIndex, edit_distance, fuzzy_index_path
+
+
+class TestFuzzy(unittest.TestCase):
+    """Test ranked fuzzy search"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_fuzzy_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.data = ContactManager(self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def names(self, query, top=10):
+        indices = self.data.fuzzy_query(query, top)
+        return [self.data.contacts[i]['name'] for i in indices]
+
+    def test_edit_distance(self):
+        """Test swapped letters count as a single edit."""
+        self.assertEqual(edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(edit_distance('rikc', 'rick'), 1)
+        self.assertEqual(edit_distance('', 'abc'), 3)
+
+    def test_typos(self):
+        """Test close matches are found despite typos."""
+        self.assertEqual(self.names('squancy'), ['Squanchy'])
+        self.assertEqual(self.names('morty smth'), ['Morty Smith'])
+        self.assertEqual(self.names('sanches'),
+                         ['Diane Sanchez', 'Rick Sanchez'])
+        self.assertEqual(self.names('xyzzy'), [])
+
+    def test_ranking(self):
+        """Test exact matches rank above completions and typos."""
+        self.assertEqual(self.names('rick sanchez')[0], 'Rick Sanchez')
+        names = self.names('rick', top=3)
+        self.assertEqual(len(names), 3)
+        self.assertTrue(all('Rick' in name for name in names))
+        self.assertEqual(self.names('abradolf.linc'), ['Abradolf Lincler'])
+
+    def test_index_updated(self):
+        """Test added contacts are found without rebuilding the index, in
+        the manager which added them and in the next one, through the
+        index log.
+        """
+        self.data.fuzzy_index
+        path = fuzzy_index_path(self.json_file)
+        saved = path.read_bytes()
+        args = Namespace(name='Mr. Poopybutthole', email=None, phone=None,
+                         tags=None)
+        with patch('sys.stderr', new=StringIO()):
+            self.data.add(args=args)
+        self.assertEqual(self.names('poopybuthole'), ['Mr. Poopybutthole'])
+
+        self.data = ContactManager(self.json_file)
+        with patch.object(FuzzyIndex, 'build') as build:
+            self.assertEqual(self.names('poopybuthole'),
+                             ['Mr. Poopybutthole'])
+            self.assertEqual(self.names('poopy'), ['Mr. Poopybutthole'])
+        build.assert_not_called()
+        self.assertEqual(path.read_bytes(), saved)
+
+    def test_find(self):
+        """Test --fuzzy selects ranked matches."""
+        args = Namespace(query_str='rikc sanchez', fuzzy=True, top=1)
+        indices = self.data.find(args)
+        self.assertEqual(self.data.contacts[indices[0]]['name'],
+                         'Rick Sanchez')
+
+
+if __name__ == '__main__':
+    unittest.main()
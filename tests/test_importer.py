@@ -0,0 +1,100 @@
+"""Tests for the importer module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.export import write_export
+from contacts.importer import json_records, normalize, read_contacts
+
+
+class TestImporter(unittest.TestCase):
+    """Test bulk import in each format"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_importer_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.data = ContactManager(self.json_file)
+        self.new_contacts = [
+            {'name': f'Clone {n}', 'email': [f'clone{n}@plumbus.com'],
+             'phone': [], 'tags': ['clone'], 'uuid': f'clone-{n}'}
+            for n in range(50)
+        ]
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def import_file(self, contacts, format, jobs=1):
+        input_file = self.json_file.with_name(
+            f'{self.json_file.name}.{format}'
+        )
+        with open(input_file, 'w', newline='') as f:
+            write_export(contacts, f, format)
+        args = Namespace(input_file=str(input_file), format=None, jobs=jobs)
+        with patch('sys.stderr', new=StringIO()) as mock_stderr:
+            self.data.import_json(args=args)
+        return mock_stderr.getvalue()
+
+    def test_round_trip(self):
+        """Test contacts exported in each format are imported unchanged."""
+        for format in ('json', 'ndjson', 'csv', 'vcard'):
+            with self.subTest(format=format):
+                output = StringIO(newline='')
+                write_export(self.data.contacts, output, format)
+                output.seek(0)
+                contacts, skipped = read_contacts(output, format)
+                self.assertEqual(skipped, 0)
+                self.assertEqual(contacts, self.data.contacts)
+
+    def test_import(self):
+        """Test imported contacts are stored with a single write."""
+        output = self.import_file(self.new_contacts, 'ndjson', jobs=2)
+        self.assertIn('imported 50 contacts (0 updated, 0 skipped)', output)
+        self.assertEqual(output.count('overwriting'), 1)
+        reloaded = ContactManager(self.json_file)
+        self.assertEqual(len(reloaded.contacts), 131)
+        self.assertEqual(len(reloaded.query('clone')), 50)
+
+    def test_import_updates(self):
+        """Test a contact with a stored uuid replaces the stored contact."""
+        contact = dict(self.data.contacts[0], name='Abradolf Lincler II')
+        output = self.import_file([contact], 'csv')
+        self.assertIn('(1 updated, 0 skipped)', output)
+        reloaded = ContactManager(self.json_file)
+        self.assertEqual(len(reloaded.contacts), 81)
+        self.assertEqual(reloaded.contacts[0]['name'], 'Abradolf Lincler II')
+
+    def test_invalid_records_skipped(self):
+        """Test records without a name are skipped and uuids assigned."""
+        lines = ['{"name": "  Mr. Meeseeks ", "email": "a@b.com; a@b.com"}',
+                 '{"email": ["nameless@plumbus.com"]}', 'not json', '']
+        contacts, skipped = read_contacts(StringIO('\n'.join(lines)),
+                                          'ndjson')
+        self.assertEqual(skipped, 2)
+        self.assertEqual(contacts[0]['name'], 'Mr. Meeseeks')
+        self.assertEqual(contacts[0]['email'], ['a@b.com'])
+        self.assertTrue(contacts[0]['uuid'])
+        self.assertIsNone(normalize({'name': 'Squanchy', 'tags': [1]}))
+
+    def test_json_records_chunked(self):
+        """Test the json array reader with records split across chunks."""
+        text = json.dumps(self.data.contacts)
+        records = list(json_records(StringIO(text), chunk_size=7))
+        self.assertEqual(records, self.data.contacts)
+        self.assertEqual(list(json_records(StringIO(' [ ] '))), [])
+        with self.assertRaises(ValueError):
+            list(json_records(StringIO('[{"name": "Rick"')))
+
+
+if __name__ == '__main__':
+    unittest.main()
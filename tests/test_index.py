@@ -0,0 +1,155 @@
+"""Tests for the index module."""
+
+import json
+import os
+import unittest
+
+from shutil import copyfile
+from pathlib import Path
+from unittest.mock import patch
+
+from contacts.conf import config
+from contacts.index import (
+    FieldIndex, TrigramIndex, append_log, field_index_path, index_log_path,
+    index_path, normalize_phone, normalize_value, trigrams
+)
+from contacts.storage import fingerprint
+
+
+class TestTrigramIndex(unittest.TestCase):
+    """Test the persistent trigram index"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_index_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        with open(self.json_file, 'r') as f:
+            self.contacts = json.load(f)
+        self.path = index_path(self.json_file)
+        self.log_path = index_log_path(self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset and its index."""
+        for path in (self.json_file, self.path, self.log_path,
+                     field_index_path(self.json_file)):
+            if path.exists():
+                os.remove(path)
+
+    def test_normalize(self):
+        """Test phone numbers are normalized to E.164 digits and emails
+        are case folded.
+        """
+        self.assertEqual(normalize_phone('+44 7700 900123'), '447700900123')
+        self.assertEqual(normalize_phone('0044 (7700) 900-123'),
+                         '447700900123')
+        self.assertEqual(normalize_phone('07700 900123'), '07700900123')
+        self.assertEqual(normalize_phone('07700 900123', '44'),
+                         '447700900123')
+        self.assertEqual(normalize_phone('+1 555 0100', '44'), '15550100')
+        self.assertEqual(normalize_value('email', ' Rick@Citadel.ORG '),
+                         'rick@citadel.org')
+
+    def test_trigrams(self):
+        """Test trigrams are lowercased and overlapping."""
+        self.assertEqual(trigrams('Rick'), {'ric', 'ick'})
+        self.assertEqual(trigrams('Ri'), set())
+
+    def test_candidates(self):
+        """Test candidates contain every contact matching the query."""
+        index = TrigramIndex.build(self.path, None, self.contacts)
+        self.assertFalse(self.path.exists())
+        candidates = index.candidates('sanchez')
+        names = {c['name'] for c in self.contacts if c['uuid'] in candidates}
+        self.assertEqual(names, {'Rick Sanchez', 'Diane Sanchez'})
+        self.assertIsNone(index.candidates('ab'))
+        self.assertEqual(index.candidates('xyzzy'), set())
+
+    def test_table(self):
+        """Test keys outside ascii are found and prefixes are ranges."""
+        contacts = [{'uuid': str(i), 'name': name} for i, name in
+                    enumerate(['Zoë', 'Zoe', 'Ünal', '\ud83d x'])]
+        index = FieldIndex.build(self.path, None, contacts)
+        self.assertEqual(index.name_prefix('zoë', exact=True), {'0'})
+        self.assertEqual(index.name_prefix('zo'), {'0', '1'})
+        self.assertEqual(index.name_prefix('ün'), {'2'})
+        self.assertEqual(index.name_prefix('\ud83d'), {'3'})
+        self.assertEqual(index.lookup('name', 'na', 'contains'), {'2'})
+
+    def open(self, source, contacts=None, changes=()):
+        if contacts is None:
+            contacts = self.contacts
+        return TrigramIndex.open(self.path, source, contacts, self.log_path,
+                                 changes)
+
+    def test_open(self):
+        """Test the index is only built after repeated scans of the same
+        version, then reused while fresh.
+        """
+        source = fingerprint(self.json_file)
+        for scan in range(TrigramIndex.scans_before_build):
+            self.assertIsNone(self.open(source))
+        index = self.open(source)
+        self.assertEqual(index.source, source)
+        with patch.object(TrigramIndex, 'build') as build:
+            reopened = self.open(source)
+        build.assert_not_called()
+        self.assertEqual(reopened.candidates('sanchez'),
+                         index.candidates('sanchez'))
+
+        with open(self.json_file, 'w+') as f:
+            json.dump([], f)
+        self.assertIsNone(self.open(fingerprint(self.json_file), []))
+
+    def test_follow(self):
+        """Test changes made since the index was built are followed, in
+        memory and through the index log.
+        """
+        rick = next(c for c in self.contacts if c['name'] == 'Rick Sanchez')
+        morty = dict(rick, name='Morty Sanchez')
+        zorp = {'uuid': 'zorp', 'name': 'Zorp Sanchez'}
+        index = TrigramIndex.build(self.path, 'first', self.contacts)
+        index.add(morty)
+        index.add(zorp)
+        self.assertNotIn(rick['uuid'], index.candidates('rick sanchez'))
+        self.assertEqual(index.candidates('morty sanchez'), {rick['uuid']})
+        index.remove('zorp')
+        self.assertEqual(index.candidates('zorp'), set())
+
+        append_log(self.log_path, 'first', 'second', [['update', morty]])
+        append_log(self.log_path, 'second', 'third', [['add', zorp]])
+        with patch.object(TrigramIndex, 'build') as build:
+            reopened = self.open('third', changes=[('delete', zorp)])
+            self.assertEqual(reopened.candidates('sanchez'),
+                             index.candidates('sanchez'))
+            self.assertEqual(self.open('second').candidates('zorp'), set())
+            self.assertEqual(self.open('third').candidates('zorp'), {'zorp'})
+        build.assert_not_called()
+        self.assertIsNone(self.open('fourth'))
+
+    def test_field_index(self):
+        """Test name prefix and field lookups."""
+        path = field_index_path(self.json_file)
+        index = FieldIndex.build(path, 'source', self.contacts)
+        rick = next(c for c in self.contacts if c['name'] == 'Rick Sanchez')
+        self.assertEqual(index.name_prefix('rick'), {rick['uuid']})
+        self.assertEqual(index.name_prefix('rick', exact=True), set())
+        self.assertEqual(index.lookup('email', rick['email'][0]),
+                         {rick['uuid']})
+        self.assertEqual(index.lookup('email', rick['email'][0][:4],
+                                      'prefix'), {rick['uuid']})
+        index.add(dict(rick, email=['rick@citadel.org']))
+        self.assertEqual(index.lookup('email', rick['email'][0]), set())
+        self.assertEqual(index.lookup('email', 'citadel', 'contains'),
+                         {rick['uuid']})
+
+        reopened = FieldIndex.open(path, 'source', self.contacts,
+                                   self.log_path)
+        self.assertEqual(reopened.name_prefix('rick'), {rick['uuid']})
+        settings = dict(config.settings, country_code='44')
+        with patch.object(config, '_settings', settings):
+            self.assertIsNone(FieldIndex.open(path, 'source', self.contacts,
+                                              self.log_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
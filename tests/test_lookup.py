@@ -0,0 +1,129 @@
+"""Tests for the lookup module."""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from argparse import Namespace
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from contacts.contacts import ContactManager
+from contacts.lookup import LookupIndex, lookup_index_path
+from contacts.storage import (
+    JSONStorage, JournalStorage, encode_lines, fingerprint, read_json
+)
+
+
+class TestLookup(unittest.TestCase):
+    """Test reverse lookup of phone numbers and email addresses"""
+
+    def setUp(self):
+        """Set up for testing with a line-delimited copy of the example
+        dataset.
+        """
+        self.json_file = Path('tests/test_data/test_lookup_contacts.json')
+        self.contacts = read_json('tests/test_data/example_contacts.json')
+        with open(self.json_file, 'w') as f:
+            f.write(encode_lines(self.contacts))
+        self.path = lookup_index_path(self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def index(self):
+        return LookupIndex.open(
+            self.path, self.json_file, fingerprint(self.json_file)
+        )
+
+    def test_find(self):
+        """Test every phone number and email finds its contact."""
+        index = self.index()
+        for contact in self.contacts:
+            for field in ('phone', 'email'):
+                for value in contact[field]:
+                    with self.subTest(value=value):
+                        self.assertIn(contact, index.find(field, value))
+        index.close()
+
+    def test_normalized(self):
+        """Test values are found however they are formatted."""
+        index = self.index()
+        names = [contact['name'] for contact in
+                 index.find('phone', '0700 793-7005')]
+        self.assertEqual(names, ['Abradolf Lincler'])
+        names = [contact['name'] for contact in
+                 index.find('email', 'Abradolf.Lincler@PLUMBUS.com')]
+        self.assertEqual(names, ['Abradolf Lincler'])
+        self.assertEqual(index.find('phone', '07007937006'), [])
+        self.assertEqual(index.find('email', 'abradolf'), [])
+        self.assertEqual(index.find('phone', 'none'), [])
+        index.close()
+
+    def test_kept_up_to_date(self):
+        """Test an existing index is rewritten with the snapshot."""
+        self.index().close()
+        data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Birdperson', email=['bp@bird.world'],
+                                    phone=['+1 555 0100'], tags=None))
+        index = LookupIndex.read(
+            self.path, self.json_file, fingerprint(self.json_file)
+        )
+        self.assertIsNotNone(index)
+        found, = index.find('phone', '0015550100')
+        self.assertEqual(found['name'], 'Birdperson')
+        index.close()
+
+    def test_owners(self):
+        """Test owners are found with or without the lookup index."""
+        for storage in (JSONStorage, JournalStorage):
+            with self.subTest(storage=storage.name):
+                data = ContactManager(self.json_file, storage(self.json_file))
+                owners = data.owners('email', 'ALAN.RAILS@plumbus.com')
+                self.assertEqual([owner['name'] for owner in owners],
+                                 ['Alan Rails'])
+        # Changes waiting in the journal are not in the indexed snapshot
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Birdperson', email=None,
+                                    phone=['07604760307'], tags=None))
+        data = ContactManager(self.json_file, JournalStorage(self.json_file))
+        owners = data.owners('phone', '07604760307')
+        self.assertEqual([owner['name'] for owner in owners],
+                         ['Alan Rails', 'Birdperson'])
+        self.assertIsNone(data.storage.lookup_index())
+
+    def test_command(self):
+        """Test values are looked up from options and stdin."""
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'contacts').mkdir()
+            with open(Path(directory, 'contacts', 'contacts.json'), 'w') as f:
+                f.write(encode_lines(self.contacts))
+            env = dict(os.environ, XDG_CONFIG_HOME=directory)
+            process = subprocess.run(
+                [sys.executable, '-m', 'contacts', 'lookup',
+                 '-p', '07007937005', '--stdin'],
+                input='alan.rails@plumbus.com\n\n0000\n',
+                env=env, capture_output=True, text=True
+            )
+            self.assertEqual(process.returncode, 0)
+            self.assertEqual(process.stdout.splitlines(), [
+                '07007937005\tca0617ca-6b04-11eb-844f-274375519e58\t'
+                'Abradolf Lincler',
+                'alan.rails@plumbus.com\tca0619dc-6b04-11eb-844f-274375519e58'
+                '\tAlan Rails',
+            ])
+            process = subprocess.run(
+                [sys.executable, '-m', 'contacts', 'lookup', '-p', '0000'],
+                env=env, capture_output=True, text=True
+            )
+            self.assertEqual(process.returncode, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
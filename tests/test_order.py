@@ -0,0 +1,93 @@
+"""Tests for the order module and the sorted contacts invariant."""
+
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.order import ModifiedLog, modified_log_path
+from contacts.storage import apply_changes, is_sorted, sort_contacts
+
+
+class TestOrder(unittest.TestCase):
+    """Test contacts stay sorted and secondary orders"""
+
+    def setUp(self):
+        """Set up for testing with a sorted copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_order_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.data = ContactManager(self.json_file)
+        with patch('sys.stderr', new=StringIO()):
+            self.data.overwrite()
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def run_subcommand(self, subcommand, indices=None, **kwargs):
+        args = Namespace(name=None, email=None, phone=None, tags=None)
+        vars(args).update(kwargs)
+        with patch('sys.stderr', new=StringIO()):
+            getattr(self.data, subcommand)(indices=indices, args=args)
+
+    def test_sorted_after_changes(self):
+        """Test adding and renaming contacts keeps the list sorted."""
+        self.run_subcommand('add', name='Mr. Poopybutthole')
+        self.assertTrue(is_sorted(self.data.contacts))
+        indices = self.data.query('sanchez')
+        self.run_subcommand('modify', indices, name='Aaron Sanchez')
+        self.assertTrue(is_sorted(self.data.contacts))
+        self.assertEqual(len(self.data.query('Aaron Sanchez')), 2)
+        self.assertEqual(ContactManager(self.json_file).contacts,
+                         self.data.contacts)
+
+    def test_load_skips_sorting_sorted_file(self):
+        """Test a sorted snapshot is loaded without sorting it."""
+        self.data.storage.cache.invalidate()
+        with patch('contacts.storage.sort_contacts') as sort_contacts:
+            contacts = ContactManager(self.json_file).contacts
+        sort_contacts.assert_not_called()
+        self.assertTrue(is_sorted(contacts))
+
+    def test_apply_changes(self):
+        """Test applying changes to sorted contacts keeps them sorted."""
+        contacts = list(self.data.contacts)
+        renamed = dict(contacts[0], name='Zed')
+        added = {'name': 'Mr. Poopybutthole', 'uuid': 'new'}
+        changes = [('update', renamed), ('add', added),
+                   ('delete', contacts[5])]
+        result = apply_changes(contacts, changes)
+        expected = sort_contacts(contacts[1:5] + contacts[6:]
+                                 + [renamed, added])
+        self.assertEqual(result, expected)
+
+    def test_order_by_tags(self):
+        """Test ordering by first tag puts untagged contacts last."""
+        self.run_subcommand('add', name='Zed', tags=['Work'])
+        self.run_subcommand('add', name='Alf', tags=['family', 'work'])
+        names = [self.data.contacts[i]['name']
+                 for i in self.data.order('tags')]
+        self.assertEqual(names[:2], ['Alf', 'Zed'])
+        self.assertEqual(len(names), 83)
+
+    def test_order_by_modified(self):
+        """Test ordering by most recently modified."""
+        log = ModifiedLog(modified_log_path(self.json_file))
+        log.touch([self.data.contacts[3]['uuid']], modified=1)
+        log.touch([self.data.contacts[7]['uuid']], modified=2)
+        indices = self.data.query('plumbus.com')
+        self.assertEqual(self.data.ordered(indices, 'modified')[:2], [7, 3])
+        self.run_subcommand('add', name='Mr. Poopybutthole')
+        first = self.data.order('modified')[0]
+        self.assertEqual(self.data.contacts[first]['name'],
+                         'Mr. Poopybutthole')
+
+
+if __name__ == '__main__':
+    unittest.main()
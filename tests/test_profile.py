@@ -0,0 +1,94 @@
+"""Tests for the profile module."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from pathlib import Path
+from shutil import copyfile
+
+from contacts import profile
+
+
+class TestProfile(unittest.TestCase):
+    """Test per-phase timing of commands"""
+
+    def tearDown(self):
+        profile.profiling = False
+        del profile.phases[:]
+
+    def test_requested(self):
+        """Test profiling is asked for by option or environment."""
+        value_options = ('-q', '--query_str', '--top', '--profile-dump')
+        self.assertEqual(profile.requested(['show'], environ={}),
+                         (False, None))
+        self.assertEqual(
+            profile.requested(['-q', 'rick', '--profile', 'show'],
+                              value_options, environ={}),
+            (True, None)
+        )
+        self.assertEqual(
+            profile.requested(['--profile-dump', 'out.prof', 'show'],
+                              value_options, environ={}),
+            (True, 'out.prof')
+        )
+        # Options of the subcommand are not looked at
+        self.assertEqual(
+            profile.requested(['add', '-n', '--profile'], environ={}),
+            (False, None)
+        )
+        self.assertEqual(
+            profile.requested(['show'], environ={'CONTACTS_PROFILE': '1'}),
+            (True, None)
+        )
+        self.assertEqual(
+            profile.requested(['show'], environ={'CONTACTS_PROFILE': '0'}),
+            (False, None)
+        )
+
+    def test_disabled_phase_records_nothing(self):
+        """Test phases cost nothing and record nothing when disabled."""
+        with profile.phase('load') as current:
+            current.records = 10
+        self.assertIs(profile.phase('query'), profile.null_phase)
+        self.assertIsNone(profile.null_phase.records)
+        self.assertEqual(profile.phases, [])
+
+    def test_enabled_phase(self):
+        """Test a phase records its time, records and memory."""
+        profile.profiling = True
+        with profile.phase('load') as current:
+            current.records = 10
+        recorded, = profile.phases
+        self.assertEqual(recorded['phase'], 'load')
+        self.assertEqual(recorded['records'], 10)
+        self.assertGreaterEqual(recorded['wall_s'], 0)
+        self.assertGreater(recorded['peak_rss_mb'], 0)
+
+    def test_command(self):
+        """Test a profiled command writes its phases as json to stderr."""
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, 'contacts').mkdir()
+            copyfile('tests/test_data/example_contacts.json',
+                     Path(directory, 'contacts', 'contacts.json'))
+            dump = Path(directory, 'contacts.prof')
+            env = dict(os.environ, XDG_CONFIG_HOME=directory)
+            process = subprocess.run(
+                [sys.executable, '-m', 'contacts', '--profile-dump', dump,
+                 '-q', 'rick', 'get_field', 'email'],
+                env=env, capture_output=True, text=True, check=True
+            )
+            report = json.loads(process.stderr.splitlines()[-1])
+            self.assertTrue(dump.exists())
+        names = [recorded['phase'] for recorded in report['phases']]
+        for name in ('cli', 'load', 'query'):
+            self.assertIn(name, names)
+        self.assertEqual(report['cache'], {'hits': 0, 'misses': 1})
+        self.assertEqual(report['profile_dump'], str(dump))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Tests for the query module."""
+
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.index import FieldIndex, TrigramIndex, scans_before_index
+from contacts.query import And, Not, Or, QueryError, is_structured, parse
+
+
+class TestParse(unittest.TestCase):
+    """Test parsing of the query language"""
+
+    def test_is_structured(self):
+        """Test plain substrings are not parsed as the query language."""
+        self.assertFalse(is_structured('Rick Sanchez'))
+        self.assertFalse(is_structured('plumbus.com'))
+        self.assertTrue(is_structured('name:rick'))
+        self.assertTrue(is_structured('rick OR morty'))
+        self.assertTrue(is_structured('-tag:archived'))
+
+    def test_parse(self):
+        """Test terms, operators and precedence."""
+        query = parse('name:smith* tag:=Work OR NOT (email:@acme.com -x)')
+        self.assertIsInstance(query, Or)
+        first, second = query.children
+        self.assertIsInstance(first, And)
+        self.assertEqual(repr(first.children[0]), "Term(name, prefix, 'smith')")
+        self.assertEqual(repr(first.children[1]), "Term(tags, exact, 'work')")
+        self.assertIsInstance(second, Not)
+        self.assertIsInstance(second.child.children[1], Not)
+
+    def test_phone_digits(self):
+        """Test phone numbers are compared by their digits only."""
+        term = parse('phone:="0700 793 7005"')
+        self.assertTrue(term.matches({'phone': ['07007937005']}))
+
+    def test_errors(self):
+        """Test malformed queries raise QueryError."""
+        for query in ('(name:rick', 'name:rick)', 'rick OR', 'name:',
+                      'phone:abc'):
+            with self.subTest(query=query):
+                with self.assertRaises(QueryError):
+                    parse(query)
+
+
+class TestQuery(unittest.TestCase):
+    """Test planned queries against the example dataset"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_query_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        # Index on first use, so that queries go through the indexes
+        for index in (TrigramIndex, FieldIndex):
+            patcher = patch.object(index, 'scans_before_build', 0)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.data = ContactManager(self.json_file)
+        for name, tags in (('Squanchy', ['work', 'friend']),
+                           ('Birdperson', ['friend']),
+                           ('Tammy', ['work', 'archived'])):
+            args = Namespace(name=name, email=[f'{name.lower()}@acme.com'],
+                             phone=None, tags=tags)
+            with patch('sys.stderr', new=StringIO()):
+                self.data.add(args=args)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def names(self, query):
+        data = ContactManager(self.json_file)
+        return [data.contacts[i]['name'] for i in data.query(query)]
+
+    def test_tags(self):
+        """Test tag terms match only the tags field."""
+        self.assertEqual(self.names('tag:work -tag:archived'), ['Squanchy'])
+        self.assertEqual(self.names('tag:friend email:@acme.com'),
+                         ['Birdperson', 'Squanchy'])
+        self.assertEqual(self.names('tag:=wor'), [])
+        self.assertEqual(self.names('tag:wor*'), ['Squanchy', 'Tammy'])
+
+    def test_matches_scan(self):
+        """Test planned queries give the same results as scanning."""
+        data = ContactManager(self.json_file)
+        for query in ('name:rick* OR name:morty', 'sanchez NOT name:rick',
+                      'email:plumbus phone:070', 'uuid:ca06',
+                      'NOT email:plumbus', '(tag:work OR rick) -tag:archived'):
+            with self.subTest(query=query):
+                parsed = parse(query)
+                expected = [
+                    i for i, contact in enumerate(data.contacts)
+                    if parsed.matches(contact)
+                ]
+                self.assertEqual(data.query(query), expected)
+
+    def test_field_index_updated(self):
+        """Test the field index follows changes made after it was opened,
+        in this manager and, through the index log, in the next.
+        """
+        data = ContactManager(self.json_file)
+        self.assertEqual(len(data.query('tag:work')), 2)
+        index = data.field_index
+        self.assertIsNotNone(index)
+        position = data.query('name:=tammy')[0]
+        with patch('sys.stderr', new=StringIO()):
+            data.remove(position)
+            self.assertEqual(len(data.query('tag:work')), 1)
+            data.overwrite()
+        self.assertIs(data.field_index, index)
+        self.assertEqual(len(data.query('tag:work')), 1)
+        with patch.object(FieldIndex, 'build') as build:
+            self.assertEqual(self.names('tag:work'), ['Squanchy'])
+            self.assertEqual(self.names('name:tam*'), [])
+        build.assert_not_called()
+
+    def test_resident(self):
+        """Test a manager kept in memory builds the indexes once it was
+        queried often enough, and keeps them up to date.
+        """
+        data = ContactManager(self.json_file)
+        with patch.object(TrigramIndex, 'scans_before_build',
+                          scans_before_index):
+            for query in range(scans_before_index):
+                self.assertEqual(len(data.query('sanchez')), 2)
+                self.assertIsNone(data._index)
+            self.assertEqual(len(data.query('sanchez')), 2)
+        self.assertIsNotNone(data.index)
+        with patch('sys.stderr', new=StringIO()):
+            data.insert({'name': 'Zorp Sanchez', 'email': [], 'phone': [],
+                         'uuid': 'zorp', 'tags': []})
+            data.overwrite()
+        self.assertIsNotNone(data.index)
+        self.assertEqual(len(data.query('sanchez')), 3)
+
+    def test_concurrent_write(self):
+        """Test indexes saved after a write are not tagged with the
+        fingerprint of a write another process made right after it.
+        """
+        data = ContactManager(self.json_file)
+        data.query('tag:work')
+        data.query('rick')
+        commit = data.storage.commit
+
+        def commit_then_other_write(contacts, changes):
+            stored = commit(contacts, changes)
+            other = ContactManager(self.json_file)
+            other.insert({'name': 'Zorblax', 'email': [], 'phone': [],
+                          'uuid': 'zorblax', 'tags': ['work']})
+            other.overwrite()
+            return stored
+
+        with patch('sys.stderr', new=StringIO()), \
+                patch.object(data.storage, 'commit',
+                             new=commit_then_other_write):
+            data.remove(data.query('name:=tammy')[0])
+            data.overwrite()
+        self.assertEqual(self.names('zorblax'), ['Zorblax'])
+        self.assertIn('Zorblax', self.names('tag:work'))
+
+    def test_invalid_query(self):
+        """Test an invalid query exits with a message."""
+        with patch('sys.stderr', new=StringIO()) as mock_stderr:
+            with self.assertRaises(SystemExit):
+                self.data.query('(name:rick')
+        self.assertIn('Invalid query', mock_stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""Tests for the record module."""
+
+import json
+import unittest
+
+from contacts.record import Contact, ContactTable, compact, pack_uuid
+from contacts.storage import encode_lines
+
+
+class TestRecord(unittest.TestCase):
+    """Test compact contact representations"""
+
+    def setUp(self):
+        """Read the example dataset, and add contacts with odd fields."""
+        with open('tests/test_data/example_contacts.json', 'r') as f:
+            self.contacts = json.load(f)
+        self.contacts += [
+            {'uuid': 'not-a-uuid', 'name': 'Squanchy', 'email': None,
+             'phone': None, 'tags': ['work', 'friend']},
+            {'name': 'Birdperson', 'email': ['bird@person.com'],
+             'uuid': '6d1b9e4c-0a8e-11eb-8000-000000000000'},
+        ]
+
+    def test_contact(self):
+        """Test records read and serialize like the dicts they came from."""
+        for contact in self.contacts:
+            record = Contact.from_dict(contact)
+            self.assertEqual(record, contact)
+            self.assertEqual(json.loads(json.dumps(record.to_dict())),
+                             contact)
+        record = Contact.from_dict(self.contacts[0])
+        self.assertEqual(len(record._uuid), 16)
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_compact(self):
+        """Test only dicts a record writes back the same are compacted."""
+        records = [compact(contact) for contact in self.contacts]
+        self.assertEqual(records, self.contacts)
+        self.assertEqual(encode_lines(records), encode_lines(self.contacts))
+        self.assertEqual(
+            [record['name'] for record in records
+             if not isinstance(record, Contact)],
+            ['Squanchy', 'Birdperson']
+        )
+        contact = self.contacts[0]
+        reordered = {'uuid': contact['uuid'], 'name': contact['name'],
+                     'email': [], 'phone': [], 'tags': []}
+        self.assertIs(compact(reordered), reordered)
+
+    def test_interned_tags(self):
+        """Test equal tags share a single string."""
+        first = Contact(name='a', tags=[''.join(['wo', 'rk'])])
+        second = Contact(name='b', tags=[''.join(['w', 'ork'])])
+        self.assertIs(first.tags[0], second.tags[0])
+
+    def test_pack_uuid(self):
+        """Test only canonical uuids are packed."""
+        uuid = self.contacts[0]['uuid']
+        self.assertEqual(len(pack_uuid(uuid)), 16)
+        self.assertEqual(pack_uuid(uuid.upper()), uuid.upper())
+        self.assertEqual(pack_uuid('not-a-uuid'), 'not-a-uuid')
+
+    def test_table(self):
+        """Test rows of a table decode to the dicts they were made from."""
+        table = ContactTable(self.contacts)
+        self.assertEqual(len(table), len(self.contacts))
+        self.assertEqual(list(table), self.contacts)
+        self.assertEqual(table[-1], self.contacts[-1])
+        self.assertEqual(table[1:3], self.contacts[1:3])
+        self.assertEqual(table.tags, ['work', 'friend'])
+        with self.assertRaises(IndexError):
+            table[len(self.contacts)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+"""Tests for the render module."""
+
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.render import cell, column_widths, render, sample_size
+
+
+class TestRender(unittest.TestCase):
+    """Test the streaming table renderer"""
+
+    def test_cell(self):
+        """Test field values are shortened for display."""
+        self.assertEqual(cell(None), '...')
+        self.assertEqual(cell([]), '...')
+        self.assertEqual(cell(['a@b.com']), 'a@b.com')
+        self.assertEqual(cell(['a@b.com', 'c@d.com']), 'a@b.com, ...')
+
+    def test_column_widths_capped(self):
+        """Test long values are cut to the maximum column width."""
+        rows = [('1', 'x' * 100, 'e', 'p')]
+        self.assertEqual(column_widths(rows), [1, 30, 5, 5])
+        lines = list(render(rows))
+        self.assertTrue(lines[2].endswith('x…  e      p'))
+
+    def test_render_is_lazy(self):
+        """Test only a bounded sample is consumed before the first line."""
+        consumed = []
+
+        def rows():
+            for n in range(10 * sample_size):
+                consumed.append(n)
+                yield (str(n), 'name', 'email', 'phone')
+
+        lines = render(rows())
+        next(lines)
+        self.assertEqual(len(consumed), sample_size)
+
+
+class TestShow(unittest.TestCase):
+    """Test the show subcommand"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_render_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.data = ContactManager(self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def show(self, indices, **kwargs):
+        args = Namespace(color=False, limit=None, offset=0, pager=False,
+                         tabulate=False, term_lines=100)
+        vars(args).update(kwargs)
+        with patch('sys.stdout', new=StringIO()) as mock_stdout:
+            self.data.show(indices, args)
+        return mock_stdout.getvalue().splitlines()
+
+    def test_show_page(self):
+        """Test limit and offset select the rows shown."""
+        lines = self.show(self.data.query(None), limit=2, offset=56)
+        self.assertEqual(len(lines), 6)
+        self.assertIn('Rick Sanchez', lines[2])
+        self.assertTrue(lines[2].startswith('56  '))
+        self.assertEqual(lines[-1], '81 contacts, showing 57-58')
+
+    def test_show_fits_terminal(self):
+        """Test output is cut to the terminal height by default."""
+        lines = self.show(self.data.query(None), term_lines=20)
+        self.assertEqual(len(lines), 2 + 15 + 2)
+        self.assertEqual(lines[-1], '81 contacts, showing 1-15')
+
+    def test_show_all_matches(self):
+        """Test every match is shown when they fit."""
+        lines = self.show(self.data.query('Rick'))
+        self.assertEqual(len(lines), 2 + 7 + 2)
+        self.assertEqual(lines[-1], '7 contacts')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""Tests for the server module."""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.record import Contact
+from contacts.server import ContactServer, request
+from contacts.storage import read_json
+
+
+class TestContactServer(unittest.TestCase):
+    """Test answering contacts requests from a resident ContactManager"""
+
+    def setUp(self):
+        """Set up a server for a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_server_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.socket_path = Path(self.tmpdir.name, 'contacts.sock')
+        self.server = ContactServer(
+            ContactManager(self.json_file), self.socket_path
+        )
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+        self.tmpdir.cleanup()
+
+    def args(self, subcommand, query_str=None, **kwargs):
+        return Namespace(subcommand=subcommand, query_str=query_str, **kwargs)
+
+    def test_handle_get_field(self):
+        """Test a request gives the same output as a direct call."""
+        response = self.server.handle(vars(self.args(
+            'get_field', 'Sanchez', fieldname='email'
+        )))
+        self.assertEqual(response['status'], 0)
+        self.assertEqual(
+            response['stdout'],
+            'diane.sanchez@plumbus.com\nrick.sanchez@plumbus.com\n'
+        )
+
+    def test_handle_refresh(self):
+        """Test the server reloads contacts written by another process."""
+        other = ContactManager(self.json_file)
+        with patch('sys.stderr', new=StringIO()):
+            other.add(args=Namespace(name='Birdperson', email=None,
+                                     phone=None, tags=None))
+        response = self.server.handle(vars(self.args(
+            'get_field', 'Birdperson', fieldname='name'
+        )))
+        self.assertEqual(response['stdout'], 'Birdperson\n')
+
+    def test_handle_records(self):
+        """Test the resident contacts are held as records, and are shown,
+        exported and written as the dicts they were loaded as.
+        """
+        direct = ContactManager(self.json_file)
+        expected = [json.dumps(contact) + '\n' for contact in direct.contacts]
+        response = self.server.handle(vars(self.args(
+            'export', format='ndjson'
+        )))
+        self.assertEqual(response['stdout'], ''.join(expected))
+        contacts = self.server.contact_manager.contacts
+        self.assertTrue(all(isinstance(contact, Contact)
+                            for contact in contacts))
+
+        response = self.server.handle(vars(self.args(
+            'modify', 'name:="Rick Sanchez"', name=None, email=None,
+            phone=None, tags=['pickle']
+        )))
+        self.assertEqual(response['status'], 0)
+        self.assertIn("{'name': 'Rick Sanchez'", response['stderr'])
+        self.assertIs(self.server.contact_manager.contacts, contacts)
+        self.assertEqual(
+            [contact['name'] for contact in contacts
+             if not isinstance(contact, Contact)],
+            ['Rick Sanchez']
+        )
+        self.assertEqual(read_json(self.json_file), contacts)
+        self.assertEqual(ContactManager(self.json_file).contacts, contacts)
+
+    def test_handle_rejects_interactive(self):
+        """Test subcommands needing a terminal are refused."""
+        response = self.server.handle(vars(self.args('delete')))
+        self.assertEqual(response['status'], 1)
+        self.assertIn('cannot be run by the server', response['stderr'])
+
+    def test_request(self):
+        """Test a round trip over the unix socket."""
+        self.assertIsNone(request(self.socket_path, self.args('export')))
+
+        loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def run():
+            server = await self.server.start()
+            started.set()
+            async with server:
+                try:
+                    await server.serve_forever()
+                except asyncio.CancelledError:
+                    pass
+
+        task = loop.create_task(run())
+        thread = threading.Thread(target=loop.run_until_complete, args=(task,))
+        thread.start()
+        try:
+            started.wait(5)
+            response = request(
+                self.socket_path, self.args('export', 'Morty Smith')
+            )
+        finally:
+            loop.call_soon_threadsafe(task.cancel)
+            thread.join()
+            loop.close()
+        self.assertEqual(response['status'], 0)
+        exported = json.loads(response['stdout'])
+        self.assertEqual([c['name'] for c in exported], ['Morty Smith'])
+
+
+if __name__ == '__main__':
+    unittest.main()
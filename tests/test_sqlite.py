@@ -0,0 +1,160 @@
+"""Tests for the sqlite module."""
+
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.batch import Batch
+from contacts.conf import config
+from contacts.contacts import ContactManager
+from contacts.index import scans_before_index
+from contacts.sqlite import SQLiteStorage
+from contacts.storage import JSONStorage
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    """Test the SQLite storage backend"""
+
+    def setUp(self):
+        """Migrate a copy of the example dataset into a database."""
+        self.json_file = Path('tests/test_data/test_sqlite_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.json_contacts = JSONStorage(self.json_file).load()
+        data = ContactManager(self.json_file)
+        with patch('sys.stderr', new=StringIO()):
+            data.migrate(args=Namespace(to='sqlite'))
+        self.storage = SQLiteStorage(self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset, database and anything else written."""
+        for pattern in (f'{self.json_file.name}*',
+                        f'{self.json_file.stem}.db*'):
+            for path in self.json_file.parent.glob(pattern):
+                os.remove(path)
+
+    def manager(self):
+        return ContactManager(self.json_file, SQLiteStorage(self.json_file))
+
+    def test_migrate(self):
+        """Test every contact is migrated in the same order."""
+        self.assertEqual(self.storage.load(), self.json_contacts)
+
+    def test_query_loads_matches_only(self):
+        """Test a query only loads contacts found by full text search."""
+        data = self.manager()
+        indices = data.query('sanchez')
+        self.assertEqual(
+            [c['name'] for c in data.list_matches(indices)],
+            ['Diane Sanchez', 'Rick Sanchez']
+        )
+        self.assertEqual(len(data.contacts), 2)
+
+    def test_short_query(self):
+        """Test queries too short for full text search still match."""
+        data = self.manager()
+        json_data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        self.assertEqual(
+            data.list_matches(data.query('ri')),
+            json_data.list_matches(json_data.query('ri'))
+        )
+
+    def test_per_row_changes(self):
+        """Test add, modify and delete update single rows."""
+        data = self.manager()
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Birdperson', email=None,
+                                    phone=['07700900123'], tags=['friend']))
+        data = self.manager()
+        indices = data.query('morty smith')
+        with patch('sys.stderr', new=StringIO()):
+            data.modify(indices=indices, args=Namespace(
+                name=None, email=['morty@plumbus.com'], phone=None, tags=None
+            ))
+
+        contacts = self.storage.load()
+        self.assertEqual(len(contacts), 82)
+        self.assertIn('Birdperson', [c['name'] for c in contacts])
+        morty = next(c for c in contacts if c['name'] == 'Morty Smith')
+        self.assertEqual(morty['email'], ['morty@plumbus.com'])
+        self.assertEqual(len(self.manager().query('morty.smith@')), 0)
+
+        data = self.manager()
+        data.remove(data.query('birdperson')[0])
+        with patch('sys.stderr', new=StringIO()):
+            data.overwrite()
+        self.assertEqual(len(self.storage.load()), 81)
+        tags = self.storage.connection.execute('SELECT tag FROM tags')
+        self.assertEqual(tags.fetchall(), [])
+
+    def test_field_query(self):
+        """Test field terms are answered from the side tables, loading
+        only the contacts matching.
+        """
+        json_data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        for query in ('name:rick*', 'email:=RICK.SANCHEZ@plumbus.com',
+                      'phone:0765', 'name:sanchez email:plumbus',
+                      'uuid:ca064182*'):
+            with self.subTest(query=query):
+                data = self.manager()
+                matches = data.list_matches(data.query(query))
+                self.assertEqual(
+                    matches, json_data.list_matches(json_data.query(query))
+                )
+                self.assertEqual(len(data.contacts), len(matches))
+
+    def test_field_query_after_change(self):
+        """Test field terms find contacts changed since they were loaded."""
+        data = self.manager()
+        data.contacts
+        data.insert({'name': 'Zzz New', 'email': [], 'phone': [],
+                     'uuid': 'zzz', 'tags': ['fresh']})
+        self.assertEqual(
+            [c['name'] for c in data.list_matches(data.query('tag:=fresh'))],
+            ['Zzz New']
+        )
+
+    def test_batch(self):
+        """Test a batch finds the contacts it added, from indexes built in
+        memory once queries were scanned often enough.
+        """
+        data = self.manager()
+        batch = Batch(data)
+        for i in range(scans_before_index + 2):
+            uuid = batch.add({'name': f'Zzz New {i}', 'tags': [f'fresh{i}']})
+            self.assertEqual(
+                batch.apply({'op': 'modify', 'query': f'tag:=fresh{i}',
+                             'email': ['new@zzz.com']}),
+                {'uuids': [uuid]}
+            )
+        self.assertIsNotNone(data._field_index)
+        self.assertEqual(batch.scans, scans_before_index)
+
+    def test_lookup(self):
+        """Test owners are found in the side tables without loading every
+        contact.
+        """
+        data = self.manager()
+        owners = data.owners('email', ' Rick.Sanchez@plumbus.com')
+        self.assertEqual([c['name'] for c in owners], ['Rick Sanchez'])
+        owners = data.owners('phone', '07655 266089')
+        self.assertEqual([c['name'] for c in owners], ['Rick Sanchez'])
+        self.assertIsNone(data._contacts)
+
+    def test_normalization_changed(self):
+        """Test the side tables are refilled when phone numbers are
+        normalized differently.
+        """
+        settings = dict(config.settings, country_code='44')
+        with patch.object(config, '_settings', settings):
+            data = self.manager()
+            owners = data.owners('phone', '+44 7655 266089')
+            self.assertEqual([c['name'] for c in owners], ['Rick Sanchez'])
+
+
+if __name__ == '__main__':
+    unittest.main()
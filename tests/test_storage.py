@@ -0,0 +1,279 @@
+"""Tests for the storage module."""
+
+import json
+import os
+import unittest
+
+from argparse import Namespace
+from unittest.mock import patch
+from shutil import copyfile
+from io import StringIO
+from pathlib import Path
+
+from contacts.contacts import ContactManager
+from contacts.storage import (
+    JSONStorage, JournalStorage, atomic_write, encode_lines, locked,
+    read_json, scan_json
+)
+
+
+class TestJournalStorage(unittest.TestCase):
+    """Test the snapshot plus journal storage backend"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_storage_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.storage = JournalStorage(self.json_file)
+        with open(self.json_file, 'r') as f:
+            self.snapshot = f.read()
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def manager(self):
+        return ContactManager(self.json_file, storage=self.storage)
+
+    def test_add_appends_to_journal(self):
+        """Test adding a contact leaves the snapshot untouched."""
+        data = self.manager()
+        args = Namespace(name='Mr. Poopybutthole', email=None, phone=None,
+                         tags=None)
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=args)
+
+        with open(self.json_file, 'r') as f:
+            self.assertEqual(f.read(), self.snapshot)
+        records = list(self.storage.read_journal())
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['op'], 'add')
+
+        reloaded = self.manager()
+        self.assertEqual(reloaded.contacts, data.contacts)
+
+    def test_commit_only_appends(self):
+        """Test a commit writes nothing but the journal, and the cached
+        snapshot is still used once the journal is replayed on it.
+        """
+        from contacts.cache import stats
+
+        data = self.manager()
+        data.query('rick')
+        written = {path: path.read_bytes() for path in
+                   self.json_file.parent.glob(f'{self.json_file.name}*')}
+        with patch('sys.stderr', new=StringIO()):
+            data.remove(0)
+            data.overwrite()
+        for path, content in written.items():
+            self.assertEqual(path.read_bytes(), content, path)
+
+        hits = stats['hits']
+        reloaded = JournalStorage(self.json_file).load()
+        self.assertEqual(stats['hits'], hits + 1)
+        self.assertEqual(reloaded, data.contacts)
+
+    def test_replay_tombstone(self):
+        """Test delete records remove contacts when replayed."""
+        data = self.manager()
+        with patch('sys.stderr', new=StringIO()):
+            data.remove(0)
+            data.overwrite()
+        reloaded = self.manager()
+        self.assertEqual(reloaded.contacts, data.contacts)
+        self.assertEqual(len(reloaded.contacts), 80)
+
+    def test_truncated_record_ignored(self):
+        """Test a partially written final record is skipped."""
+        with open(self.storage.journal_path, 'w+') as f:
+            f.write('{"op": "delete", "uu')
+        self.assertEqual(len(self.storage.load()), 81)
+
+    def test_compact(self):
+        """Test compaction folds the journal into the snapshot."""
+        data = self.manager()
+        with patch('sys.stderr', new=StringIO()):
+            data.remove(0)
+            data.overwrite()
+            data.compact()
+        self.assertFalse(self.storage.journal_path.exists())
+        with open(self.json_file, 'r') as f:
+            self.assertEqual(json.load(f), data.contacts)
+
+    def test_automatic_compaction(self):
+        """Test the journal is compacted once it passes its size limit."""
+        self.storage.max_journal_bytes = 0
+        data = self.manager()
+        with patch('sys.stderr', new=StringIO()):
+            data.remove(0)
+            data.overwrite()
+        self.assertFalse(self.storage.journal_path.exists())
+        self.assertEqual(len(self.storage.load()), 80)
+
+
+class TestJSONStorage(unittest.TestCase):
+    """Test atomic, locked writes to the json storage backend"""
+
+    def setUp(self):
+        """Set up for testing with a copy of the example dataset."""
+        self.json_file = Path('tests/test_data/test_storage_contacts.json')
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def add(self, data, name):
+        args = Namespace(name=name, email=None, phone=None, tags=None)
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=args)
+
+    def test_concurrent_writers(self):
+        """Test a write is not lost when another process wrote first."""
+        first = ContactManager(self.json_file, JSONStorage(self.json_file))
+        second = ContactManager(self.json_file, JSONStorage(self.json_file))
+        self.add(first, 'Mr. Poopybutthole')
+        self.add(second, 'Birdperson')
+
+        names = {c['name'] for c in JSONStorage(self.json_file).load()}
+        self.assertIn('Mr. Poopybutthole', names)
+        self.assertIn('Birdperson', names)
+        self.assertEqual(len(second.contacts), 83)
+        self.assertEqual(len(second.query('Poopybutthole')), 1)
+
+    def test_atomic_write_failure(self):
+        """Test a failed write leaves the original file in place."""
+        with open(self.json_file, 'r') as f:
+            original = f.read()
+
+        def fail(f):
+            f.write('[')
+            raise ValueError
+
+        with self.assertRaises(ValueError):
+            atomic_write(self.json_file, fail)
+        with open(self.json_file, 'r') as f:
+            self.assertEqual(f.read(), original)
+        leftovers = list(self.json_file.parent.glob('.*.tmp'))
+        self.assertEqual(leftovers, [])
+
+    def test_lock_timeout(self):
+        """Test waiting for a held exclusive lock is bounded."""
+        lock_path = f'{self.json_file}.lock'
+        with locked(lock_path):
+            with self.assertRaises(TimeoutError):
+                with locked(lock_path, shared=True, timeout=0.05):
+                    pass
+        with locked(lock_path, shared=True):
+            with locked(lock_path, shared=True, timeout=0.05):
+                pass
+
+
+class TestScan(unittest.TestCase):
+    """Test queries answered by scanning the line-delimited stored file"""
+
+    def setUp(self):
+        """Set up for testing with a line-delimited copy of the example
+        dataset.
+        """
+        self.json_file = Path('tests/test_data/test_scan_contacts.json')
+        self.contacts = read_json('tests/test_data/example_contacts.json')
+        with open(self.json_file, 'w') as f:
+            f.write(encode_lines(self.contacts))
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def test_encode_lines(self):
+        """Test each record is written on its own line as json.dumps
+        would write it.
+        """
+        with open(self.json_file, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(len(lines), len(self.contacts) + 2)
+        self.assertEqual(json.loads(lines[1].rstrip(',')), self.contacts[0])
+        self.assertEqual(lines[1].rstrip(','), json.dumps(self.contacts[0]))
+        self.assertEqual(read_json(self.json_file), self.contacts)
+        self.assertEqual(json.loads(encode_lines([])), [])
+
+    def test_scan(self):
+        """Test a scan finds the same contacts as loading everything."""
+        data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        self.assertIsNotNone(scan_json(self.json_file, 'rick'))
+        for query in ('rick', 'SMITH', 'plumbus', '@', 'zzzz'):
+            with self.subTest(query=query):
+                found = scan_json(self.json_file, query.lower())
+                partial = ContactManager(self.json_file,
+                                         JSONStorage(self.json_file))
+                indices = partial.query(query, partial=True)
+                self.assertEqual(partial.partial, found is not None)
+                if found is not None:
+                    self.assertEqual(len(partial.contacts), len(found))
+                self.assertEqual(
+                    partial.list_matches(indices),
+                    data.list_matches(data.query(query))
+                )
+
+    def test_common_query(self):
+        """Test queries found in most records, like field names, are not
+        answered by a scan.
+        """
+        self.assertIsNone(
+            scan_json(self.json_file, 'email', chunk_size=1024)
+        )
+        self.assertIsNotNone(
+            scan_json(self.json_file, 'rick', chunk_size=1024)
+        )
+
+    def test_escaped_characters(self):
+        """Test characters escaped in json are still found."""
+        with open(self.json_file, 'w') as f:
+            f.write(encode_lines([
+                {'name': '\u212aelvin', 'uuid': '1'},
+                {'name': 'Zo\u00eb', 'uuid': '2'},
+            ]))
+        self.assertEqual(len(scan_json(self.json_file, 'kelvin')), 1)
+        self.assertIsNone(scan_json(self.json_file, 'zo\u00eb'))
+        self.assertIsNone(scan_json(self.json_file, 'a, b'))
+
+    def test_other_layouts(self):
+        """Test files not written by encode_lines are not scanned."""
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        self.assertIsNone(scan_json(self.json_file, 'rick'))
+        with open(self.json_file, 'w') as f:
+            json.dump(self.contacts, f, indent=2)
+        self.assertIsNone(scan_json(self.json_file, 'rick'))
+
+    def test_journal_not_scanned(self):
+        """Test changes waiting in the journal disable the scan."""
+        storage = JournalStorage(self.json_file)
+        self.assertIsNotNone(storage.scan('rick'))
+        data = ContactManager(self.json_file, storage)
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Rick Two', email=None,
+                                    phone=None, tags=None))
+        self.assertIsNone(JournalStorage(self.json_file).scan('rick'))
+
+    def test_partial_not_written(self):
+        """Test a partially loaded contacts list cannot be written."""
+        data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        data.query('rick', partial=True)
+        with self.assertRaises(RuntimeError):
+            data.overwrite()
+
+    def test_written_line_delimited(self):
+        """Test writes keep the layout scans need."""
+        copyfile('tests/test_data/example_contacts.json', self.json_file)
+        data = ContactManager(self.json_file, JSONStorage(self.json_file))
+        with patch('sys.stderr', new=StringIO()):
+            data.add(args=Namespace(name='Rick Two', email=None,
+                                    phone=None, tags=None))
+        self.assertEqual(len(scan_json(self.json_file, 'rick two')), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,185 @@
+"""Tests for the sync module."""
+
+import json
+import os
+import socket
+import unittest
+
+from argparse import Namespace
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
+from contacts.contacts import ContactManager
+from contacts.storage import encode_lines, read_json
+from contacts.syncserver import SyncServer, running
+
+
+class TestSync(unittest.TestCase):
+    """Test exchanging only changed contacts with the stand-in server"""
+
+    def setUp(self):
+        """Set up for testing with a line-delimited copy of the example
+        dataset and an empty server.
+        """
+        self.json_file = Path('tests/test_data/test_sync_contacts.json')
+        self.contacts = read_json('tests/test_data/example_contacts.json')
+        with open(self.json_file, 'w') as f:
+            f.write(encode_lines(self.contacts))
+        self.backup = f'{self.json_file}.deleted.ndjson'
+        self.server = SyncServer()
+        serving = running(self.server)
+        self.url = serving.__enter__()
+        self.addCleanup(serving.__exit__, None, None, None)
+
+    def tearDown(self):
+        """Remove the copied dataset and anything written next to it."""
+        for path in self.json_file.parent.glob(f'{self.json_file.name}*'):
+            os.remove(path)
+
+    def sync(self, prefer='server', url=None, status=None):
+        """Sync the book, returning the number of requests the server
+        answered and the calls to the storage's commit
+        """
+        data = ContactManager(self.json_file)
+        args = Namespace(url=url or self.url, prefer=prefer, full=False,
+                         connections=2, depth=4, backup=self.backup)
+        requests = self.server.requests
+        with patch('sys.stderr', new=StringIO()), \
+                patch.object(data.storage, 'commit',
+                             wraps=data.storage.commit) as commit:
+            try:
+                data.sync(args=args)
+            except SystemExit as exit:
+                self.assertEqual(exit.code, status)
+            else:
+                self.assertIsNone(status)
+        return self.server.requests - requests, commit.call_args_list
+
+    def stored(self):
+        """Return the contacts of the book and of the server by uuid"""
+        local = {contact['uuid']: contact
+                 for contact in ContactManager(self.json_file).contacts}
+        remote = {contact['uuid']: contact
+                  for contact in self.server.contacts()}
+        return local, remote
+
+    def change(self, changes):
+        """Change contacts of the book, mapping uuids to their new fields
+        or to None to delete them
+        """
+        data = ContactManager(self.json_file)
+        with patch('sys.stderr', new=StringIO()):
+            for uuid, fields in changes.items():
+                index = data.positions()[uuid]
+                if fields is None:
+                    data.remove(index)
+                else:
+                    data.replace(index, dict(data.contacts[index], **fields))
+            data.overwrite()
+
+    def change_server(self, uuid, **fields):
+        contact = json.loads(self.server.records[uuid][1])
+        self.server.store(uuid, json.dumps(dict(contact, **fields)).encode())
+
+    def test_first_sync(self):
+        """Test the book is sent once, then nothing is exchanged."""
+        requests, commits = self.sync()
+        self.assertEqual(requests, 1 + len(self.contacts))
+        self.assertEqual(commits, [])
+        local, remote = self.stored()
+        self.assertEqual(local, remote)
+        self.assertEqual(self.sync(), (1, []))
+
+    def test_changes(self):
+        """Test only changed contacts are sent and fetched."""
+        self.sync()
+        uuids = [contact['uuid'] for contact in self.contacts]
+        self.change({uuids[0]: {'tags': ['synced']}, uuids[1]: None})
+        self.change_server(uuids[2], name='Changed On Server')
+        self.server.remove(uuids[3])
+        self.server.store('new-uuid', json.dumps({
+            'name': 'Birdperson', 'email': [], 'phone': [], 'tags': ['bird'],
+        }).encode())
+        requests, commits = self.sync()
+        # A report, two sent and two fetched
+        self.assertEqual(requests, 5)
+        call, = commits
+        self.assertEqual(sorted(op for op, contact in call.args[1]),
+                         ['add', 'delete', 'update'])
+        local, remote = self.stored()
+        self.assertEqual(local, remote)
+        self.assertEqual(local[uuids[0]]['tags'], ['synced'])
+        self.assertEqual(local[uuids[2]]['name'], 'Changed On Server')
+        self.assertEqual(local['new-uuid']['name'], 'Birdperson')
+        self.assertNotIn(uuids[1], remote)
+        self.assertNotIn(uuids[3], local)
+        with open(self.backup) as f:
+            self.assertEqual(json.loads(f.read())['uuid'], uuids[3])
+        self.assertEqual(self.sync(), (1, []))
+
+    def test_conflicts(self):
+        """Test contacts changed on both sides are taken from one."""
+        self.sync()
+        uuid = self.contacts[0]['uuid']
+        for prefer, expected in [('server', 'Server'), ('local', 'Local')]:
+            with self.subTest(prefer=prefer):
+                self.change({uuid: {'name': 'Local'}})
+                self.change_server(uuid, name='Server')
+                self.sync(prefer)
+                local, remote = self.stored()
+                self.assertEqual(local, remote)
+                self.assertEqual(local[uuid]['name'], expected)
+
+    def test_expired_token(self):
+        """Test every contact is listed once the token is forgotten."""
+        self.sync()
+        uuid = self.contacts[0]['uuid']
+        self.server.remove(uuid)
+        self.server.expire_tokens()
+        requests, commits = self.sync()
+        self.assertEqual(requests, 2)
+        local, remote = self.stored()
+        self.assertEqual(local, remote)
+        self.assertNotIn(uuid, local)
+
+    def test_failed_push(self):
+        """Test contacts fetched by a sync which fails are fetched again."""
+        self.sync()
+        uuids = [contact['uuid'] for contact in self.contacts]
+        self.change({uuids[0]: {'tags': ['synced']}})
+        self.change_server(uuids[1], name='Changed On Server')
+        self.server.remove(uuids[2])
+        handle = self.server.handle
+
+        def failing(method, target, headers, body):
+            if method == 'PUT':
+                return 500, {}, b''
+            return handle(method, target, headers, body)
+
+        with patch.object(self.server, 'handle', new=failing):
+            requests, commits = self.sync(status=1)
+        self.assertEqual(commits, [])
+        self.sync()
+        local, remote = self.stored()
+        self.assertEqual(local, remote)
+        self.assertEqual(local[uuids[0]]['tags'], ['synced'])
+        self.assertEqual(local[uuids[1]]['name'], 'Changed On Server')
+        self.assertNotIn(uuids[2], local)
+
+    def test_unreachable(self):
+        """Test nothing is changed if the server cannot be reached."""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        with open(self.json_file, 'rb') as f:
+            stored = f.read()
+        requests, commits = self.sync(url=f'http://127.0.0.1:{port}/',
+                                      status=1)
+        self.assertEqual(commits, [])
+        with open(self.json_file, 'rb') as f:
+            self.assertEqual(f.read(), stored)
+
+
+if __name__ == '__main__':
+    unittest.main()